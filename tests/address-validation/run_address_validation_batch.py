@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+import argparse
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from usps_client.addresses import ADDRESS_PATH, AddressValidator, build_address_cache  # noqa: E402
+from usps_client.auth import get_token_provider  # noqa: E402
+from usps_client.batch import describe_error, read_rows, row_reference, run_items  # noqa: E402
+from usps_client.cache import INELIGIBLE_STATUSES  # noqa: E402
+from usps_client.concurrency import DEFAULT_MAX_LIMIT, ConcurrencyLimits  # noqa: E402
+from usps_client.config import load_env, parse_int, resolve_base_url  # noqa: E402
+from usps_client.jobs import build_job_queue  # noqa: E402
+from usps_client.metrics import get_metrics  # noqa: E402
+from usps_client.ratelimit import configure_rate_limiter  # noqa: E402
+from usps_client.retry import get_retry_engine  # noqa: E402
+from usps_client.sink import open_sink  # noqa: E402
+from usps_client.transport import DEFAULT_POOL_SIZE, configure_transport  # noqa: E402
+
+FLOW = "address-validation"
+OUTPUT_DIR = Path(__file__).resolve().parent / "output"
+DEFAULT_RESULTS_PATH = OUTPUT_DIR / "address-validation-batch.jsonl"
+SUMMARY_PATH = OUTPUT_DIR / "address-validation-batch-summary.json"
+REQUIRED_ENV_KEYS = ["USPS_CLIENT_ID", "USPS_CLIENT_SECRET"]
+DEFAULT_CONCURRENCY = 8
+DEFAULT_CHUNK_SIZE = 500
+# (line, row) pairs validated together by one validate_many call
+Chunk = List[Tuple[int, Dict[str, str]]]
+
+
+def parse_args(argv: Optional[List[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Validate many addresses against addresses/v3/address. Rows carry streetAddress, secondaryAddress, city, "
+        "state and ZIPCode (or USPS_ADDR_STREET, USPS_ADDR_SECONDARY, USPS_ADDR_CITY, USPS_ADDR_STATE, USPS_ADDR_ZIP). "
+        "Addresses are normalized first, so repeats and spelling variants are looked up once."
+    )
+    parser.add_argument("--input", required=True, help="CSV (with header row) or JSONL file of addresses")
+    parser.add_argument("--output", default=str(DEFAULT_RESULTS_PATH), help="JSONL file receiving one result per address")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=None,
+        help=f"Rows deduped and validated together (default USPS_ADDRESS_CHUNK_SIZE or {DEFAULT_CHUNK_SIZE})",
+    )
+    parser.add_argument("--concurrency", type=int, default=None, help="Maximum in-flight requests (default USPS_CONCURRENCY or 8)")
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Tune in-flight requests with AIMD on latency, timeouts and 429s, starting from --concurrency",
+    )
+    parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_LIMIT, help="Upper bound for --adaptive")
+    parser.add_argument(
+        "--queue",
+        default=None,
+        help="SQLite job queue that makes the run resumable after a crash (default USPS_JOB_QUEUE; off when neither is set)",
+    )
+    parser.add_argument("--run-id", default=None, help="Queue run to create or resume (default: derived from the input file's path, size and mtime)")
+    parser.add_argument("--retry-dead", action="store_true", help="Requeue the run's dead-lettered jobs before processing")
+    return parser.parse_args(argv)
+
+
+def row_chunks(rows: Iterable[Dict[str, str]], size: int) -> Iterator[Chunk]:
+    """Numbered rows (from 1) in lists of up to ``size``, read lazily."""
+    numbered = enumerate(rows, 1)
+    while True:
+        chunk = list(itertools.islice(numbered, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def write_summary(summary: Dict[str, Any]) -> None:
+    SUMMARY_PATH.parent.mkdir(parents=True, exist_ok=True)
+    SUMMARY_PATH.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    env_file = os.environ.get("ENV_FILE", ".env.local")
+    summary: Dict[str, Any] = {
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "envFile": env_file,
+        "input": args.input,
+        "output": args.output,
+        "baseUrl": None,
+        "concurrency": None,
+        "chunkSize": None,
+        "total": 0,
+        "succeeded": 0,
+        "failed": 0,
+        "valid": 0,
+        "invalid": 0,
+        "elapsedSeconds": None,
+        "errors": [],
+    }
+
+    try:
+        env = load_env(env_file)
+    except OSError as exc:
+        summary["errors"].append(f"Failed to read env file: {exc}")
+        write_summary(summary)
+        return 1
+
+    missing = [key for key in REQUIRED_ENV_KEYS if not env.get(key)]
+    if missing:
+        summary["errors"].append(f"Missing required env values: {', '.join(missing)}")
+        write_summary(summary)
+        return 1
+
+    base_url = resolve_base_url(env)
+    if not base_url:
+        summary["errors"].append("Could not determine USPS API base URL from env")
+        write_summary(summary)
+        return 1
+    summary["baseUrl"] = base_url
+
+    concurrency = args.concurrency or parse_int(env.get("USPS_CONCURRENCY")) or DEFAULT_CONCURRENCY
+    summary["concurrency"] = concurrency
+    chunk_size = max(1, args.chunk_size or parse_int(env.get("USPS_ADDRESS_CHUNK_SIZE")) or DEFAULT_CHUNK_SIZE)
+    summary["chunkSize"] = chunk_size
+    limits = ConcurrencyLimits(initial=concurrency, maximum=max(concurrency, args.max_concurrency)) if args.adaptive else None
+    configure_transport(pool_size=max(limits.maximum if limits else concurrency, DEFAULT_POOL_SIZE))
+    rate_limiter = configure_rate_limiter(env)
+    token_provider = get_token_provider(
+        base_url,
+        env["USPS_CLIENT_ID"],
+        env["USPS_CLIENT_SECRET"],
+        cache_path=env.get("USPS_TOKEN_CACHE"),
+    )
+
+    try:
+        address_cache = build_address_cache(env)
+    except (OSError, sqlite3.Error) as exc:
+        summary["errors"].append(f"Failed to open address cache: {exc}")
+        write_summary(summary)
+        return 1
+    if address_cache is not None:
+        address_cache.purge()
+    validator = AddressValidator(base_url, token_provider.get_token, cache=address_cache)
+    controller = limits.controller(validator.url) if limits else None
+
+    def validate(item: Tuple[int, Chunk]) -> List[Dict[str, Any]]:
+        _, chunk = item
+        # Each chunk is deduped up front and its distinct misses fanned out; repeats across chunks hit the cache.
+        # With a queue, a chunk with a failed lookup is retried (its answered rows come back from the cache).
+        rows = [row for _, row in chunk]
+        return validator.validate_many(rows, concurrency, controller=controller, raise_transient=queue is not None)
+
+    try:
+        queue = build_job_queue(env, FLOW, args.input, args.queue, args.run_id)
+    except (OSError, sqlite3.Error) as exc:
+        summary["errors"].append(f"Failed to open job queue: {exc}")
+        write_summary(summary)
+        return 1
+    if queue is not None and args.retry_dead:
+        summary["requeuedDead"] = queue.requeue_dead()
+
+    started = time.monotonic()
+    try:
+        with open_sink(Path(args.output), env, append=queue is not None and queue.resumed) as writer:
+            # One chunk at a time: validate_many already keeps `concurrency` lookups in flight.
+            for (_, chunk), outcome, dead_lettered in run_items(
+                enumerate(row_chunks(read_rows(args.input), chunk_size), 1),
+                validate,
+                1,
+                queue=queue,
+            ):
+                if isinstance(outcome, BaseException):
+                    error = dict(describe_error(outcome), valid=False)
+                    if dead_lettered:
+                        error["deadLettered"] = True
+                    results = [error] * len(chunk)
+                else:
+                    results = outcome
+                for (index, row), result in zip(chunk, results):
+                    record: Dict[str, Any] = {"line": index, "reference": row_reference(row, index), **result}
+                    # An address USPS could not match is an answer, not a failed call.
+                    if result.get("status") == 200 or result.get("status") in INELIGIBLE_STATUSES:
+                        summary["succeeded"] += 1
+                        summary["valid" if result["valid"] else "invalid"] += 1
+                    else:
+                        summary["failed"] += 1
+                    summary["total"] += 1
+                    writer.write(record)
+        summary["outputSegments"] = [str(segment) for segment in writer.segments]
+    except (OSError, ValueError) as exc:
+        summary["errors"].append(f"Failed to process input: {exc}")
+
+    summary["elapsedSeconds"] = round(time.monotonic() - started, 3)
+    if limits is not None:
+        summary["concurrencyLimits"] = limits.report()
+    summary["latency"] = get_metrics().report()
+    summary["circuitBreakers"] = get_retry_engine().breaker_states()
+    summary["rateLimitWaitSeconds"] = {name: round(waited, 3) for name, waited in rate_limiter.waited.items()}
+    summary["addressLookups"] = {"endpoint": ADDRESS_PATH, **validator.report()}
+    if queue is not None:
+        summary["jobQueue"] = queue.report()
+        queue.close()
+    if address_cache is not None:
+        address_cache.close()
+    write_summary(summary)
+    return 0 if not summary["errors"] and summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
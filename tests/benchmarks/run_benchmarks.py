@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore[assignment]
+
+TESTS_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(TESTS_DIR))
+for harness_dir in ("domestic-labels", "scan-forms", "shipping-options"):
+    sys.path.insert(0, str(TESTS_DIR / harness_dir))
+
+from run_domestic_labels_test import build_default_label, label_extension  # noqa: E402
+from run_scan_forms_test import build_request_body  # noqa: E402
+from run_shipping_options_test import build_payload  # noqa: E402
+from usps_client.auth import TokenProvider  # noqa: E402
+from usps_client.batch import run_bounded  # noqa: E402
+from usps_client.cache import canonical_key, prune_none  # noqa: E402
+from usps_client.metrics import LatencyHistogram  # noqa: E402
+from usps_client.ratelimit import configure_rate_limiter  # noqa: E402
+from usps_client.transport import configure_transport, decode_json_body, get_transport, http_post_json, stream_body_to_file  # noqa: E402
+
+OUTPUT_PATH = Path(__file__).resolve().parent / "output" / "benchmark-results.json"
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+DEFAULT_TOLERANCE = 0.2
+DEFAULT_CONCURRENCY_LEVELS = "1,8,32"
+LABEL_BYTES = 200 * 1024
+
+# Representative env for the payload builders; no credentials are needed because nothing leaves the host.
+BENCH_ENV: Dict[str, str] = {
+    "USPS_CLIENT_ID": "bench-client",
+    "USPS_CLIENT_SECRET": "bench-secret",
+    "USPS_PAYMENT_TOKEN": "bench-payment-token",
+    "USPS_FROM_ZIP": "22407",
+    "USPS_TO_ZIP": "10001",
+    "USPS_WEIGHT_LBS": "2.5",
+    "USPS_ORIGIN_ZIP": "22407",
+    "USPS_DESTINATION_ZIP": "10001",
+    "USPS_SCAN_LABEL_TRACKINGS": ",".join(f"9400100000000000{n:06d}" for n in range(50)),
+    "USPS_SCAN_LABEL_CLASSES": ",".join(["USPS_GROUND_ADVANTAGE"] * 50),
+}
+
+RATE_BODY = json.dumps(
+    {
+        "originZIPCode": "22407",
+        "destinationZIPCode": "10001",
+        "pricingOptions": [
+            {
+                "shippingOptions": [
+                    {
+                        "mailClass": mail_class,
+                        "rateOptions": [{"totalBasePrice": 9.35 + index, "rates": [{"SKU": f"SKU{index}", "price": 9.35 + index, "weight": 2.5}]}],
+                    }
+                    for index, mail_class in enumerate(("USPS_GROUND_ADVANTAGE", "PRIORITY_MAIL", "PRIORITY_MAIL_EXPRESS"))
+                ]
+            }
+        ],
+    }
+).encode("utf-8")
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; with Nagle on, delayed ACKs would add ~40 ms to small responses.
+    disable_nagle_algorithm = True
+    latency = 0.0
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.latency:
+            time.sleep(self.latency)
+        if "oauth2/" in self.path:
+            content_type, body = "application/json", json.dumps({"access_token": "bench-token", "expires_in": 3600}).encode("utf-8")
+        elif "labels/v3/label" in self.path:
+            content_type, body = "application/pdf", b"%PDF-1.4\n" + b"0" * LABEL_BYTES
+        else:
+            content_type, body = "application/json", RATE_BODY
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _StandInServer(ThreadingHTTPServer):
+    request_queue_size = 256
+    daemon_threads = True
+
+
+def start_stand_in_server(latency_ms: float) -> Tuple[ThreadingHTTPServer, str]:
+    handler = type("StandInHandler", (_StandInHandler,), {"latency": latency_ms / 1000.0})
+    server = _StandInServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, name="bench-server", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+class _ReplayResponse(io.BytesIO):
+    """Stands in for http.client.HTTPResponse when timing artifact saving without a socket."""
+
+
+def time_micro(fn: Callable[[], Any], seconds: float, repeats: int = 5) -> Dict[str, Any]:
+    best = float("inf")
+    for _ in range(repeats):
+        iterations = 0
+        started = time.perf_counter()
+        deadline = started + seconds
+        while True:
+            fn()
+            iterations += 1
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+        best = min(best, (now - started) / iterations)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"opsPerSec": round(1.0 / best, 1), "usPerOp": round(best * 1_000_000, 3), "peakBytes": peak}
+
+
+def run_micro(seconds: float) -> Dict[str, Dict[str, Any]]:
+    label_payload = build_default_label(BENCH_ENV)
+    label_json = json.dumps(label_payload)
+    label_bytes = label_json.encode("utf-8")
+    artifact_bytes = b"%PDF-1.4\n" + b"0" * LABEL_BYTES
+    artifact_dir = Path(tempfile.mkdtemp(prefix="usps-bench-"))
+    pdf_headers = {"Content-Type": "application/pdf"}
+
+    def save_artifact() -> None:
+        stream_body_to_file(_ReplayResponse(artifact_bytes), artifact_dir / "label.pdf")
+
+    cases: Dict[str, Callable[[], Any]] = {
+        "build_default_label": lambda: build_default_label(BENCH_ENV),
+        "build_request_body": lambda: build_request_body(BENCH_ENV, []),
+        "build_shipping_payload": lambda: build_payload(BENCH_ENV),
+        "prune_none": lambda: prune_none(label_payload),
+        "canonical_key": lambda: canonical_key("https://apis.usps.com/shipments/v3/options/search", label_payload),
+        "json_encode": lambda: json.dumps(label_payload).encode("utf-8"),
+        "json_decode": lambda: decode_json_body(label_bytes),
+        "json_decode_rates": lambda: decode_json_body(RATE_BODY),
+        "label_extension": lambda: label_extension(pdf_headers),
+        "save_artifact_200k": save_artifact,
+    }
+    results = {name: time_micro(fn, seconds) for name, fn in cases.items()}
+    for leftover in artifact_dir.iterdir():
+        leftover.unlink()
+    artifact_dir.rmdir()
+    return results
+
+
+def run_flow(name: str, base_url: str, requests: int, concurrency: int, call: Callable[[str, str], Any]) -> Dict[str, Any]:
+    configure_transport(pool_size=concurrency)
+    provider = TokenProvider(base_url, BENCH_ENV["USPS_CLIENT_ID"], BENCH_ENV["USPS_CLIENT_SECRET"])
+    histogram = LatencyHistogram()
+    errors = 0
+
+    def worker(_: int) -> float:
+        started = time.perf_counter()
+        call(base_url, provider.get_token() or "")
+        return (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    for _, outcome in run_bounded(range(requests), worker, concurrency):
+        if isinstance(outcome, BaseException):
+            errors += 1
+        else:
+            histogram.record(outcome)
+    elapsed = time.perf_counter() - started
+    summary = histogram.summary()
+    return {
+        "flow": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "elapsedSeconds": round(elapsed, 3),
+        "requestsPerSec": round((requests - errors) / elapsed, 1) if elapsed else None,
+        "p50Ms": summary["p50Ms"],
+        "p95Ms": summary["p95Ms"],
+        "p99Ms": summary["p99Ms"],
+    }
+
+
+def run_macro(latency_ms: float, requests: int, levels: List[int]) -> Dict[str, Dict[str, Any]]:
+    server, base_url = start_stand_in_server(latency_ms)
+    # Budgets from the caller's environment would measure the limiter, not the client.
+    configure_rate_limiter({key: "" for key in os.environ if key.startswith("USPS_RATE_LIMIT_")})
+    quote_payload = build_payload(BENCH_ENV)
+    label_payload = build_default_label(BENCH_ENV)
+    artifact_dir = Path(tempfile.mkdtemp(prefix="usps-bench-labels-"))
+    label_counter = iter(range(1_000_000))
+    counter_lock = threading.Lock()
+
+    def quote(base: str, token: str) -> Any:
+        return http_post_json(urllib.parse.urljoin(base, "shipments/v3/options/search"), quote_payload, headers={"Authorization": f"Bearer {token}"})
+
+    def label(base: str, token: str) -> Any:
+        with counter_lock:
+            path = artifact_dir / f"label-{next(label_counter)}.pdf"
+        return get_transport().request(
+            "POST",
+            urllib.parse.urljoin(base, "labels/v3/label"),
+            body=json.dumps(label_payload).encode("utf-8"),
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {token}", "X-Payment-Authorization-Token": "bench"},
+            timeout=40,
+            stream_to=lambda headers: path,
+        )
+
+    results: Dict[str, Dict[str, Any]] = {}
+    try:
+        for level in levels:
+            results[f"auth_quote_c{level}"] = run_flow("auth_quote", base_url, requests, level, quote)
+            results[f"auth_label_c{level}"] = run_flow("auth_label", base_url, max(1, requests // 4), level, label)
+    finally:
+        server.shutdown()
+        for leftover in artifact_dir.iterdir():
+            leftover.unlink()
+        artifact_dir.rmdir()
+    return results
+
+
+def peak_rss_kb() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS.
+    return int(peak / 1024) if sys.platform == "darwin" else int(peak)
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Throughput may not drop, and memory may not grow, by more than ``tolerance`` versus the baseline."""
+    regressions: List[str] = []
+    checks = [("micro", "opsPerSec", True), ("micro", "peakBytes", False), ("macro", "requestsPerSec", True)]
+    for section, metric, higher_is_better in checks:
+        for name, current in results.get(section, {}).items():
+            reference = baseline.get(section, {}).get(name, {}).get(metric)
+            value = current.get(metric)
+            if not isinstance(reference, (int, float)) or not isinstance(value, (int, float)) or reference <= 0:
+                continue
+            change = (value - reference) / reference
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append(f"{section}.{name}.{metric}: {value} vs baseline {reference} ({change:+.1%})")
+    reference_rss = baseline.get("peakRssKb")
+    if isinstance(reference_rss, int) and isinstance(results.get("peakRssKb"), int) and reference_rss > 0:
+        change = (results["peakRssKb"] - reference_rss) / reference_rss
+        if change > tolerance:
+            regressions.append(f"peakRssKb: {results['peakRssKb']} vs baseline {reference_rss} ({change:+.1%})")
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Micro and macro benchmarks for the USPS client hot paths, against a local stand-in server.")
+    parser.add_argument("--output", default=str(OUTPUT_PATH), help="Where to write the machine-readable results")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH), help="Baseline results to compare against (skipped if missing)")
+    parser.add_argument("--update-baseline", action="store_true", help="Write this run's results to --baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed fractional regression (default 0.2)")
+    parser.add_argument("--micro-seconds", type=float, default=0.2, help="Time budget per micro benchmark repeat")
+    parser.add_argument("--requests", type=int, default=200, help="Quote requests per concurrency level (labels use a quarter)")
+    parser.add_argument("--concurrency", default=DEFAULT_CONCURRENCY_LEVELS, help="Comma-separated concurrency levels for the macro flows")
+    parser.add_argument("--server-latency-ms", type=float, default=5.0, help="Artificial per-request latency of the stand-in server")
+    parser.add_argument("--skip-macro", action="store_true", help="Only run the in-process micro benchmarks")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip().isdigit()]
+    results: Dict[str, Any] = {
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "microSeconds": args.micro_seconds,
+            "requests": args.requests,
+            "concurrency": levels,
+            "serverLatencyMs": args.server_latency_ms,
+        },
+        "micro": run_micro(args.micro_seconds),
+        "macro": {} if args.skip_macro else run_macro(args.server_latency_ms, args.requests, levels),
+    }
+    results["peakRssKb"] = peak_rss_kb()
+
+    exit_code = 0
+    baseline_path = Path(args.baseline)
+    if args.update_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    elif baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+        results["baseline"] = str(baseline_path)
+        results["regressions"] = compare(results, baseline, args.tolerance)
+        if results["regressions"]:
+            exit_code = 1
+
+    output_path = Path(args.output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    for name, stats in results["micro"].items():
+        print(f"{name:<24} {stats['opsPerSec']:>14,.1f} ops/s {stats['peakBytes']:>10,} B peak")
+    for name, stats in results["macro"].items():
+        print(f"{name:<24} {stats['requestsPerSec']:>14,.1f} req/s  p95 {stats['p95Ms']} ms  errors {stats['errors']}")
+    for regression in results.get("regressions", []):
+        print(f"REGRESSION {regression}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
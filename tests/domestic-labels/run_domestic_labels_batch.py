@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+import urllib.parse
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from run_domestic_labels_test import build_default_label, label_extension  # noqa: E402
+from usps_client.auth import get_token_provider  # noqa: E402
+from usps_client.batch import describe_error, read_rows, row_reference, run_items  # noqa: E402
+from usps_client.concurrency import DEFAULT_MAX_LIMIT, ConcurrencyLimits  # noqa: E402
+from usps_client.config import load_env, parse_int, resolve_base_url  # noqa: E402
+from usps_client.idempotency import build_label_ledger, idempotency_key, is_ambiguous  # noqa: E402
+from usps_client.jobs import build_job_queue  # noqa: E402
+from usps_client.metrics import get_metrics  # noqa: E402
+from usps_client.ratelimit import configure_rate_limiter  # noqa: E402
+from usps_client.records import LabelRecord, set_retain_raw  # noqa: E402
+from usps_client.registry import build_label_registry  # noqa: E402
+from usps_client.retry import get_retry_engine  # noqa: E402
+from usps_client.sink import open_sink  # noqa: E402
+from usps_client.transport import DEFAULT_POOL_SIZE, configure_transport, decode_json_body, get_transport  # noqa: E402
+
+FLOW = "domestic-labels"
+OUTPUT_DIR = Path(__file__).resolve().parent / "output"
+DEFAULT_RESULTS_PATH = OUTPUT_DIR / "domestic-labels-batch.jsonl"
+DEFAULT_ARTIFACT_DIR = OUTPUT_DIR / "labels"
+SUMMARY_PATH = OUTPUT_DIR / "domestic-labels-batch-summary.json"
+REQUIRED_ENV_KEYS = ["USPS_CLIENT_ID", "USPS_CLIENT_SECRET", "USPS_PAYMENT_TOKEN"]
+DEFAULT_CONCURRENCY = 4
+UNSAFE_FILENAME_CHARS = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+def parse_args(argv: Optional[List[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Create many domestic labels via labels/v3/label. "
+        "Each CSV column / JSONL key overrides the env value of the same name (USPS_TO_ZIP, USPS_WEIGHT_LBS, USPS_LABEL_REFERENCE, ...)."
+    )
+    parser.add_argument("--input", required=True, help="CSV (with header row) or JSONL file of label requests")
+    parser.add_argument("--output", default=str(DEFAULT_RESULTS_PATH), help="JSONL file receiving one result per label")
+    parser.add_argument("--artifact-dir", default=str(DEFAULT_ARTIFACT_DIR), help="Directory for saved label PDF/TIFF files")
+    parser.add_argument("--concurrency", type=int, default=None, help="Maximum in-flight label requests (default USPS_CONCURRENCY or 4)")
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Tune in-flight requests with AIMD on latency, timeouts and 429s, starting from --concurrency",
+    )
+    parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_LIMIT, help="Upper bound for --adaptive")
+    parser.add_argument(
+        "--ledger",
+        default=None,
+        help="SQLite idempotency ledger so reruns never buy a label twice (default USPS_LABEL_LEDGER; off when neither is set)",
+    )
+    parser.add_argument(
+        "--registry",
+        default=None,
+        help="SQLite label registry that SCAN forms are built from (default USPS_LABEL_REGISTRY; off when neither is set)",
+    )
+    parser.add_argument(
+        "--retain-raw",
+        action="store_true",
+        help="Keep full response headers and JSON bodies in the output (default: status, IDs and artifact only; also USPS_RETAIN_RAW=1)",
+    )
+    parser.add_argument(
+        "--queue",
+        default=None,
+        help="SQLite job queue that makes the run resumable after a crash; requires a ledger (default USPS_JOB_QUEUE; off when neither is set)",
+    )
+    parser.add_argument("--run-id", default=None, help="Queue run to create or resume (default: derived from the input file's path, size and mtime)")
+    parser.add_argument("--retry-dead", action="store_true", help="Requeue the run's dead-lettered jobs before processing")
+    return parser.parse_args(argv)
+
+
+def label_reference(row: Dict[str, str], line: int) -> str:
+    return row.get("USPS_LABEL_REFERENCE") or row_reference(row, line)
+
+
+def artifact_stem(reference: str, line: int) -> str:
+    safe = UNSAFE_FILENAME_CHARS.sub("_", reference).strip("._")
+    return f"label-{safe}" if safe else f"label-line{line}"
+
+
+def reserve_artifact_path(artifact_dir: Path, headers: Any, reference: str, line: int) -> Optional[Path]:
+    extension = label_extension(headers)
+    if not extension:
+        return None
+    artifact_dir.mkdir(parents=True, exist_ok=True)
+    stem = artifact_stem(reference, line)
+    for candidate in (artifact_dir / f"{stem}.{extension}", artifact_dir / f"{stem}-line{line}.{extension}"):
+        try:
+            # Claim the name up front; duplicate references in the input keep both labels.
+            with open(candidate, "xb"):
+                pass
+            return candidate
+        except FileExistsError:
+            continue
+    return artifact_dir / f"{stem}-line{line}.{extension}"
+
+
+def write_summary(summary: Dict[str, Any]) -> None:
+    SUMMARY_PATH.parent.mkdir(parents=True, exist_ok=True)
+    SUMMARY_PATH.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    env_file = os.environ.get("ENV_FILE", ".env.local")
+    summary: Dict[str, Any] = {
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "envFile": env_file,
+        "input": args.input,
+        "output": args.output,
+        "artifactDir": args.artifact_dir,
+        "baseUrl": None,
+        "concurrency": None,
+        "total": 0,
+        "succeeded": 0,
+        "failed": 0,
+        "elapsedSeconds": None,
+        "errors": [],
+    }
+
+    try:
+        env = load_env(env_file)
+    except OSError as exc:
+        summary["errors"].append(f"Failed to read env file: {exc}")
+        write_summary(summary)
+        return 1
+
+    missing = [key for key in REQUIRED_ENV_KEYS if not env.get(key)]
+    if missing:
+        summary["errors"].append(f"Missing required env values: {', '.join(missing)}")
+        write_summary(summary)
+        return 1
+
+    base_url = resolve_base_url(env)
+    if not base_url:
+        summary["errors"].append("Could not determine USPS API base URL from env")
+        write_summary(summary)
+        return 1
+    summary["baseUrl"] = base_url
+    label_url = urllib.parse.urljoin(base_url, "labels/v3/label")
+
+    concurrency = args.concurrency or parse_int(env.get("USPS_CONCURRENCY")) or DEFAULT_CONCURRENCY
+    summary["concurrency"] = concurrency
+    if args.retain_raw:
+        set_retain_raw(True)
+    limits = ConcurrencyLimits(initial=concurrency, maximum=max(concurrency, args.max_concurrency)) if args.adaptive else None
+    configure_transport(pool_size=max(limits.maximum if limits else concurrency, DEFAULT_POOL_SIZE))
+    rate_limiter = configure_rate_limiter(env)
+    token_provider = get_token_provider(
+        base_url,
+        env["USPS_CLIENT_ID"],
+        env["USPS_CLIENT_SECRET"],
+        cache_path=env.get("USPS_TOKEN_CACHE"),
+    )
+    artifact_dir = Path(args.artifact_dir)
+    try:
+        ledger = build_label_ledger(env, args.ledger)
+    except (OSError, sqlite3.Error) as exc:
+        summary["errors"].append(f"Failed to open label ledger: {exc}")
+        write_summary(summary)
+        return 1
+    try:
+        registry = build_label_registry(env, args.registry)
+    except (OSError, sqlite3.Error) as exc:
+        summary["errors"].append(f"Failed to open label registry: {exc}")
+        write_summary(summary)
+        return 1
+
+    def create_label(item: Tuple[int, Dict[str, str]]) -> LabelRecord:
+        index, row = item
+        label_env = {**env, **row}
+        payload = build_default_label(label_env)
+        reference = label_reference(row, index)
+        # Only a per-row key counts; an env-wide USPS_IDEMPOTENCY_KEY would collapse the whole batch into one label.
+        key = row.get("idempotencyKey") or row.get("USPS_IDEMPOTENCY_KEY") or idempotency_key(label_url, payload, reference)
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {token_provider.get_token()}",
+            "X-Payment-Authorization-Token": label_env["USPS_PAYMENT_TOKEN"],
+            "Accept": "application/json",
+        }
+
+        def artifact_path(response_headers: Any) -> Optional[Path]:
+            path = reserve_artifact_path(artifact_dir, response_headers, reference, index)
+            return ledger.note_artifact(key, path) if ledger is not None else path
+
+        def send() -> LabelRecord:
+            response = get_transport().request(
+                "POST",
+                label_url,
+                body=json.dumps(payload).encode("utf-8"),
+                headers=headers,
+                timeout=40,
+                stream_to=artifact_path,
+            )
+            return LabelRecord.from_transport(response, None if response.saved_path is not None else decode_json_body(response.body))
+
+        if ledger is None:
+            return send()
+        return ledger.call(key, send, encode=LabelRecord.to_dict, decode=LabelRecord.from_dict, reference=reference)
+
+    if ledger is None and (args.queue or os.environ.get("USPS_JOB_QUEUE") or env.get("USPS_JOB_QUEUE")):
+        # A crashed run's leased jobs are handed out again, which for labels means buying them again.
+        summary["errors"].append("A job queue needs a label ledger (--ledger or USPS_LABEL_LEDGER) so resumed label jobs are not bought twice")
+        write_summary(summary)
+        return 1
+    try:
+        queue = build_job_queue(env, FLOW, args.input, args.queue, args.run_id)
+    except (OSError, sqlite3.Error) as exc:
+        summary["errors"].append(f"Failed to open job queue: {exc}")
+        write_summary(summary)
+        return 1
+    if queue is not None and args.retry_dead:
+        summary["requeuedDead"] = queue.requeue_dead()
+
+    started = time.monotonic()
+    try:
+        with open_sink(Path(args.output), env, append=queue is not None and queue.resumed) as writer:
+            for (index, row), outcome, dead_lettered in run_items(
+                enumerate(read_rows(args.input), 1),
+                create_label,
+                concurrency,
+                controller=limits.controller(label_url) if limits else None,
+                queue=queue,
+                ambiguous=is_ambiguous,
+            ):
+                label_env = {**env, **row}
+                payload = build_default_label(label_env)
+                # Mailing date and origin let the SCAN form batch group this file by day and acceptance location.
+                record: Dict[str, Any] = {
+                    "line": index,
+                    "reference": label_reference(row, index),
+                    "mailingDate": payload["mailingDate"],
+                    "originZIPCode": payload["fromAddress"]["ZIPCode"],
+                }
+                if isinstance(outcome, BaseException):
+                    record.update(describe_error(outcome))
+                    if dead_lettered:
+                        record["deadLettered"] = True
+                else:
+                    record.update(outcome.to_dict())
+                    if registry is not None:
+                        registry.add(
+                            outcome, payload, reference=record["reference"], mid=label_env.get("USPS_MID"), crid=label_env.get("USPS_CRID")
+                        )
+                summary["total"] += 1
+                if record["status"] == 200:
+                    summary["succeeded"] += 1
+                else:
+                    summary["failed"] += 1
+                writer.write(record)
+        summary["outputSegments"] = [str(segment) for segment in writer.segments]
+    except (OSError, ValueError) as exc:
+        summary["errors"].append(f"Failed to process input: {exc}")
+
+    summary["elapsedSeconds"] = round(time.monotonic() - started, 3)
+    if limits is not None:
+        summary["concurrencyLimits"] = limits.report()
+    summary["latency"] = get_metrics().report()
+    summary["circuitBreakers"] = get_retry_engine().breaker_states()
+    summary["rateLimitWaitSeconds"] = {name: round(waited, 3) for name, waited in rate_limiter.waited.items()}
+    if queue is not None:
+        summary["jobQueue"] = queue.report()
+        queue.close()
+    if ledger is not None:
+        summary["labelLedger"] = ledger.report()
+        ledger.close()
+    if registry is not None:
+        summary["labelRegistry"] = registry.report()
+        registry.close()
+    write_summary(summary)
+    return 0 if not summary["errors"] and summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,23 @@
 #!/usr/bin/env python3
-import base64
 import json
 import os
 import sys
 import urllib.error
 import urllib.parse
-import urllib.request
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from usps_client.auth import get_token_provider  # noqa: E402
+from usps_client.idempotency import artifact_stem, build_label_ledger, idempotency_key  # noqa: E402
+from usps_client.metrics import get_metrics  # noqa: E402
+from usps_client.ratelimit import configure_rate_limiter  # noqa: E402
+from usps_client.records import LabelRecord, compact_headers  # noqa: E402
+from usps_client.registry import build_label_registry  # noqa: E402
+from usps_client.sink import build_sink, record_call  # noqa: E402
+from usps_client.transport import get_transport  # noqa: E402
 
 OUTPUT_PATH = Path(__file__).resolve().parent / "output" / "domestic-labels-result.json"
 REQUIRED_ENV_KEYS = ["USPS_CLIENT_ID", "USPS_CLIENT_SECRET", "USPS_PAYMENT_TOKEN"]
@@ -43,42 +52,31 @@ def load_env(path: str) -> Dict[str, str]:
     return env
 
 
-def http_post_form(url: str, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None, timeout: int = 15):
-    data = urllib.parse.urlencode(payload).encode("utf-8")
-    hdrs = {"Content-Type": "application/x-www-form-urlencoded", "Accept": "application/json"}
-    if headers:
-        hdrs.update(headers)
-    request = urllib.request.Request(url, data=data, headers=hdrs, method="POST")
-    with urllib.request.urlopen(request, timeout=timeout) as response:
-        body_bytes = response.read()
-        body_text = body_bytes.decode("utf-8") if body_bytes else ""
-        try:
-            body_json = json.loads(body_text) if body_text else {}
-        except json.JSONDecodeError:
-            body_json = {"raw": body_text}
-        return {
-            "status": response.status,
-            "headers": dict(response.headers.items()),
-            "body": body_json,
-        }
-
-
-def http_post_json(url: str, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None, timeout: int = 30):
+def http_post_json(
+    url: str,
+    payload: Dict[str, Any],
+    headers: Optional[Dict[str, str]] = None,
+    timeout: int = 30,
+    stream_to: Optional[Callable[[Any], Optional[Path]]] = None,
+):
     data = json.dumps(payload).encode("utf-8")
     hdrs = {"Content-Type": "application/json"}
     if headers:
         hdrs.update(headers)
-    request = urllib.request.Request(url, data=data, headers=hdrs, method="POST")
-    with urllib.request.urlopen(request, timeout=timeout) as response:
-        body_bytes = response.read()
-        body_text = body_bytes.decode("utf-8", errors="replace") if body_bytes else ""
-        body_b64 = base64.b64encode(body_bytes).decode("ascii") if body_bytes else ""
-        return {
-            "status": response.status,
-            "headers": dict(response.headers.items()),
-            "body": body_text,
-            "bodyBase64": body_b64,
-        }
+    response = get_transport().request("POST", url, body=data, headers=hdrs, timeout=timeout, stream_to=stream_to)
+    result: Dict[str, Any] = {
+        "status": response.status,
+        "headers": compact_headers(response.headers),
+        "timings": response.timings,
+    }
+    if response.saved_path is not None:
+        # Binary label bodies go straight to disk; only record where they went.
+        result["savedLabel"] = str(response.saved_path)
+        result["size"] = response.size
+        result["sha256"] = response.sha256
+    else:
+        result["body"] = response.body.decode("utf-8", errors="replace") if response.body else ""
+    return result
 
 
 def build_default_label(env: Dict[str, str]) -> Dict[str, Any]:
@@ -132,7 +130,7 @@ def build_default_label(env: Dict[str, str]) -> Dict[str, Any]:
     }
 
 
-def save_label_artifact(headers: Dict[str, Any], body_b64: str) -> Optional[str]:
+def label_extension(headers: Any) -> Optional[str]:
     content_type = headers.get("Content-Type")
     if not content_type:
         return None
@@ -140,15 +138,18 @@ def save_label_artifact(headers: Dict[str, Any], body_b64: str) -> Optional[str]
     if content_type.startswith("application/json"):
         return None
 
-    extension = "pdf" if "pdf" in content_type.lower() else "tif"
-    output_dir = OUTPUT_PATH.parent
-    output_dir.mkdir(parents=True, exist_ok=True)
-    file_path = output_dir / f"label.{extension}"
-    try:
-        file_path.write_bytes(base64.b64decode(body_b64))
-    except Exception:
-        return None
-    return str(file_path)
+    return "pdf" if "pdf" in content_type.lower() else "tif"
+
+
+def label_artifact_target(output_dir: Path, stem: str = "label") -> Callable[[Any], Optional[Path]]:
+    def target(headers: Any) -> Optional[Path]:
+        extension = label_extension(headers)
+        if not extension:
+            return None
+        output_dir.mkdir(parents=True, exist_ok=True)
+        return output_dir / f"{stem}.{extension}"
+
+    return target
 
 
 def main() -> int:
@@ -178,6 +179,13 @@ def main() -> int:
         OUTPUT_PATH.write_text(json.dumps(results, indent=2), encoding="utf-8")
         return 1
 
+    try:
+        sink = build_sink(env)
+    except (OSError, ValueError) as exc:
+        results["errors"].append(f"Failed to open results sink: {exc}")
+        exit_code = 1
+        sink = None
+
     missing = [key for key in REQUIRED_ENV_KEYS if not env.get(key)]
     if missing:
         results["errors"].append(f"Missing required env values: {', '.join(missing)}")
@@ -201,18 +209,21 @@ def main() -> int:
         results["labelUrl"] = label_url
 
         try:
-            auth_payload = {
-                "grant_type": "client_credentials",
-                "client_id": env.get("USPS_CLIENT_ID", ""),
-                "client_secret": env.get("USPS_CLIENT_SECRET", ""),
-            }
-            results["auth"] = http_post_form(auth_url, auth_payload)
+            configure_rate_limiter(env)
+            token_provider = get_token_provider(
+                base_url,
+                env.get("USPS_CLIENT_ID", ""),
+                env.get("USPS_CLIENT_SECRET", ""),
+                cache_path=env.get("USPS_TOKEN_CACHE"),
+            )
+            results["auth"] = token_provider.authenticate()
         except urllib.error.HTTPError as err:
             body = err.read().decode("utf-8", errors="replace") if err.fp else ""
             results["auth"] = {
                 "status": err.code,
-                "headers": dict(err.headers.items()) if err.headers else {},
+                "headers": compact_headers(err.headers),
                 "body": {"raw": body},
+                "timings": getattr(err, "timings", None),
             }
             results["errors"].append(f"Auth request failed with HTTP {err.code}")
             exit_code = 1
@@ -236,6 +247,7 @@ def main() -> int:
         body = results["auth"].get("body")
         if isinstance(body, dict):
             token = body.get("access_token")
+    results["auth"] = record_call(sink, "auth", results["auth"])
 
     if not token:
         if not results["errors"]:
@@ -250,20 +262,35 @@ def main() -> int:
             "Accept": "application/json"
         }
 
+        key = env.get("USPS_IDEMPOTENCY_KEY") or idempotency_key(results["labelUrl"], label_payload, label_payload.get("reference"))
+        ledger = None
+        registry = None
+
         try:
-            results["label"] = http_post_json(results["labelUrl"], label_payload, headers=headers, timeout=40)
+            ledger = build_label_ledger(env)
+            registry = build_label_registry(env)
+            # With a ledger each key writes its own file, so a later call's label never reconciles this one.
+            target = label_artifact_target(OUTPUT_PATH.parent, artifact_stem("label", key) if ledger else "label")
+
+            def send() -> Dict[str, Any]:
+                return http_post_json(
+                    results["labelUrl"],
+                    label_payload,
+                    headers=headers,
+                    timeout=40,
+                    stream_to=(lambda response_headers: ledger.note_artifact(key, target(response_headers))) if ledger else target,
+                )
+
+            results["label"] = ledger.call(key, send, reference=label_payload.get("reference")) if ledger else send()
             if results["label"].get("status") != 200:
                 exit_code = 1
-            else:
-                artifact_path = save_label_artifact(results["label"].get("headers", {}), results["label"].get("bodyBase64", ""))
-                if artifact_path:
-                    results["label"]["savedLabel"] = artifact_path
         except urllib.error.HTTPError as err:
             body = err.read().decode("utf-8", errors="replace") if err.fp else ""
             results["label"] = {
                 "status": err.code,
-                "headers": dict(err.headers.items()) if err.headers else {},
+                "headers": compact_headers(err.headers),
                 "body": {"raw": body},
+                "timings": getattr(err, "timings", None),
             }
             results["errors"].append(f"Label request failed with HTTP {err.code}")
             exit_code = 1
@@ -281,7 +308,26 @@ def main() -> int:
             }
             results["errors"].append(f"Label request failed: {exc}")
             exit_code = 1
+        if ledger is not None:
+            results["idempotencyKey"] = key
+            results["labelLedger"] = ledger.report()
+            ledger.close()
+        if registry is not None:
+            registry.add(
+                LabelRecord.from_result(results["label"]),
+                label_payload,
+                reference=label_payload.get("reference"),
+                mid=env.get("USPS_MID"),
+                crid=env.get("USPS_CRID"),
+            )
+            results["labelRegistry"] = registry.report()
+            registry.close()
 
+    results["label"] = record_call(sink, "label", results["label"])
+    if sink is not None:
+        sink.close()
+        results["resultsSink"] = [str(segment) for segment in sink.segments]
+    results["latency"] = get_metrics().report()
     OUTPUT_PATH.parent.mkdir(parents=True, exist_ok=True)
     OUTPUT_PATH.write_text(json.dumps(results, indent=2), encoding="utf-8")
     return exit_code
@@ -1,14 +1,23 @@
 #!/usr/bin/env python3
-import base64
 import json
 import os
 import sys
 import urllib.error
 import urllib.parse
-import urllib.request
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from usps_client.auth import get_token_provider  # noqa: E402
+from usps_client.idempotency import artifact_stem, build_label_ledger, idempotency_key  # noqa: E402
+from usps_client.metrics import get_metrics  # noqa: E402
+from usps_client.ratelimit import configure_rate_limiter  # noqa: E402
+from usps_client.records import LabelRecord, compact_headers  # noqa: E402
+from usps_client.registry import build_label_registry  # noqa: E402
+from usps_client.sink import build_sink, record_call  # noqa: E402
+from usps_client.transport import get_transport  # noqa: E402
 
 OUTPUT_PATH = Path(__file__).resolve().parent / "output" / "international-labels-result.json"
 REQUIRED_ENV_KEYS = ["USPS_CLIENT_ID", "USPS_CLIENT_SECRET", "USPS_PAYMENT_TOKEN"]
@@ -43,27 +52,14 @@ def load_env(path: str) -> Dict[str, str]:
     return env
 
 
-def http_post_form(url: str, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None, timeout: int = 15):
-    data = urllib.parse.urlencode(payload).encode("utf-8")
-    hdrs = {"Content-Type": "application/x-www-form-urlencoded", "Accept": "application/json"}
-    if headers:
-        hdrs.update(headers)
-    request = urllib.request.Request(url, data=data, headers=hdrs, method="POST")
-    with urllib.request.urlopen(request, timeout=timeout) as response:
-        body_bytes = response.read()
-        body_text = body_bytes.decode("utf-8") if body_bytes else ""
-        try:
-            body_json = json.loads(body_text) if body_text else {}
-        except json.JSONDecodeError:
-            body_json = {"raw": body_text}
-        return {
-            "status": response.status,
-            "headers": dict(response.headers.items()),
-            "body": body_json,
-        }
-
-
-def http_request(url: str, payload: Optional[Dict[str, Any]], headers: Dict[str, str], method: str = "POST", timeout: int = 40):
+def http_request(
+    url: str,
+    payload: Optional[Dict[str, Any]],
+    headers: Dict[str, str],
+    method: str = "POST",
+    timeout: int = 40,
+    stream_to: Optional[Callable[[Any], Optional[Path]]] = None,
+):
     data: Optional[bytes] = None
     if payload is not None:
         data = json.dumps(payload).encode("utf-8")
@@ -71,17 +67,20 @@ def http_request(url: str, payload: Optional[Dict[str, Any]], headers: Dict[str,
         hdrs.update(headers)
     else:
         hdrs = dict(headers)
-    request = urllib.request.Request(url, data=data, headers=hdrs, method=method)
-    with urllib.request.urlopen(request, timeout=timeout) as response:
-        body_bytes = response.read()
-        body_text = body_bytes.decode("utf-8", errors="replace") if body_bytes else ""
-        body_b64 = base64.b64encode(body_bytes).decode("ascii") if body_bytes else ""
-        return {
-            "status": response.status,
-            "headers": dict(response.headers.items()),
-            "body": body_text,
-            "bodyBase64": body_b64,
-        }
+    response = get_transport().request(method, url, body=data, headers=hdrs, timeout=timeout, stream_to=stream_to)
+    result: Dict[str, Any] = {
+        "status": response.status,
+        "headers": compact_headers(response.headers),
+        "timings": response.timings,
+    }
+    if response.saved_path is not None:
+        # Binary label bodies go straight to disk; only record where they went.
+        result["savedLabel"] = str(response.saved_path)
+        result["size"] = response.size
+        result["sha256"] = response.sha256
+    else:
+        result["body"] = response.body.decode("utf-8", errors="replace") if response.body else ""
+    return result
 
 
 def parse_bool(value: Optional[str]) -> Optional[bool]:
@@ -171,23 +170,18 @@ def build_default_request(env: Dict[str, str]) -> Dict[str, Any]:
     }
 
 
-def save_label_artifact(headers: Dict[str, Any], body_b64: str) -> Optional[str]:
+def label_artifact_target(headers: Any, stem: str = "international-label") -> Optional[Path]:
     content_type = headers.get("Content-Type")
     if not content_type:
         return None
 
-    if content_type.startswith("application/json") or not body_b64:
+    if content_type.startswith("application/json"):
         return None
 
     extension = "pdf" if "pdf" in content_type.lower() else "tif"
     output_dir = OUTPUT_PATH.parent
     output_dir.mkdir(parents=True, exist_ok=True)
-    file_path = output_dir / f"international-label.{extension}"
-    try:
-        file_path.write_bytes(base64.b64decode(body_b64))
-    except Exception:
-        return None
-    return str(file_path)
+    return output_dir / f"{stem}.{extension}"
 
 
 def main() -> int:
@@ -217,6 +211,13 @@ def main() -> int:
         OUTPUT_PATH.write_text(json.dumps(results, indent=2), encoding="utf-8")
         return 1
 
+    try:
+        sink = build_sink(env)
+    except (OSError, ValueError) as exc:
+        results["errors"].append(f"Failed to open results sink: {exc}")
+        exit_code = 1
+        sink = None
+
     missing = [key for key in REQUIRED_ENV_KEYS if not env.get(key)]
     if missing:
         results["errors"].append(f"Missing required env values: {', '.join(missing)}")
@@ -240,18 +241,21 @@ def main() -> int:
         results["labelUrl"] = label_url
 
         try:
-            auth_payload = {
-                "grant_type": "client_credentials",
-                "client_id": env.get("USPS_CLIENT_ID", ""),
-                "client_secret": env.get("USPS_CLIENT_SECRET", ""),
-            }
-            results["auth"] = http_post_form(auth_url, auth_payload)
+            configure_rate_limiter(env)
+            token_provider = get_token_provider(
+                base_url,
+                env.get("USPS_CLIENT_ID", ""),
+                env.get("USPS_CLIENT_SECRET", ""),
+                cache_path=env.get("USPS_TOKEN_CACHE"),
+            )
+            results["auth"] = token_provider.authenticate()
         except urllib.error.HTTPError as err:
             body = err.read().decode("utf-8", errors="replace") if err.fp else ""
             results["auth"] = {
                 "status": err.code,
-                "headers": dict(err.headers.items()) if err.headers else {},
+                "headers": compact_headers(err.headers),
                 "body": {"raw": body},
+                "timings": getattr(err, "timings", None),
             }
             results["errors"].append(f"Auth request failed with HTTP {err.code}")
             exit_code = 1
@@ -275,6 +279,7 @@ def main() -> int:
         body = results["auth"].get("body")
         if isinstance(body, dict):
             token = body.get("access_token")
+    results["auth"] = record_call(sink, "auth", results["auth"])
 
     if not token:
         if not results["errors"]:
@@ -289,20 +294,39 @@ def main() -> int:
             "Accept": "application/json, multipart/mixed"
         }
 
+        key = env.get("USPS_IDEMPOTENCY_KEY") or idempotency_key(results["labelUrl"], label_payload, label_payload.get("reference"))
+        ledger = None
+        registry = None
+
         try:
-            results["label"] = http_request(results["labelUrl"], label_payload, headers=headers, method="POST", timeout=60)
+            ledger = build_label_ledger(env)
+            registry = build_label_registry(env)
+
+            def send() -> Dict[str, Any]:
+                return http_request(
+                    results["labelUrl"],
+                    label_payload,
+                    headers=headers,
+                    method="POST",
+                    timeout=60,
+                    # With a ledger each key writes its own file, so a later call's label never reconciles this one.
+                    stream_to=(
+                        (lambda response_headers: ledger.note_artifact(key, label_artifact_target(response_headers, artifact_stem("international-label", key))))
+                        if ledger
+                        else label_artifact_target
+                    ),
+                )
+
+            results["label"] = ledger.call(key, send, reference=label_payload.get("reference")) if ledger else send()
             if results["label"].get("status") != 200:
                 exit_code = 1
-            else:
-                artifact_path = save_label_artifact(results["label"].get("headers", {}), results["label"].get("bodyBase64", ""))
-                if artifact_path:
-                    results["label"]["savedLabel"] = artifact_path
         except urllib.error.HTTPError as err:
             body = err.read().decode("utf-8", errors="replace") if err.fp else ""
             results["label"] = {
                 "status": err.code,
-                "headers": dict(err.headers.items()) if err.headers else {},
+                "headers": compact_headers(err.headers),
                 "body": {"raw": body},
+                "timings": getattr(err, "timings", None),
             }
             results["errors"].append(f"International label request failed with HTTP {err.code}")
             exit_code = 1
@@ -320,7 +344,26 @@ def main() -> int:
             }
             results["errors"].append(f"International label request failed: {exc}")
             exit_code = 1
-
+        if ledger is not None:
+            results["idempotencyKey"] = key
+            results["labelLedger"] = ledger.report()
+            ledger.close()
+        if registry is not None:
+            registry.add(
+                LabelRecord.from_result(results["label"]),
+                label_payload,
+                reference=label_payload.get("reference"),
+                mid=env.get("USPS_MID"),
+                crid=env.get("USPS_CRID"),
+            )
+            results["labelRegistry"] = registry.report()
+            registry.close()
+
+    results["label"] = record_call(sink, "label", results["label"])
+    if sink is not None:
+        sink.close()
+        results["resultsSink"] = [str(segment) for segment in sink.segments]
+    results["latency"] = get_metrics().report()
     OUTPUT_PATH.parent.mkdir(parents=True, exist_ok=True)
     OUTPUT_PATH.write_text(json.dumps(results, indent=2), encoding="utf-8")
     return exit_code
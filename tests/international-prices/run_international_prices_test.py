@@ -1,13 +1,26 @@
 #!/usr/bin/env python3
+import asyncio
 import json
 import os
 import sys
 import urllib.error
 import urllib.parse
-import urllib.request
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from usps_client.aio import AsyncUspsClient  # noqa: E402
+from usps_client.auth import get_token_provider  # noqa: E402
+from usps_client.bucketing import build_bucketer  # noqa: E402
+from usps_client.cache import EligibilityCache, ResponseCache, build_response_cache, cached_post  # noqa: E402
+from usps_client.metrics import get_metrics  # noqa: E402
+from usps_client.ratelimit import configure_rate_limiter  # noqa: E402
+from usps_client.ratetable import RateTable  # noqa: E402
+from usps_client.records import compact_headers  # noqa: E402
+from usps_client.sink import build_sink, call_summary, record_call  # noqa: E402
+from usps_client.transport import http_post_json  # noqa: E402
 
 OUTPUT_PATH = Path(__file__).resolve().parent / "output" / "international-prices-result.json"
 REQUIRED_ENV_KEYS = ["USPS_CLIENT_ID", "USPS_CLIENT_SECRET"]
@@ -39,46 +52,6 @@ def load_env(path: str) -> Dict[str, str]:
     return env
 
 
-def http_post_form(url: str, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None, timeout: int = 15):
-    data = urllib.parse.urlencode(payload).encode("utf-8")
-    hdrs = {"Content-Type": "application/x-www-form-urlencoded", "Accept": "application/json"}
-    if headers:
-        hdrs.update(headers)
-    request = urllib.request.Request(url, data=data, headers=hdrs, method="POST")
-    with urllib.request.urlopen(request, timeout=timeout) as response:
-        body_bytes = response.read()
-        body_text = body_bytes.decode("utf-8") if body_bytes else ""
-        try:
-            body_json = json.loads(body_text) if body_text else {}
-        except json.JSONDecodeError:
-            body_json = {"raw": body_text}
-        return {
-            "status": response.status,
-            "headers": dict(response.headers.items()),
-            "body": body_json,
-        }
-
-
-def http_post_json(url: str, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None, timeout: int = 15):
-    data = json.dumps(payload).encode("utf-8")
-    hdrs = {"Content-Type": "application/json", "Accept": "application/json"}
-    if headers:
-        hdrs.update(headers)
-    request = urllib.request.Request(url, data=data, headers=hdrs, method="POST")
-    with urllib.request.urlopen(request, timeout=timeout) as response:
-        body_bytes = response.read()
-        body_text = body_bytes.decode("utf-8") if body_bytes else ""
-        try:
-            body_json = json.loads(body_text) if body_text else {}
-        except json.JSONDecodeError:
-            body_json = {"raw": body_text}
-        return {
-            "status": response.status,
-            "headers": dict(response.headers.items()),
-            "body": body_json,
-        }
-
-
 def parse_float(value: Optional[str]) -> Optional[float]:
     if value is None or value == "":
         return None
@@ -103,6 +76,15 @@ def parse_int_list(value: Optional[str]) -> Optional[list[int]]:
     return items or None
 
 
+def parse_int(value: Optional[str]) -> Optional[int]:
+    if value is None or value.strip() == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
 def prune_none(obj: Any) -> Any:
     if isinstance(obj, dict):
         return {k: prune_none(v) for k, v in obj.items() if v is not None}
@@ -111,6 +93,111 @@ def prune_none(obj: Any) -> Any:
     return obj
 
 
+def default_package_weight(env: Dict[str, str]) -> float:
+    weight = parse_float(env.get("USPS_PACKAGE_WEIGHT"))
+    if weight is None:
+        weight = parse_float(env.get("USPS_WEIGHT_LBS"))
+    if weight is None:
+        weight = parse_float(env.get("USPS_WEIGHT_OZ"))
+    return weight if weight is not None else 2.0
+
+
+def build_base_rates_payload(env: Dict[str, str], weight: float, today: str) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {
+        "originZIPCode": env.get("USPS_ORIGIN_ZIP", "22407"),
+        "foreignPostalCode": env.get("USPS_FOREIGN_POSTAL", "10109"),
+        "destinationCountryCode": env.get("USPS_DESTINATION_COUNTRY_CODE", "CA"),
+        "destinationEntryFacilityType": env.get("USPS_DEST_ENTRY_FACILITY", "NONE"),
+        "weight": weight,
+        "length": parse_float(env.get("USPS_DIM_LENGTH")) or 9.0,
+        "width": parse_float(env.get("USPS_DIM_WIDTH")) or 6.0,
+        "height": parse_float(env.get("USPS_DIM_HEIGHT")) or 4.0,
+        "mailClass": env.get("USPS_MAIL_CLASS", "PRIORITY_MAIL_INTERNATIONAL"),
+        "processingCategory": env.get("USPS_PROCESSING_CATEGORY", "MACHINABLE"),
+        "rateIndicator": env.get("USPS_RATE_INDICATOR", "SP"),
+        "priceType": env.get("USPS_PRICE_TYPE", "COMMERCIAL"),
+        "accountType": env.get("USPS_ACCOUNT_TYPE", "EPS"),
+        "accountNumber": env.get("USPS_ACCOUNT_NUMBER", "1234567890"),
+        "mailingDate": env.get("USPS_MAILING_DATE", today),
+    }
+    return prune_none(payload)
+
+
+def build_base_rates_list_payload(env: Dict[str, str], base_rates_payload: Dict[str, Any], weight: float) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {
+        "originZIPCode": base_rates_payload.get("originZIPCode"),
+        "foreignPostalCode": base_rates_payload.get("foreignPostalCode"),
+        "destinationCountryCode": base_rates_payload.get("destinationCountryCode"),
+        "weight": weight,
+        "length": base_rates_payload.get("length"),
+        "width": base_rates_payload.get("width"),
+        "height": base_rates_payload.get("height"),
+        "mailClass": env.get("USPS_MAIL_CLASS", "PRIORITY_MAIL_INTERNATIONAL"),
+        "priceType": env.get("USPS_PRICE_TYPE", "COMMERCIAL"),
+        "accountType": base_rates_payload.get("accountType"),
+        "accountNumber": base_rates_payload.get("accountNumber"),
+        "mailingDate": base_rates_payload.get("mailingDate"),
+    }
+    return prune_none(payload)
+
+
+def build_total_rates_payload(env: Dict[str, str], base_rates_payload: Dict[str, Any], weight: float) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {
+        "originZIPCode": base_rates_payload.get("originZIPCode"),
+        "foreignPostalCode": base_rates_payload.get("foreignPostalCode"),
+        "destinationCountryCode": base_rates_payload.get("destinationCountryCode"),
+        "weight": weight,
+        "length": base_rates_payload.get("length"),
+        "width": base_rates_payload.get("width"),
+        "height": base_rates_payload.get("height"),
+        "mailClass": base_rates_payload.get("mailClass"),
+        "priceType": base_rates_payload.get("priceType"),
+        "mailingDate": base_rates_payload.get("mailingDate"),
+        "accountType": base_rates_payload.get("accountType"),
+        "accountNumber": base_rates_payload.get("accountNumber"),
+        "itemValue": parse_float(env.get("USPS_ITEM_VALUE")) or 300.0,
+        "extraServices": parse_int_list(env.get("USPS_EXTRA_SERVICES")) or None,
+        "processingCategory": base_rates_payload.get("processingCategory"),
+        "rateIndicator": base_rates_payload.get("rateIndicator"),
+    }
+    return prune_none(payload)
+
+
+async def fetch_quote(client: AsyncUspsClient, url: str, payload: Dict[str, Any], cache: Optional[ResponseCache]) -> Dict[str, Any]:
+    if cache is not None:
+        hit = cache.get(url, payload)
+        if hit is not None:
+            return dict(hit, cached=True)
+    response = await client.post_json(url, payload)
+    if cache is not None:
+        cache.put(url, payload, response)
+    return response
+
+
+async def fetch_concurrently(client: AsyncUspsClient, calls: List[Tuple[str, Dict[str, Any]]], cache: Optional[ResponseCache] = None) -> List[Any]:
+    async with client:
+        return await asyncio.gather(*(fetch_quote(client, url, payload, cache) for url, payload in calls), return_exceptions=True)
+
+
+def extra_service_outcome(code: int, outcome: Any) -> Tuple[Dict[str, Any], Optional[str]]:
+    if isinstance(outcome, urllib.error.HTTPError):
+        body = outcome.read().decode("utf-8", errors="replace") if outcome.fp else ""
+        result = {
+            "status": outcome.code,
+            "headers": compact_headers(outcome.headers),
+            "body": {"raw": body},
+            "timings": getattr(outcome, "timings", None),
+        }
+        return result, f"Extra service {code} request failed with HTTP {outcome.code}"
+    if isinstance(outcome, urllib.error.URLError):
+        return {"status": "connection_error", "body": {"message": str(outcome.reason)}}, f"Extra service {code} connection error: {outcome.reason}"
+    if isinstance(outcome, BaseException):
+        return {"status": "error", "body": {"message": str(outcome)}}, f"Extra service {code} request failed: {outcome}"
+    if outcome.get("status") != 200:
+        return outcome, f"Extra service {code} failed with status {outcome.get('status')}"
+    return outcome, None
+
+
 def main() -> int:
     env_file = os.environ.get("ENV_FILE", ".env.local")
     results: Dict[str, Any] = {
@@ -142,6 +229,13 @@ def main() -> int:
         exit_code = 1
         env = {}
 
+    try:
+        sink = build_sink(env)
+    except (OSError, ValueError) as exc:
+        results["errors"].append(f"Failed to open results sink: {exc}")
+        exit_code = 1
+        sink = None
+
     missing = [key for key in REQUIRED_ENV_KEYS if not env.get(key)]
     if missing:
         results["errors"].append(f"Missing required env values: {', '.join(missing)}")
@@ -171,18 +265,21 @@ def main() -> int:
             results["totalRatesUrl"] = total_rates_url
 
             try:
-                auth_payload = {
-                    "grant_type": "client_credentials",
-                    "client_id": env["USPS_CLIENT_ID"],
-                    "client_secret": env["USPS_CLIENT_SECRET"],
-                }
-                results["auth"] = http_post_form(auth_url, auth_payload)
+                configure_rate_limiter(env)
+                token_provider = get_token_provider(
+                    base_url,
+                    env["USPS_CLIENT_ID"],
+                    env["USPS_CLIENT_SECRET"],
+                    cache_path=env.get("USPS_TOKEN_CACHE"),
+                )
+                results["auth"] = token_provider.authenticate()
             except urllib.error.HTTPError as err:
                 body = err.read().decode("utf-8", errors="replace") if err.fp else ""
                 results["auth"] = {
                     "status": err.code,
-                    "headers": dict(err.headers.items()) if err.headers else {},
+                    "headers": compact_headers(err.headers),
                     "body": {"raw": body},
+                    "timings": getattr(err, "timings", None),
                 }
                 results["errors"].append(f"Auth request failed with HTTP {err.code}")
                 exit_code = 1
@@ -205,163 +302,102 @@ def main() -> int:
             auth_body = results["auth"].get("body") if isinstance(results["auth"], dict) else None
             if isinstance(auth_body, dict):
                 token = auth_body.get("access_token")
+            results["auth"] = record_call(sink, "auth", results["auth"])
 
             if token:
                 today = datetime.utcnow().date().isoformat()
-                default_weight = parse_float(env.get("USPS_PACKAGE_WEIGHT"))
-                if default_weight is None:
-                    default_weight = parse_float(env.get("USPS_WEIGHT_LBS"))
-                if default_weight is None:
-                    default_weight = parse_float(env.get("USPS_WEIGHT_OZ"))
-                if default_weight is None:
-                    default_weight = 2.0
-
-                base_rates_payload: Dict[str, Any] = {
-                    "originZIPCode": env.get("USPS_ORIGIN_ZIP", "22407"),
-                    "foreignPostalCode": env.get("USPS_FOREIGN_POSTAL", "10109"),
-                    "destinationCountryCode": env.get("USPS_DESTINATION_COUNTRY_CODE", "CA"),
-                    "destinationEntryFacilityType": env.get("USPS_DEST_ENTRY_FACILITY", "NONE"),
-                    "weight": default_weight,
-                    "length": parse_float(env.get("USPS_DIM_LENGTH")) or 9.0,
-                    "width": parse_float(env.get("USPS_DIM_WIDTH")) or 6.0,
-                    "height": parse_float(env.get("USPS_DIM_HEIGHT")) or 4.0,
-                    "mailClass": env.get("USPS_MAIL_CLASS", "PRIORITY_MAIL_INTERNATIONAL"),
-                    "processingCategory": env.get("USPS_PROCESSING_CATEGORY", "MACHINABLE"),
-                    "rateIndicator": env.get("USPS_RATE_INDICATOR", "SP"),
-                    "priceType": env.get("USPS_PRICE_TYPE", "COMMERCIAL"),
-                    "accountType": env.get("USPS_ACCOUNT_TYPE", "EPS"),
-                    "accountNumber": env.get("USPS_ACCOUNT_NUMBER", "1234567890"),
-                    "mailingDate": env.get("USPS_MAILING_DATE", today),
-                }
-                base_rates_payload = prune_none(base_rates_payload)
-
-                base_rates_list_payload: Dict[str, Any] = {
-                    "originZIPCode": base_rates_payload.get("originZIPCode"),
-                    "foreignPostalCode": base_rates_payload.get("foreignPostalCode"),
-                    "destinationCountryCode": base_rates_payload.get("destinationCountryCode"),
-                    "weight": default_weight,
-                    "length": base_rates_payload.get("length"),
-                    "width": base_rates_payload.get("width"),
-                    "height": base_rates_payload.get("height"),
-                    "mailClass": env.get("USPS_MAIL_CLASS", "PRIORITY_MAIL_INTERNATIONAL"),
-                    "priceType": env.get("USPS_PRICE_TYPE", "COMMERCIAL"),
-                    "accountType": base_rates_payload.get("accountType"),
-                    "accountNumber": base_rates_payload.get("accountNumber"),
-                    "mailingDate": base_rates_payload.get("mailingDate"),
-                }
-                base_rates_list_payload = prune_none(base_rates_list_payload)
+                default_weight = default_package_weight(env)
+                base_rates_payload = build_base_rates_payload(env, default_weight, today)
+                bucketer = build_bucketer(env)
 
-                total_rates_payload: Dict[str, Any] = {
-                    "originZIPCode": base_rates_payload.get("originZIPCode"),
-                    "foreignPostalCode": base_rates_payload.get("foreignPostalCode"),
-                    "destinationCountryCode": base_rates_payload.get("destinationCountryCode"),
-                    "weight": default_weight,
-                    "length": base_rates_payload.get("length"),
-                    "width": base_rates_payload.get("width"),
-                    "height": base_rates_payload.get("height"),
-                    "mailClass": base_rates_payload.get("mailClass"),
-                    "priceType": base_rates_payload.get("priceType"),
-                    "mailingDate": base_rates_payload.get("mailingDate"),
-                    "accountType": base_rates_payload.get("accountType"),
-                    "accountNumber": base_rates_payload.get("accountNumber"),
-                    "itemValue": parse_float(env.get("USPS_ITEM_VALUE")) or 300.0,
-                    "extraServices": parse_int_list(env.get("USPS_EXTRA_SERVICES")) or None,
-                    "processingCategory": base_rates_payload.get("processingCategory"),
-                    "rateIndicator": base_rates_payload.get("rateIndicator"),
-                }
-                total_rates_payload = prune_none(total_rates_payload)
+                base_rates_list_payload = build_base_rates_list_payload(env, base_rates_payload, default_weight)
+                total_rates_payload = build_total_rates_payload(env, base_rates_payload, default_weight)
 
                 headers = {
                     "Authorization": f"Bearer {token}",
                 }
 
-                try:
-                    results["baseRates"] = http_post_json(base_rates_url, base_rates_payload, headers=headers)
-                    if results["baseRates"].get("status") != 200:
+                quote_calls = [
+                    ("baseRates", "Base rates request", base_rates_url, base_rates_payload),
+                    ("baseRatesList", "Base rates list request", base_rates_list_url, base_rates_list_payload),
+                    ("totalRates", "Total rates request", total_rates_url, total_rates_payload),
+                ]
+
+                # With a local rate table, a fresh list quote is answered in-process and the table is
+                # re-harvested from live list responses (plus any USPS_RATE_TABLE_WEIGHTS sweep).
+                rate_table = RateTable.load(env["USPS_RATE_TABLE_PATH"]) if env.get("USPS_RATE_TABLE_PATH") else None
+                harvest_payloads: List[Dict[str, Any]] = []
+                if rate_table is not None:
+                    local_rates = rate_table.quote(
+                        base_rates_list_payload.get("destinationCountryCode", ""),
+                        base_rates_list_payload.get("mailClass", ""),
+                        base_rates_list_payload.get("priceType", ""),
+                        default_weight,
+                        base_rates_list_payload.get("rateIndicator"),
+                    )
+                    if local_rates is not None:
+                        # Recorded like a live call; "source" tells local answers apart in the sink.
+                        results["baseRatesList"] = record_call(
+                            sink, "baseRatesList", {"status": 200, "source": "rateTable", "body": {"rateOptions": [{"rates": local_rates}]}}
+                        )
+                        quote_calls = [call for call in quote_calls if call[0] != "baseRatesList"]
+                    for sweep_weight in parse_int_list(env.get("USPS_RATE_TABLE_WEIGHTS")) or []:
+                        harvest_payloads.append(dict(base_rates_list_payload, weight=float(sweep_weight)))
+                # The three quotes are independent, so issue them concurrently.
+                client = AsyncUspsClient(
+                    base_url,
+                    token_provider=token_provider,
+                    concurrency=parse_int(env.get("USPS_CONCURRENCY")) or len(quote_calls),
+                )
+                price_cache = build_response_cache(env, bucketer=bucketer)
+                calls = [(url, payload) for _, _, url, payload in quote_calls]
+                calls.extend((base_rates_list_url, payload) for payload in harvest_payloads)
+                outcomes = asyncio.run(fetch_concurrently(client, calls, price_cache))
+                if rate_table is not None:
+                    harvested = 0
+                    for (url, payload), outcome in zip(calls, outcomes):
+                        if url == base_rates_list_url and isinstance(outcome, dict) and outcome.get("status") == 200:
+                            harvested += rate_table.harvest(payload, outcome.get("body"))
+                    rate_table.save(env["USPS_RATE_TABLE_PATH"])
+                    results["rateTable"] = dict(rate_table.freshness(), harvestedRows=harvested)
+                total_body = None
+                for (key, label, _, _), outcome in zip(quote_calls, outcomes):
+                    try:
+                        if isinstance(outcome, BaseException):
+                            raise outcome
+                        results[key] = outcome
+                        if results[key].get("status") != 200:
+                            exit_code = 1
+                    except urllib.error.HTTPError as err:
+                        body = err.read().decode("utf-8", errors="replace") if err.fp else ""
+                        results[key] = {
+                            "status": err.code,
+                            "headers": compact_headers(err.headers),
+                            "body": {"raw": body},
+                            "timings": getattr(err, "timings", None),
+                        }
+                        results["errors"].append(f"{label} failed with HTTP {err.code}")
                         exit_code = 1
-                except urllib.error.HTTPError as err:
-                    body = err.read().decode("utf-8", errors="replace") if err.fp else ""
-                    results["baseRates"] = {
-                        "status": err.code,
-                        "headers": dict(err.headers.items()) if err.headers else {},
-                        "body": {"raw": body},
-                    }
-                    results["errors"].append(f"Base rates request failed with HTTP {err.code}")
-                    exit_code = 1
-                except urllib.error.URLError as err:
-                    results["baseRates"] = {
-                        "status": "connection_error",
-                        "body": {"message": str(err.reason)},
-                    }
-                    results["errors"].append(f"Base rates request connection error: {err.reason}")
-                    exit_code = 1
-                except Exception as exc:
-                    results["baseRates"] = {
-                        "status": "error",
-                        "body": {"message": str(exc)},
-                    }
-                    results["errors"].append(f"Base rates request failed: {exc}")
-                    exit_code = 1
-
-                try:
-                    results["baseRatesList"] = http_post_json(base_rates_list_url, base_rates_list_payload, headers=headers)
-                    if results["baseRatesList"].get("status") != 200:
+                    except urllib.error.URLError as err:
+                        results[key] = {
+                            "status": "connection_error",
+                            "body": {"message": str(err.reason)},
+                        }
+                        results["errors"].append(f"{label} connection error: {err.reason}")
                         exit_code = 1
-                except urllib.error.HTTPError as err:
-                    body = err.read().decode("utf-8", errors="replace") if err.fp else ""
-                    results["baseRatesList"] = {
-                        "status": err.code,
-                        "headers": dict(err.headers.items()) if err.headers else {},
-                        "body": {"raw": body},
-                    }
-                    results["errors"].append(f"Base rates list request failed with HTTP {err.code}")
-                    exit_code = 1
-                except urllib.error.URLError as err:
-                    results["baseRatesList"] = {
-                        "status": "connection_error",
-                        "body": {"message": str(err.reason)},
-                    }
-                    results["errors"].append(f"Base rates list connection error: {err.reason}")
-                    exit_code = 1
-                except Exception as exc:
-                    results["baseRatesList"] = {
-                        "status": "error",
-                        "body": {"message": str(exc)},
-                    }
-                    results["errors"].append(f"Base rates list request failed: {exc}")
-                    exit_code = 1
-
-                try:
-                    results["totalRates"] = http_post_json(total_rates_url, total_rates_payload, headers=headers)
-                    if results["totalRates"].get("status") != 200:
+                    except Exception as exc:
+                        results[key] = {
+                            "status": "error",
+                            "body": {"message": str(exc)},
+                        }
+                        results["errors"].append(f"{label} failed: {exc}")
                         exit_code = 1
-                except urllib.error.HTTPError as err:
-                    body = err.read().decode("utf-8", errors="replace") if err.fp else ""
-                    results["totalRates"] = {
-                        "status": err.code,
-                        "headers": dict(err.headers.items()) if err.headers else {},
-                        "body": {"raw": body},
-                    }
-                    results["errors"].append(f"Total rates request failed with HTTP {err.code}")
-                    exit_code = 1
-                except urllib.error.URLError as err:
-                    results["totalRates"] = {
-                        "status": "connection_error",
-                        "body": {"message": str(err.reason)},
-                    }
-                    results["errors"].append(f"Total rates connection error: {err.reason}")
-                    exit_code = 1
-                except Exception as exc:
-                    results["totalRates"] = {
-                        "status": "error",
-                        "body": {"message": str(exc)},
-                    }
-                    results["errors"].append(f"Total rates request failed: {exc}")
-                    exit_code = 1
+                    if key == "totalRates":
+                        total_body = results[key].get("body")
+                    results[key] = record_call(sink, key, results[key])
 
                 # Discover eligible extra services from total rates if available
                 discovered_extras: list[int] = []
-                total_body = results["totalRates"].get("body") if isinstance(results["totalRates"], dict) else None
                 if isinstance(total_body, dict):
                     rate_options = total_body.get("rateOptions")
                     if isinstance(rate_options, list):
@@ -401,49 +437,85 @@ def main() -> int:
 
                 extra_errors: list[str] = []
                 allowed_codes = {813, 820, 826, 857, 930, 931, 955}
+                eligibility = EligibilityCache(env["USPS_EXTRA_SERVICE_CACHE"]) if env.get("USPS_EXTRA_SERVICE_CACHE") else None
+                route = EligibilityCache.route_key(base_extra_payload.get("destinationCountryCode"), base_extra_payload.get("mailClass"))
+                probe_codes: list[int] = []
                 for code in candidate_codes:
                     if code not in allowed_codes:
                         extra_errors.append(f"Skipping extra service {code} not allowed by schema")
-                        continue
-                    extra_payload = dict(base_extra_payload)
-                    extra_payload["extraService"] = code
+                    elif eligibility is not None and eligibility.known_ineligible(route, code):
+                        extra_errors.append(f"Skipping extra service {code} previously rejected for {route}")
+                    else:
+                        probe_codes.append(code)
+
+                if (env.get("USPS_EXTRA_SERVICE_PROBE") or "").strip().lower() == "concurrent":
+                    # Probe every eligible code at once and keep each result; the reported rate is
+                    # still the first success in candidate order.
+                    probe_client = AsyncUspsClient(
+                        base_url,
+                        token_provider=token_provider,
+                        concurrency=parse_int(env.get("USPS_CONCURRENCY")) or max(1, len(probe_codes)),
+                    )
+                    probe_calls = [(extra_service_url, dict(base_extra_payload, extraService=code)) for code in probe_codes]
+                    probe_outcomes = asyncio.run(fetch_concurrently(probe_client, probe_calls, price_cache)) if probe_calls else []
+                    results["extraServiceProbes"] = {}
+                    for code, outcome in zip(probe_codes, probe_outcomes):
+                        call_result, error = extra_service_outcome(code, outcome)
+                        record_call(sink, "extraServiceRates", dict(call_result, extraService=code))
+                        kept = call_summary(call_result) if sink is not None else call_result
+                        results["extraServiceProbes"][str(code)] = kept
+                        if eligibility is not None:
+                            eligibility.record(route, code, call_result.get("status"))
+                        if error:
+                            extra_errors.append(error)
+                        if results["extraServiceRates"] is None or results["extraServiceRates"].get("status") != 200:
+                            results["extraServiceRates"] = kept
+                else:
+                    for code in probe_codes:
+                        extra_payload = dict(base_extra_payload)
+                        extra_payload["extraService"] = code
+                        try:
+                            outcome: Any = cached_post(
+                                price_cache,
+                                extra_service_url,
+                                extra_payload,
+                                lambda: http_post_json(extra_service_url, extra_payload, headers=headers),
+                            )
+                        except Exception as exc:
+                            outcome = exc
+                        call_result, error = extra_service_outcome(code, outcome)
+                        record_call(sink, "extraServiceRates", dict(call_result, extraService=code))
+                        results["extraServiceRates"] = call_summary(call_result) if sink is not None else call_result
+                        if eligibility is not None:
+                            eligibility.record(route, code, call_result.get("status"))
+                        if not error:
+                            break
+                        extra_errors.append(error)
 
+                if eligibility is not None:
                     try:
-                        call_result = http_post_json(extra_service_url, extra_payload, headers=headers)
-                        results["extraServiceRates"] = call_result
-                        if call_result.get("status") == 200:
-                            break
-                        extra_errors.append(f"Extra service {code} failed with status {call_result.get('status')}")
-                    except urllib.error.HTTPError as err:
-                        body = err.read().decode("utf-8", errors="replace") if err.fp else ""
-                        results["extraServiceRates"] = {
-                            "status": err.code,
-                            "headers": dict(err.headers.items()) if err.headers else {},
-                            "body": {"raw": body},
-                        }
-                        extra_errors.append(f"Extra service {code} request failed with HTTP {err.code}")
-                    except urllib.error.URLError as err:
-                        results["extraServiceRates"] = {
-                            "status": "connection_error",
-                            "body": {"message": str(err.reason)},
-                        }
-                        extra_errors.append(f"Extra service {code} connection error: {err.reason}")
-                    except Exception as exc:
-                        results["extraServiceRates"] = {
-                            "status": "error",
-                            "body": {"message": str(exc)},
-                        }
-                        extra_errors.append(f"Extra service {code} request failed: {exc}")
+                        eligibility.save()
+                    except OSError as exc:
+                        results["errors"].append(f"Failed to save extra service eligibility cache: {exc}")
 
                 if results.get("extraServiceRates") and results["extraServiceRates"].get("status") != 200:
                     if extra_errors:
                         results["errors"].extend(extra_errors)
                     exit_code = 1
+
+                if price_cache is not None:
+                    results["priceCache"] = price_cache.stats()
+                if bucketer is not None and env.get("USPS_RATE_TIERS_PATH"):
+                    bucketer.save(env["USPS_RATE_TIERS_PATH"])
             else:
                 if not results["errors"]:
                     results["errors"].append("Access token not returned from auth response")
                 exit_code = 1 if exit_code == 0 else exit_code
 
+    if sink is not None:
+        sink.close()
+        results["resultsSink"] = [str(segment) for segment in sink.segments]
+    results["latency"] = get_metrics().report()
     OUTPUT_PATH.parent.mkdir(parents=True, exist_ok=True)
     OUTPUT_PATH.write_text(json.dumps(results, indent=2), encoding="utf-8")
     return exit_code
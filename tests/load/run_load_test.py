@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+TESTS_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(TESTS_DIR))
+for harness_dir in ("domestic-labels", "international-prices", "scan-forms", "shipping-options"):
+    sys.path.insert(0, str(TESTS_DIR / harness_dir))
+
+from run_domestic_labels_test import build_default_label  # noqa: E402
+from run_international_prices_test import build_base_rates_payload, build_total_rates_payload, default_package_weight  # noqa: E402
+from run_scan_forms_test import build_request_body  # noqa: E402
+from run_shipping_options_test import build_payload  # noqa: E402
+from usps_client.auth import get_token_provider  # noqa: E402
+from usps_client.config import load_env, resolve_base_url  # noqa: E402
+from usps_client.metrics import LatencyHistogram, get_metrics  # noqa: E402
+from usps_client.ratelimit import configure_rate_limiter  # noqa: E402
+from usps_client.retry import get_retry_engine  # noqa: E402
+from usps_client.transport import configure_transport  # noqa: E402
+
+OUTPUT_PATH = Path(__file__).resolve().parent / "output" / "load-results.json"
+REQUIRED_ENV_KEYS = ["USPS_CLIENT_ID", "USPS_CLIENT_SECRET"]
+# Quotes only: label and SCAN form calls buy postage or manifest real labels, so they must be asked for.
+DEFAULT_MIX = "quote=75,totalRates=25"
+PAID_FLOWS = ("label", "scanForm")
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+DEFAULT_WORKERS = 256
+DEFAULT_MAX_OUTSTANDING = 10_000
+# A stage whose completions fall this far below its arrival rate could not keep up.
+THROUGHPUT_SHORTFALL = 0.95
+
+FLOW_PATHS = {
+    "quote": "shipments/v3/options/search",
+    "totalRates": "international-prices/v3/total-rates/search",
+    "label": "labels/v3/label",
+    "scanForm": "scan-forms/v3/scan-form",
+}
+
+
+def parse_mix(spec: str) -> List[Tuple[str, float]]:
+    mix: List[Tuple[str, float]] = []
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if not name:
+            continue
+        if name not in FLOW_PATHS:
+            raise ValueError(f"Unknown flow '{name}'; choose from {', '.join(FLOW_PATHS)}")
+        mix.append((name, float(weight or 1)))
+    if not mix or sum(weight for _, weight in mix) <= 0:
+        raise ValueError(f"Flow mix '{spec}' has no positive weights")
+    return mix
+
+
+def is_local(base_url: str) -> bool:
+    """Whether ``base_url`` is the mock server or another service on this machine."""
+    host = urllib.parse.urlsplit(base_url).hostname or ""
+    return host in LOCAL_HOSTS or host.endswith(".localhost")
+
+
+def build_flow_bodies(env: Dict[str, str], flows: List[str]) -> Dict[str, bytes]:
+    """Request bodies from the harness builders, serialized once so the generator measures USPS, not json.dumps."""
+    bodies: Dict[str, bytes] = {}
+    if "quote" in flows:
+        bodies["quote"] = json.dumps(build_payload(env)).encode("utf-8")
+    if "totalRates" in flows:
+        weight = default_package_weight(env)
+        base_rates_payload = build_base_rates_payload(env, weight, datetime.utcnow().date().isoformat())
+        bodies["totalRates"] = json.dumps(build_total_rates_payload(env, base_rates_payload, weight)).encode("utf-8")
+    if "label" in flows:
+        bodies["label"] = json.dumps(build_default_label(env)).encode("utf-8")
+    if "scanForm" in flows:
+        scan_env = dict(env)
+        if not scan_env.get("USPS_SCAN_LABEL_IDS") and not scan_env.get("USPS_SCAN_LABEL_TRACKINGS"):
+            scan_env["USPS_SCAN_LABEL_TRACKINGS"] = "9400100000000000000000"
+        errors: List[str] = []
+        body = build_request_body(scan_env, errors)
+        if body is None:
+            raise ValueError(f"Could not build a SCAN form request: {'; '.join(errors)}")
+        bodies["scanForm"] = json.dumps(body).encode("utf-8")
+    return bodies
+
+
+class StageRecorder:
+    """Outcomes of one arrival-rate stage, per flow.
+
+    ``latency`` is measured from the *intended* send time of each request, so time spent waiting behind
+    a slow response is charged to the requests that were delayed (coordinated-omission correction).
+    ``serviceTime`` is measured from the moment a worker actually sent the request.
+    """
+
+    def __init__(self, flows: List[str]):
+        self.latency = {flow: LatencyHistogram() for flow in flows}
+        self.service = {flow: LatencyHistogram() for flow in flows}
+        self.dispatch_lag = LatencyHistogram()
+        self.succeeded = {flow: 0 for flow in flows}
+        self.failed = {flow: 0 for flow in flows}
+        self.error_kinds: Dict[str, int] = {}
+        self.dropped = 0
+        self.outstanding = 0
+        self.peak_outstanding = 0
+        self.scheduled_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def begin(self) -> None:
+        with self._lock:
+            self.outstanding += 1
+            self.peak_outstanding = max(self.peak_outstanding, self.outstanding)
+
+    def finish(self, flow: str, intended: float, sent: float, error: Optional[str]) -> None:
+        done = time.perf_counter()
+        with self._lock:
+            self.outstanding -= 1
+            self.latency[flow].record((done - intended) * 1000)
+            self.service[flow].record((done - sent) * 1000)
+            if error is None:
+                self.succeeded[flow] += 1
+            else:
+                self.failed[flow] += 1
+                self.error_kinds[error] = self.error_kinds.get(error, 0) + 1
+
+
+def classify_error(exc: BaseException) -> str:
+    if isinstance(exc, urllib.error.HTTPError):
+        return f"HTTP {exc.code}"
+    if isinstance(exc, urllib.error.URLError):
+        return f"connection: {type(exc.reason).__name__ if isinstance(exc.reason, BaseException) else exc.reason}"
+    return type(exc).__name__
+
+
+def run_stage(
+    rps: float,
+    duration: float,
+    mix: List[Tuple[str, float]],
+    send: Callable[[str], None],
+    executor: ThreadPoolExecutor,
+    max_outstanding: int,
+    poisson: bool,
+    rng: random.Random,
+) -> StageRecorder:
+    """Issue requests on a fixed arrival schedule, whether or not earlier ones have completed (open loop)."""
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    recorder = StageRecorder(names)
+    total = max(1, int(round(rps * duration)))
+    start = time.perf_counter()
+    intended = start
+
+    def task(flow: str, scheduled: float) -> None:
+        sent = time.perf_counter()
+        error = None
+        try:
+            send(flow)
+        except Exception as exc:
+            error = classify_error(exc)
+        recorder.finish(flow, scheduled, sent, error)
+
+    for index in range(total):
+        if not poisson:
+            intended = start + index / rps
+        elif index:
+            intended += rng.expovariate(rps)
+        delay = intended - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        recorder.dispatch_lag.record(max(0.0, time.perf_counter() - intended) * 1000)
+        if recorder.outstanding >= max_outstanding:
+            # The client has fallen so far behind that queueing more would only measure the backlog.
+            recorder.dropped += 1
+            continue
+        flow = rng.choices(names, weights)[0]
+        recorder.begin()
+        executor.submit(task, flow, intended)
+    recorder.scheduled_seconds = intended - start
+    while recorder.outstanding:
+        time.sleep(0.01)
+    return recorder
+
+
+def summarize_stage(
+    rps: float,
+    recorder: StageRecorder,
+    slo_ms: Optional[float],
+    max_error_rate: float,
+) -> Dict[str, Any]:
+    completed = sum(recorder.succeeded.values()) + sum(recorder.failed.values())
+    failed = sum(recorder.failed.values())
+    overall = LatencyHistogram()
+    flows: Dict[str, Any] = {}
+    for flow, histogram in recorder.latency.items():
+        overall.merge(histogram)
+        count = recorder.succeeded[flow] + recorder.failed[flow]
+        if not count:
+            continue
+        flows[flow] = {
+            "requests": count,
+            "failed": recorder.failed[flow],
+            "latency": histogram.summary(),
+            "serviceTime": recorder.service[flow].summary(),
+        }
+    # The arrival window plus one typical response time; measuring to the last completion would let a single
+    # straggler (say, one 429 honouring Retry-After) make a healthy stage look saturated.
+    window = recorder.scheduled_seconds + 1.0 / rps + (overall.percentile(0.50) or 0.0) / 1000
+    achieved = completed / window
+    error_rate = (failed + recorder.dropped) / (completed + recorder.dropped) if completed + recorder.dropped else 0.0
+    p99 = overall.percentile(0.99)
+    reasons: List[str] = []
+    if achieved < rps * THROUGHPUT_SHORTFALL:
+        reasons.append(f"throughput {achieved:.1f}/s below target {rps:g}/s")
+    if recorder.dropped:
+        reasons.append(f"{recorder.dropped} requests dropped with {recorder.peak_outstanding} outstanding")
+    if slo_ms is not None and p99 is not None and p99 > slo_ms:
+        reasons.append(f"p99 {p99:.1f} ms above SLO {slo_ms:g} ms")
+    return {
+        "targetRps": rps,
+        "achievedRps": round(achieved, 1),
+        "requests": completed,
+        "failed": failed,
+        "dropped": recorder.dropped,
+        "errorRate": round(error_rate, 4),
+        "errorKinds": recorder.error_kinds,
+        "peakOutstanding": recorder.peak_outstanding,
+        "dispatchLagMs": recorder.dispatch_lag.summary(),
+        "latency": overall.summary(),
+        "flows": flows,
+        "saturated": bool(reasons),
+        "saturationReasons": reasons,
+        "errorThresholdExceeded": error_rate > max_error_rate,
+    }
+
+
+def parse_args(argv: Optional[List[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Open-loop load generator: replays a mix of harness flows at fixed arrival rates and reports "
+        "coordinated-omission-corrected latency, errors and the saturation point. Point ENV_FILE at the mock server "
+        "(tests/mock-server) unless you mean to load the real API."
+    )
+    parser.add_argument("--rps", default="10", help="Comma-separated arrival rates; each is run as a stage, e.g. 50,100,200,400")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per stage")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Flow weights from {', '.join(FLOW_PATHS)} (default {DEFAULT_MIX})")
+    parser.add_argument(
+        "--allow-paid",
+        action="store_true",
+        help="Allow label and scanForm flows against a non-local base URL; every label request buys postage",
+    )
+    parser.add_argument("--arrivals", choices=("uniform", "poisson"), default="uniform", help="Evenly spaced or Poisson arrivals")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Sender threads (and pooled connections per host)")
+    parser.add_argument("--max-outstanding", type=int, default=DEFAULT_MAX_OUTSTANDING, help="Drop arrivals beyond this many unfinished requests")
+    parser.add_argument("--slo-ms", type=float, default=None, help="A stage whose corrected p99 exceeds this is saturated")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="Error rate that marks the error point (default 0.01)")
+    parser.add_argument("--stop-on-saturation", action="store_true", help="Skip the remaining stages once one saturates")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for flow selection and Poisson arrivals")
+    parser.add_argument("--output", default=str(OUTPUT_PATH), help="Where to write the machine-readable results")
+    return parser.parse_args(argv)
+
+
+def write_results(results: Dict[str, Any], path: str) -> None:
+    output_path = Path(path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    env_file = os.environ.get("ENV_FILE", ".env.local")
+    results: Dict[str, Any] = {
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "envFile": env_file,
+        "baseUrl": None,
+        "settings": {
+            "mix": args.mix,
+            "allowPaid": args.allow_paid,
+            "arrivals": args.arrivals,
+            "durationSeconds": args.duration,
+            "workers": args.workers,
+            "sloMs": args.slo_ms,
+            "maxErrorRate": args.max_error_rate,
+        },
+        "stages": [],
+        "saturationRps": None,
+        "errorRps": None,
+        "errors": [],
+    }
+
+    try:
+        env = load_env(env_file)
+        mix = parse_mix(args.mix)
+        levels = [float(level) for level in args.rps.split(",") if level.strip()]
+    except (OSError, ValueError) as exc:
+        results["errors"].append(str(exc))
+        write_results(results, args.output)
+        return 1
+
+    flows = [name for name, _ in mix]
+    required = REQUIRED_ENV_KEYS + (["USPS_PAYMENT_TOKEN"] if "label" in flows else [])
+    missing = [key for key in required if not env.get(key)]
+    if missing:
+        results["errors"].append(f"Missing required env values: {', '.join(missing)}")
+        write_results(results, args.output)
+        return 1
+    base_url = resolve_base_url(env)
+    if not base_url:
+        results["errors"].append("Could not determine USPS API base URL from env")
+        write_results(results, args.output)
+        return 1
+    results["baseUrl"] = base_url
+    paid = [flow for flow in flows if flow in PAID_FLOWS]
+    if paid and not is_local(base_url) and not args.allow_paid:
+        results["errors"].append(
+            f"Refusing to send {', '.join(paid)} requests to {base_url}: they buy postage or manifest labels. "
+            "Point ENV_FILE at the mock server or pass --allow-paid."
+        )
+        write_results(results, args.output)
+        return 1
+
+    try:
+        bodies = build_flow_bodies(env, flows)
+    except ValueError as exc:
+        results["errors"].append(str(exc))
+        write_results(results, args.output)
+        return 1
+
+    transport = configure_transport(pool_size=args.workers)
+    configure_rate_limiter(env)
+    token_provider = get_token_provider(base_url, env["USPS_CLIENT_ID"], env["USPS_CLIENT_SECRET"], cache_path=env.get("USPS_TOKEN_CACHE"))
+    try:
+        token_provider.get_token()
+    except (urllib.error.HTTPError, urllib.error.URLError) as exc:
+        results["errors"].append(f"Auth request failed: {classify_error(exc)}")
+        write_results(results, args.output)
+        return 1
+
+    urls = {flow: urllib.parse.urljoin(base_url, FLOW_PATHS[flow]) for flow in flows}
+
+    def send(flow: str) -> None:
+        headers = {"Content-Type": "application/json", "Accept": "application/json", "Authorization": f"Bearer {token_provider.get_token()}"}
+        if flow == "label":
+            headers["X-Payment-Authorization-Token"] = env["USPS_PAYMENT_TOKEN"]
+        transport.request("POST", urls[flow], body=bodies[flow], headers=headers, timeout=40)
+
+    rng = random.Random(args.seed)
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for rps in levels:
+            recorder = run_stage(rps, args.duration, mix, send, executor, args.max_outstanding, args.arrivals == "poisson", rng)
+            stage = summarize_stage(rps, recorder, args.slo_ms, args.max_error_rate)
+            results["stages"].append(stage)
+            latency = stage["latency"]
+            print(
+                f"{rps:>8g} rps -> {stage['achievedRps']:>8.1f}/s  p50 {latency['p50Ms']} ms  p99 {latency['p99Ms']} ms  "
+                f"errors {stage['errorRate']:.2%}{'  SATURATED' if stage['saturated'] else ''}"
+            )
+            if stage["saturated"] and results["saturationRps"] is None:
+                results["saturationRps"] = rps
+            if stage["errorThresholdExceeded"] and results["errorRps"] is None:
+                results["errorRps"] = rps
+            if stage["saturated"] and args.stop_on_saturation:
+                break
+
+    results["endpointLatency"] = get_metrics().report()
+    results["circuitBreakers"] = get_retry_engine().breaker_states()
+    write_results(results, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
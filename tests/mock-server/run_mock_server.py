@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+import urllib.parse
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import uvloop  # type: ignore[import-not-found]
+except ImportError:
+    uvloop = None
+
+TESTS_DIR = Path(__file__).resolve().parents[1]
+MAX_HEADER_BYTES = 64 * 1024
+
+CANNED_RATE = {
+    "SKU": "DPXX0XXXXX07200",
+    "description": "Priority Mail International",
+    "priceType": "COMMERCIAL",
+    "price": 54.35,
+    "weight": 2.0,
+    "dimWeight": 0,
+    "fees": [],
+    "startDate": "2025-01-19",
+    "endDate": "",
+    "mailClass": "PRIORITY_MAIL_INTERNATIONAL",
+    "zone": "01",
+}
+CANNED_EXTRA_SERVICE = {"extraService": "930", "name": "Insurance <= $500", "SKU": "DXIX0XXXXXX0000", "priceType": "COMMERCIAL", "price": 5.25, "warnings": []}
+# Smallest well-formed single-page PDF, used when no recorded label artifact is available.
+CANNED_PDF = (
+    b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+    b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 288 432]>>endobj\n"
+    b"trailer<</Root 1 0 R>>\n%%EOF\n"
+)
+
+# route name -> (path suffix, recording file relative to tests/, result key, canned JSON body or None for a label)
+ROUTES: Dict[str, Tuple[str, Optional[str], Optional[str], Optional[Dict[str, Any]]]] = {
+    "token": ("oauth2/v3/token", None, None, {"access_token": "mock-access-token", "token_type": "Bearer", "expires_in": 28800, "scope": "mock"}),
+    "label": ("labels/v3/label", "domestic-labels/output/domestic-labels-result.json", "label", None),
+    "internationalLabel": ("international-labels/v3/international-label", "international-labels/output/international-labels-result.json", "label", None),
+    "baseRates": (
+        "international-prices/v3/base-rates/search",
+        "international-prices/output/international-prices-result.json",
+        "baseRates",
+        {"totalBasePrice": 54.35, "rates": [CANNED_RATE]},
+    ),
+    "baseRatesList": (
+        "international-prices/v3/base-rates-list/search",
+        "international-prices/output/international-prices-result.json",
+        "baseRatesList",
+        {"rateOptions": [{"totalBasePrice": 54.35, "rates": [CANNED_RATE]}]},
+    ),
+    "extraServiceRates": (
+        "international-prices/v3/extra-service-rates/search",
+        "international-prices/output/international-prices-result.json",
+        "extraServiceRates",
+        CANNED_EXTRA_SERVICE,
+    ),
+    "totalRates": (
+        "international-prices/v3/total-rates/search",
+        "international-prices/output/international-prices-result.json",
+        "totalRates",
+        {"rateOptions": [{"totalBasePrice": 54.35, "totalPrice": 59.6, "rates": [CANNED_RATE], "extraServices": [CANNED_EXTRA_SERVICE]}]},
+    ),
+    "shippingOptions": (
+        "shipments/v3/options/search",
+        "shipping-options/output/shipping-options-result.json",
+        "shippingOptions",
+        {
+            "originZIPCode": "22407",
+            "destinationZIPCode": "10001",
+            "pricingOptions": [
+                {
+                    "shippingOptions": [
+                        {
+                            "mailClass": "USPS_GROUND_ADVANTAGE",
+                            "rateOptions": [{"totalBasePrice": 8.45, "rates": [dict(CANNED_RATE, mailClass="USPS_GROUND_ADVANTAGE", price=8.45)]}],
+                        }
+                    ]
+                }
+            ],
+        },
+    ),
+    "scanForm": (
+        "scan-forms/v3/scan-form",
+        "scan-forms/output/scan-forms-result.json",
+        "scanForm",
+        {"SCANFormMetadata": {"SCANFormNumber": "9475711201080212345678", "mailingDate": "2025-01-20", "labelCount": 1}},
+    ),
+    "address": (
+        "addresses/v3/address",
+        None,
+        None,
+        {
+            "firm": "",
+            "address": {
+                "streetAddress": "475 L ENFANT PLZ SW",
+                "secondaryAddress": "",
+                "city": "WASHINGTON",
+                "state": "DC",
+                "ZIPCode": "20260",
+                "ZIPPlus4": "0004",
+            },
+            "additionalInfo": {"deliveryPoint": "75", "carrierRoute": "C000", "DPVConfirmation": "Y", "business": "Y", "vacant": "N"},
+            "corrections": [],
+            "matches": [{"code": "31", "text": "Single Response - exact match"}],
+        },
+    ),
+}
+
+
+def http_response(status: int, reason: str, body: bytes, content_type: str, extra_headers: Optional[Dict[str, str]] = None) -> bytes:
+    headers = {"Content-Type": content_type, "Content-Length": str(len(body)), "Connection": "keep-alive"}
+    if extra_headers:
+        headers.update(extra_headers)
+    head = f"HTTP/1.1 {status} {reason}\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
+    return head.encode("latin-1") + body
+
+
+def json_response(status: int, reason: str, body: Any, extra_headers: Optional[Dict[str, str]] = None) -> bytes:
+    return http_response(status, reason, json.dumps(body, separators=(",", ":")).encode("utf-8"), "application/json", extra_headers)
+
+
+def multipart_response(status: int, reason: str, parts: List[Tuple[str, bytes]], boundary: str = "usps-mock-label") -> bytes:
+    """A ``multipart/mixed`` reply, the shape of a label response: JSON metadata first, then the label image."""
+    body = b"".join(
+        f"--{boundary}\r\nContent-Type: {content_type}\r\n\r\n".encode("latin-1") + data + b"\r\n" for content_type, data in parts
+    )
+    return http_response(status, reason, body + f"--{boundary}--\r\n".encode("latin-1"), f"multipart/mixed; boundary={boundary}")
+
+
+def load_recorded(recordings_dir: Path, relative: Optional[str], key: Optional[str]) -> Optional[Tuple[bytes, str]]:
+    """The recorded successful body for a route, as (bytes, content type); None if nothing usable was recorded."""
+    if not relative or not key:
+        return None
+    try:
+        recorded = json.loads((recordings_dir / relative).read_text(encoding="utf-8")).get(key)
+    except (OSError, ValueError, AttributeError):
+        return None
+    if not isinstance(recorded, dict) or recorded.get("status") != 200:
+        return None
+    saved = recorded.get("savedLabel")
+    if saved:
+        path = Path(saved) if Path(saved).is_absolute() else recordings_dir / saved
+        try:
+            content_type = "application/pdf" if path.suffix.lower() == ".pdf" else "image/tiff" if path.suffix.lower() in (".tif", ".tiff") else "application/octet-stream"
+            return path.read_bytes(), content_type
+        except OSError:
+            return None
+    body = recorded.get("body")
+    if isinstance(body, dict) and "raw" not in body:
+        return json.dumps(body, separators=(",", ":")).encode("utf-8"), "application/json"
+    return None
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """``fixed:MS``, ``uniform:LO:HI``, ``normal:MEAN:SD``, ``lognormal:MEDIAN:SIGMA`` or ``exponential:MEAN`` -> sampler in seconds."""
+    kind, *raw_args = spec.split(":")
+    args = [float(arg) for arg in raw_args]
+    kind = kind.strip().lower()
+    if kind == "fixed":
+        return lambda rng: args[0] / 1000.0
+    if kind == "uniform":
+        return lambda rng: rng.uniform(args[0], args[1]) / 1000.0
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(args[0], args[1])) / 1000.0
+    if kind == "lognormal":
+        mu = math.log(args[0])
+        return lambda rng: rng.lognormvariate(mu, args[1]) / 1000.0
+    if kind == "exponential":
+        return lambda rng: rng.expovariate(1.0 / args[0]) / 1000.0 if args[0] > 0 else 0.0
+    raise ValueError(f"Unknown latency distribution '{spec}'")
+
+
+class MockServer:
+    """Keep-alive HTTP/1.1 server on asyncio streams; responses are pre-rendered per route so serving is a dict lookup."""
+
+    def __init__(
+        self,
+        recordings_dir: Path = TESTS_DIR,
+        latency: Optional[Callable[[random.Random], float]] = None,
+        route_latency: Optional[Dict[str, Callable[[random.Random], float]]] = None,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        throttle_rate: float = 0.0,
+        retry_after: int = 1,
+        quota: Optional[float] = None,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.route_latency = route_latency or {}
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.quota = quota
+        self.rng = random.Random(seed)
+        self.responses: Dict[str, bytes] = {}
+        # Label routes are rendered per request so each label gets its own tracking number.
+        self.labels: Dict[str, Tuple[bytes, str]] = {}
+        # Start from the clock so a restarted mock does not reissue tracking numbers.
+        self.labels_issued = time.time_ns() // 1000
+        self.sources: Dict[str, str] = {}
+        self.by_suffix: List[Tuple[str, str]] = []
+        for name, (suffix, relative, key, canned) in ROUTES.items():
+            recorded = load_recorded(recordings_dir, relative, key)
+            if recorded is not None:
+                body, content_type = recorded
+                self.sources[name] = "recorded"
+            elif canned is None:
+                body, content_type = CANNED_PDF, "application/pdf"
+                self.sources[name] = "canned"
+            else:
+                body, content_type = json.dumps(canned, separators=(",", ":")).encode("utf-8"), "application/json"
+                self.sources[name] = "canned"
+            self.responses[name] = http_response(200, "OK", body, content_type)
+            if canned is None:
+                self.labels[name] = (body, content_type)
+            self.by_suffix.append(("/" + suffix, name))
+        self.error_response = json_response(error_status, "Service Unavailable", {"error": {"code": str(error_status), "message": "Injected failure"}})
+        self.throttle_response = json_response(
+            429, "Too Many Requests", {"error": {"code": "429", "message": "Quota exceeded"}}, {"Retry-After": str(retry_after)}
+        )
+        self.not_found_response = json_response(404, "Not Found", {"error": {"code": "404", "message": "Unknown route"}})
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self.started_at = time.monotonic()
+        self._quota_tokens = quota or 0.0
+        self._quota_updated = time.monotonic()
+        self._route_cache: Dict[str, Optional[str]] = {}
+
+    def route_for(self, path: str) -> Optional[str]:
+        cached = self._route_cache.get(path, ...)
+        if cached is not ...:
+            return cached  # type: ignore[return-value]
+        route = next((name for suffix, name in self.by_suffix if path.endswith(suffix)), None)
+        if len(self._route_cache) < 4096:
+            self._route_cache[path] = route
+        return route
+
+    def _over_quota(self) -> bool:
+        if not self.quota:
+            return False
+        now = time.monotonic()
+        self._quota_tokens = min(self.quota, self._quota_tokens + (now - self._quota_updated) * self.quota)
+        self._quota_updated = now
+        if self._quota_tokens < 1:
+            return True
+        self._quota_tokens -= 1
+        return False
+
+    def _count(self, route: str, status: int) -> None:
+        counts = self.stats.setdefault(route, {})
+        counts[str(status)] = counts.get(str(status), 0) + 1
+
+    def stats_response(self) -> bytes:
+        elapsed = time.monotonic() - self.started_at
+        total = sum(sum(counts.values()) for counts in self.stats.values())
+        return json_response(200, "OK", {"uptimeSeconds": round(elapsed, 3), "requests": total, "routes": self.stats, "sources": self.sources})
+
+    async def respond(self, method: str, path: str) -> bytes:
+        if path == "/__stats":
+            return self.stats_response()
+        route = self.route_for(path)
+        if route is None:
+            self._count("unknown", 404)
+            return self.not_found_response
+        if route != "token" and (self._over_quota() or (self.throttle_rate and self.rng.random() < self.throttle_rate)):
+            self._count(route, 429)
+            return self.throttle_response
+        sampler = self.route_latency.get(route, self.latency)
+        if sampler is not None:
+            delay = sampler(self.rng)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self._count(route, self.error_status)
+            return self.error_response
+        self._count(route, 200)
+        if route in self.labels:
+            return self.label_response(route)
+        return self.responses[route]
+
+    def label_response(self, route: str) -> bytes:
+        """The route's label under a fresh tracking number, in ``labelMetadata`` or the multipart JSON part as USPS sends it."""
+        self.labels_issued += 1
+        tracking_number = f"92{self.labels_issued:020d}"
+        body, content_type = self.labels[route]
+        if content_type == "application/json":
+            document = json.loads(body)
+            metadata = document.get("labelMetadata") if isinstance(document.get("labelMetadata"), dict) else document
+            metadata["trackingNumber"] = tracking_number
+            return json_response(200, "OK", document)
+        metadata_part = json.dumps({"trackingNumber": tracking_number}, separators=(",", ":")).encode("utf-8")
+        return multipart_response(200, "OK", [("application/json", metadata_part), (content_type, body)])
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                request_line, _, header_block = head.partition(b"\r\n")
+                parts = request_line.split(b" ")
+                if len(parts) < 2:
+                    return
+                method, target = parts[0].decode("latin-1"), parts[1].decode("latin-1")
+                lowered = header_block.lower()
+                length = 0
+                marker = lowered.find(b"content-length:")
+                if marker != -1:
+                    end = lowered.find(b"\r\n", marker)
+                    length = int(lowered[marker + 15 : end if end != -1 else None].strip() or 0)
+                if length:
+                    await reader.readexactly(length)
+                writer.write(await self.respond(method, urllib.parse.urlsplit(target).path))
+                await writer.drain()
+                if b"connection: close" in lowered:
+                    return
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> None:
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_HEADER_BYTES, backlog=1024)
+        bound = ", ".join(f"http://{sock.getsockname()[0]}:{sock.getsockname()[1]}/" for sock in server.sockets)
+        print(f"USPS mock server listening on {bound}", flush=True)
+        for name, source in self.sources.items():
+            print(f"  {name:<20} {source}", flush=True)
+        async with server:
+            await server.serve_forever()
+
+
+def parse_args(argv: Optional[List[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Local USPS API mock for the oauth2, labels, international-prices, shipping-options, scan-forms and addresses routes. "
+        "Serves the bodies recorded in tests/*/output/*-result.json where available, canned bodies otherwise."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9091, help="Default matches MOCK_SERVER_BASEURL in .env.example")
+    parser.add_argument("--recordings", default=str(TESTS_DIR), help="Directory holding <flow>/output/*-result.json recordings")
+    parser.add_argument("--latency", default=None, help="Latency distribution for every route, e.g. fixed:20, uniform:5:50, lognormal:120:0.6")
+    parser.add_argument("--route-latency", action="append", default=[], metavar="ROUTE=SPEC", help="Per-route override, e.g. label=lognormal:400:0.4")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--quota", type=float, default=None, help="Requests/second above which non-token routes get 429")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for latency/error sampling")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    route_latency = {}
+    for item in args.route_latency:
+        route, _, spec = item.partition("=")
+        if route not in ROUTES:
+            print(f"Unknown route '{route}'; choose from {', '.join(ROUTES)}", file=sys.stderr)
+            return 2
+        route_latency[route] = parse_latency(spec)
+    server = MockServer(
+        recordings_dir=Path(args.recordings),
+        latency=parse_latency(args.latency) if args.latency else None,
+        route_latency=route_latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        quota=args.quota,
+        seed=args.seed,
+    )
+    if uvloop is not None:
+        uvloop.install()
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
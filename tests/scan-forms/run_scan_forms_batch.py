@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+import urllib.parse
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from run_scan_forms_test import build_request_body, parse_int, scan_form_number, scan_mid  # noqa: E402
+from usps_client.auth import get_token_provider  # noqa: E402
+from usps_client.batch import describe_error, read_rows, run_items  # noqa: E402
+from usps_client.concurrency import DEFAULT_MAX_LIMIT, ConcurrencyLimits  # noqa: E402
+from usps_client.config import load_env, resolve_base_url  # noqa: E402
+from usps_client.idempotency import is_ambiguous  # noqa: E402
+from usps_client.jobs import build_job_queue  # noqa: E402
+from usps_client.metrics import get_metrics  # noqa: E402
+from usps_client.ratelimit import configure_rate_limiter  # noqa: E402
+from usps_client.records import saved_multipart_json  # noqa: E402
+from usps_client.registry import build_label_registry  # noqa: E402
+from usps_client.retry import get_retry_engine  # noqa: E402
+from usps_client.sink import open_sink  # noqa: E402
+from usps_client.transport import DEFAULT_POOL_SIZE, TransportResponse, configure_transport, decode_json_body, get_transport  # noqa: E402
+
+FLOW = "scan-forms"
+OUTPUT_DIR = Path(__file__).resolve().parent / "output"
+DEFAULT_RESULTS_PATH = OUTPUT_DIR / "scan-forms-batch.jsonl"
+DEFAULT_MAPPING_PATH = OUTPUT_DIR / "scan-forms-batch-mapping.jsonl"
+DEFAULT_ARTIFACT_DIR = OUTPUT_DIR / "forms"
+SUMMARY_PATH = OUTPUT_DIR / "scan-forms-batch-summary.json"
+REQUIRED_ENV_KEYS = ["USPS_CLIENT_ID", "USPS_CLIENT_SECRET"]
+DEFAULT_CONCURRENCY = 4
+DEFAULT_CHUNK_SIZE = 1000
+# (chunk ID, group key, SCAN form request body)
+Chunk = Tuple[str, List[str], Dict[str, Any]]
+ACCEPTANCE_KEYS = (
+    "USPS_SCAN_ACCEPT_FACILITY",
+    "USPS_SCAN_ACCEPT_ADDRESS1",
+    "USPS_SCAN_ACCEPT_ADDRESS2",
+    "USPS_SCAN_ACCEPT_CITY",
+    "USPS_SCAN_ACCEPT_STATE",
+    "USPS_SCAN_ACCEPT_POSTAL",
+    "USPS_SCAN_ACCEPT_COUNTRY",
+)
+
+
+def parse_args(argv: Optional[List[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Manifest many labels via scan-forms/v3/scan-form. The input is a CSV/JSONL label list "
+        "(labelId, trackingNumber, mailClass, packageCount, mailDate and optional USPS_SCAN_ACCEPT_* columns) "
+        "or the JSONL written by run_domestic_labels_batch.py. Labels are grouped by mail date and acceptance "
+        "location, split into chunks and submitted concurrently. Without --input, the day's unmanifested labels "
+        "are taken from the label registry instead, so each close only sends labels bought since the last one."
+    )
+    parser.add_argument("--input", default=None, help="CSV (with header row) or JSONL file of labels")
+    parser.add_argument(
+        "--registry",
+        default=None,
+        help="SQLite label registry to close from when there is no --input (default USPS_LABEL_REGISTRY)",
+    )
+    parser.add_argument("--mail-date", default=None, help="Mail date to close from the registry (default USPS_SCAN_MAIL_DATE or today)")
+    parser.add_argument("--output", default=str(DEFAULT_RESULTS_PATH), help="JSONL file receiving one result per SCAN form request")
+    parser.add_argument("--mapping", default=str(DEFAULT_MAPPING_PATH), help="JSONL file mapping each label to its SCAN form")
+    parser.add_argument("--artifact-dir", default=str(DEFAULT_ARTIFACT_DIR), help="Directory for SCAN form PDF/TIFF files")
+    parser.add_argument("--chunk-size", type=int, default=None, help=f"Labels per SCAN form (default USPS_SCAN_CHUNK_SIZE or {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument("--concurrency", type=int, default=None, help="Maximum in-flight requests (default USPS_CONCURRENCY or 4)")
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Tune in-flight requests with AIMD on latency, timeouts and 429s, starting from --concurrency",
+    )
+    parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_LIMIT, help="Upper bound for --adaptive")
+    parser.add_argument(
+        "--queue",
+        default=None,
+        help="SQLite job queue that makes the run resumable after a crash (default USPS_JOB_QUEUE; off when neither is set)",
+    )
+    parser.add_argument("--run-id", default=None, help="Queue run to create or resume (default: derived from the input file's path, size and mtime)")
+    parser.add_argument("--retry-dead", action="store_true", help="Requeue the run's dead-lettered jobs before processing")
+    return parser.parse_args(argv)
+
+
+def label_entry(row: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """The SCAN form ``labels[]`` entry for an input row, or None for rows that identify no (successful) label."""
+    if row.get("status") and row["status"] != "200":
+        return None
+    metadata: Dict[str, Any] = {}
+    if row.get("body"):
+        try:
+            body = json.loads(row["body"])
+        except json.JSONDecodeError:
+            body = None
+        if isinstance(body, dict):
+            metadata = body.get("labelMetadata") if isinstance(body.get("labelMetadata"), dict) else body
+    entry: Dict[str, Any] = {}
+    for key in ("labelId", "trackingNumber", "mailClass"):
+        value = row.get(key) or metadata.get(key)
+        if value:
+            entry[key] = value
+    package_count = parse_int(row.get("packageCount"))
+    if package_count is not None:
+        entry["packageCount"] = package_count
+    return entry if entry.get("labelId") or entry.get("trackingNumber") else None
+
+
+def group_key(row: Dict[str, str], env: Dict[str, str], today: str) -> Tuple[str, ...]:
+    """``(mailDate, *acceptance location)``; labels with no configured location are accepted at their origin ZIP."""
+    mail_date = row.get("mailDate") or row.get("mailingDate") or row.get("USPS_SCAN_MAIL_DATE") or env.get("USPS_SCAN_MAIL_DATE") or today
+    location = []
+    for key in ACCEPTANCE_KEYS:
+        fallback = key.replace("USPS_SCAN_", "USPS_")
+        location.append(row.get(key) or row.get(fallback) or env.get(key) or env.get(fallback) or "")
+    if not any(location) and row.get("originZIPCode"):
+        location[ACCEPTANCE_KEYS.index("USPS_SCAN_ACCEPT_POSTAL")] = row["originZIPCode"]
+    return (mail_date, *location)
+
+
+def label_key(entry: Dict[str, Any]) -> str:
+    return entry.get("trackingNumber") or entry["labelId"]
+
+
+def form_extension(content_type: str) -> str:
+    """File extension for a streamed SCAN form: its media subtype (``pdf``, ``tiff``, ``mixed`` for a multipart reply)."""
+    subtype = content_type.split(";", 1)[0].strip().lower().rpartition("/")[2]
+    return subtype.rpartition("+")[2] or "bin"
+
+
+def write_summary(summary: Dict[str, Any]) -> None:
+    SUMMARY_PATH.parent.mkdir(parents=True, exist_ok=True)
+    SUMMARY_PATH.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    env_file = os.environ.get("ENV_FILE", ".env.local")
+    summary: Dict[str, Any] = {
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "envFile": env_file,
+        "input": args.input,
+        "output": args.output,
+        "mapping": args.mapping,
+        "baseUrl": None,
+        "concurrency": None,
+        "chunkSize": None,
+        "labels": 0,
+        "skippedRows": 0,
+        "duplicateLabels": 0,
+        "groups": 0,
+        "chunks": 0,
+        "succeeded": 0,
+        "failed": 0,
+        "labelsManifested": 0,
+        "manifestsInReview": 0,
+        "elapsedSeconds": None,
+        "errors": [],
+    }
+
+    try:
+        env = load_env(env_file)
+    except OSError as exc:
+        summary["errors"].append(f"Failed to read env file: {exc}")
+        write_summary(summary)
+        return 1
+
+    missing = [key for key in REQUIRED_ENV_KEYS if not env.get(key)]
+    if missing:
+        summary["errors"].append(f"Missing required env values: {', '.join(missing)}")
+        write_summary(summary)
+        return 1
+
+    base_url = resolve_base_url(env)
+    if not base_url:
+        summary["errors"].append("Could not determine USPS API base URL from env")
+        write_summary(summary)
+        return 1
+    summary["baseUrl"] = base_url
+    scan_url = urllib.parse.urljoin(base_url, "scan-forms/v3/scan-form")
+
+    today = datetime.utcnow().date().isoformat()
+    chunk_size = max(1, args.chunk_size or parse_int(env.get("USPS_SCAN_CHUNK_SIZE")) or DEFAULT_CHUNK_SIZE)
+    summary["chunkSize"] = chunk_size
+    chunks: Iterator[Chunk]
+    # chunk ID -> registry manifest it settles, when closing from the label registry.
+    manifest_ids: Dict[str, int] = {}
+    registry = None
+    if args.input:
+        groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+        seen = set()
+        try:
+            for row in read_rows(args.input):
+                entry = label_entry(row)
+                if entry is None:
+                    summary["skippedRows"] += 1
+                    continue
+                key = label_key(entry)
+                if key in seen:
+                    summary["duplicateLabels"] += 1
+                    continue
+                seen.add(key)
+                groups.setdefault(group_key(row, env, today), []).append(entry)
+        except (OSError, ValueError) as exc:
+            summary["errors"].append(f"Failed to read input: {exc}")
+            write_summary(summary)
+            return 1
+        summary["labels"] = len(seen)
+        summary["groups"] = len(groups)
+        if not seen:
+            summary["errors"].append("No rows in the input identify a label by labelId or trackingNumber")
+            write_summary(summary)
+            return 1
+
+        def input_chunks() -> Iterator[Chunk]:
+            # Request bodies are built as workers free up, and each group is dropped once it is chunked.
+            for group_index, key in enumerate(sorted(groups), 1):
+                labels = groups.pop(key)
+                group_env = {**env, "USPS_SCAN_FORM_MODE": "label", "USPS_SCAN_MAIL_DATE": key[0], **dict(zip(ACCEPTANCE_KEYS, key[1:]))}
+                for offset in range(0, len(labels), chunk_size):
+                    errors: List[str] = []
+                    body = build_request_body(group_env, errors, labels=labels[offset : offset + chunk_size])
+                    if body is None:
+                        summary["errors"].extend(errors)
+                        continue
+                    summary["chunks"] += 1
+                    yield f"{key[0]}-g{group_index}-c{offset // chunk_size + 1}", list(key), body
+
+        chunks = input_chunks()
+    else:
+        try:
+            registry = build_label_registry(env, args.registry)
+        except (OSError, sqlite3.Error) as exc:
+            summary["errors"].append(f"Failed to open label registry: {exc}")
+            write_summary(summary)
+            return 1
+        if registry is None:
+            summary["errors"].append("Pass --input, or a label registry via --registry or USPS_LABEL_REGISTRY")
+            write_summary(summary)
+            return 1
+        mail_date = args.mail_date or env.get("USPS_SCAN_MAIL_DATE") or today
+        summary["input"] = registry.path
+        summary["mailDate"] = mail_date
+
+        def registry_chunks() -> Iterator[Chunk]:
+            # One manifest per chunk, claimed as a worker frees up; each close only finds labels no earlier close has taken.
+            for origin in registry.unmanifested_origins(mail_date, mid=scan_mid(env)):
+                key = group_key({"mailDate": mail_date, "originZIPCode": origin}, env, today)
+                group_env = {**env, "USPS_SCAN_FORM_MODE": "label", "USPS_SCAN_MAIL_DATE": mail_date, **dict(zip(ACCEPTANCE_KEYS, key[1:]))}
+                summary["groups"] += 1
+                while True:
+                    manifest = registry.begin_manifest(mail_date, origin_zip=origin, mid=scan_mid(env), limit=chunk_size)
+                    if manifest is None:
+                        break
+                    manifest_id, labels = manifest
+                    errors: List[str] = []
+                    body = build_request_body(group_env, errors, labels=labels)
+                    if body is None:
+                        registry.fail_manifest(manifest_id, "; ".join(errors))
+                        summary["errors"].extend(errors)
+                        break
+                    chunk_id = f"{mail_date}-m{manifest_id}"
+                    manifest_ids[chunk_id] = manifest_id
+                    summary["chunks"] += 1
+                    summary["labels"] += len(labels)
+                    yield chunk_id, list(key), body
+
+        chunks = registry_chunks()
+
+    concurrency = args.concurrency or parse_int(env.get("USPS_CONCURRENCY")) or DEFAULT_CONCURRENCY
+    summary["concurrency"] = concurrency
+    limits = ConcurrencyLimits(initial=concurrency, maximum=max(concurrency, args.max_concurrency)) if args.adaptive else None
+    configure_transport(pool_size=max(limits.maximum if limits else concurrency, DEFAULT_POOL_SIZE))
+    rate_limiter = configure_rate_limiter(env)
+    token_provider = get_token_provider(
+        base_url,
+        env["USPS_CLIENT_ID"],
+        env["USPS_CLIENT_SECRET"],
+        cache_path=env.get("USPS_TOKEN_CACHE"),
+    )
+    artifact_dir = Path(args.artifact_dir)
+
+    def form_path(headers: Any, chunk_id: str) -> Optional[Path]:
+        content_type = (headers.get("Content-Type") or "").lower()
+        if not content_type or content_type.startswith("application/json"):
+            return None
+        artifact_dir.mkdir(parents=True, exist_ok=True)
+        return artifact_dir / f"scan-form-{chunk_id}.{form_extension(content_type)}"
+
+    def submit(item: Tuple[int, Chunk]) -> TransportResponse:
+        chunk_id, _, body = item[1]
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {token_provider.get_token()}",
+            "Accept": "application/json",
+        }
+        return get_transport().request(
+            "POST",
+            scan_url,
+            body=json.dumps(body).encode("utf-8"),
+            headers=headers,
+            timeout=60,
+            stream_to=lambda response_headers: form_path(response_headers, chunk_id),
+        )
+
+    try:
+        # Registry closes are already durable: a crashed run's manifests are held for review, never re-sent blindly.
+        queue = build_job_queue(env, FLOW, args.input, args.queue, args.run_id) if args.input else None
+    except (OSError, sqlite3.Error) as exc:
+        summary["errors"].append(f"Failed to open job queue: {exc}")
+        write_summary(summary)
+        return 1
+    if queue is not None and args.retry_dead:
+        summary["requeuedDead"] = queue.requeue_dead()
+    append = queue is not None and queue.resumed
+
+    started = time.monotonic()
+    try:
+        with open_sink(Path(args.output), env, append=append) as writer, open_sink(Path(args.mapping), env, append=append) as mapping:
+            for (_, (chunk_id, key, body)), outcome, dead_lettered in run_items(
+                enumerate(chunks, 1),
+                submit,
+                concurrency,
+                controller=limits.controller(scan_url) if limits else None,
+                queue=queue,
+                ambiguous=is_ambiguous,
+            ):
+                labels = body["labelShipment"]["labels"]
+                record: Dict[str, Any] = {
+                    "chunk": chunk_id,
+                    "mailDate": key[0],
+                    "acceptanceLocation": body.get("acceptanceLocation"),
+                    "labels": len(labels),
+                }
+                if isinstance(outcome, BaseException):
+                    record.update(describe_error(outcome))
+                    if dead_lettered:
+                        record["deadLettered"] = True
+                else:
+                    record["status"] = outcome.status
+                    record["contentType"] = outcome.headers.get("Content-Type")
+                    record["timings"] = outcome.timings
+                    if outcome.saved_path is not None:
+                        record["savedForm"] = str(outcome.saved_path)
+                        record["size"] = outcome.size
+                        record["sha256"] = outcome.sha256
+                        # A multipart reply carries the form number in its JSON part, beside the form image.
+                        record["scanFormNumber"] = scan_form_number(saved_multipart_json(record["contentType"], outcome.saved_path))
+                    else:
+                        record["body"] = decode_json_body(outcome.body)
+                        record["scanFormNumber"] = scan_form_number(record["body"])
+                manifest_id = manifest_ids.pop(chunk_id, None)
+                if manifest_id is not None:
+                    record["manifestId"] = manifest_id
+                if record["status"] == 200:
+                    summary["succeeded"] += 1
+                    summary["labelsManifested"] += len(labels)
+                    if manifest_id is not None and record.get("scanFormNumber"):
+                        registry.complete_manifest(manifest_id, record["scanFormNumber"])
+                    elif manifest_id is not None:
+                        # A form was created but the reply did not say which; find it before settling the labels.
+                        registry.review_manifest(manifest_id, "SCAN form created but its number was not found in the response")
+                        record["manifestReview"] = True
+                        summary["manifestsInReview"] += 1
+                else:
+                    summary["failed"] += 1
+                    if manifest_id is not None and is_ambiguous(outcome):
+                        # The form may exist; resending these labels could put them on a second one.
+                        registry.review_manifest(manifest_id, record.get("error") or f"HTTP {record['status']}")
+                        record["manifestReview"] = True
+                        summary["manifestsInReview"] += 1
+                    elif manifest_id is not None:
+                        registry.fail_manifest(manifest_id, record.get("error") or f"HTTP {record['status']}")
+                writer.write(record)
+                for entry in labels:
+                    mapping.write(
+                        {
+                            "labelId": entry.get("labelId"),
+                            "trackingNumber": entry.get("trackingNumber"),
+                            "chunk": chunk_id,
+                            "mailDate": key[0],
+                            "status": record["status"],
+                            "scanFormNumber": record.get("scanFormNumber"),
+                            "savedForm": record.get("savedForm"),
+                        }
+                    )
+        summary["outputSegments"] = [str(segment) for segment in writer.segments]
+        summary["mappingSegments"] = [str(segment) for segment in mapping.segments]
+    except (OSError, ValueError) as exc:
+        summary["errors"].append(f"Failed to write results: {exc}")
+
+    summary["elapsedSeconds"] = round(time.monotonic() - started, 3)
+    if limits is not None:
+        summary["concurrencyLimits"] = limits.report()
+    summary["latency"] = get_metrics().report()
+    summary["circuitBreakers"] = get_retry_engine().breaker_states()
+    summary["rateLimitWaitSeconds"] = {name: round(waited, 3) for name, waited in rate_limiter.waited.items()}
+    if queue is not None:
+        summary["jobQueue"] = queue.report()
+        queue.close()
+    if registry is not None:
+        summary["labelRegistry"] = registry.report()
+        registry.close()
+    write_summary(summary)
+    return 0 if not summary["errors"] and summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,24 @@
 #!/usr/bin/env python3
 import json
 import os
+import sqlite3
 import sys
 import urllib.error
 import urllib.parse
-import urllib.request
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from usps_client.auth import get_token_provider  # noqa: E402
+from usps_client.idempotency import is_ambiguous  # noqa: E402
+from usps_client.metrics import get_metrics  # noqa: E402
+from usps_client.ratelimit import configure_rate_limiter  # noqa: E402
+from usps_client.records import compact_headers  # noqa: E402
+from usps_client.registry import LabelRegistry, build_label_registry  # noqa: E402
+from usps_client.sink import build_sink, record_call  # noqa: E402
+from usps_client.transport import http_post_json  # noqa: E402
 
 OUTPUT_PATH = Path(__file__).resolve().parent / "output" / "scan-forms-result.json"
 REQUIRED_ENV_KEYS = ["USPS_CLIENT_ID", "USPS_CLIENT_SECRET"]
@@ -43,46 +54,6 @@ def load_env(path: str) -> Dict[str, str]:
     return env
 
 
-def http_post_form(url: str, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None, timeout: int = 15):
-    data = urllib.parse.urlencode(payload).encode("utf-8")
-    hdrs = {"Content-Type": "application/x-www-form-urlencoded", "Accept": "application/json"}
-    if headers:
-        hdrs.update(headers)
-    request = urllib.request.Request(url, data=data, headers=hdrs, method="POST")
-    with urllib.request.urlopen(request, timeout=timeout) as response:
-        body_bytes = response.read()
-        body_text = body_bytes.decode("utf-8") if body_bytes else ""
-        try:
-            body_json = json.loads(body_text) if body_text else {}
-        except json.JSONDecodeError:
-            body_json = {"raw": body_text}
-        return {
-            "status": response.status,
-            "headers": dict(response.headers.items()),
-            "body": body_json,
-        }
-
-
-def http_post_json(url: str, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None, timeout: int = 15):
-    data = json.dumps(payload).encode("utf-8")
-    hdrs = {"Content-Type": "application/json", "Accept": "application/json"}
-    if headers:
-        hdrs.update(headers)
-    request = urllib.request.Request(url, data=data, headers=hdrs, method="POST")
-    with urllib.request.urlopen(request, timeout=timeout) as response:
-        body_bytes = response.read()
-        body_text = body_bytes.decode("utf-8") if body_bytes else ""
-        try:
-            body_json = json.loads(body_text) if body_text else {}
-        except json.JSONDecodeError:
-            body_json = {"raw": body_text}
-        return {
-            "status": response.status,
-            "headers": dict(response.headers.items()),
-            "body": body_json,
-        }
-
-
 def prune_none(obj: Any) -> Any:
     if isinstance(obj, dict):
         return {k: prune_none(v) for k, v in obj.items() if v is not None}
@@ -117,7 +88,73 @@ def parse_int(value: Optional[str]) -> Optional[int]:
         return None
 
 
-def build_request_body(env: Dict[str, str], errors: List[str]) -> Optional[Dict[str, Any]]:
+def scan_mid(env: Dict[str, str]) -> Optional[str]:
+    """The MID a close is for: USPS_SCAN_MID, else the USPS_MID labels are bought and registered under."""
+    return env.get("USPS_SCAN_MID") or env.get("USPS_MID")
+
+
+def labels_from_env(env: Dict[str, str]) -> List[Dict[str, Any]]:
+    label_ids = parse_csv(env.get("USPS_SCAN_LABEL_IDS"))
+    tracking_numbers = parse_csv(env.get("USPS_SCAN_LABEL_TRACKINGS"))
+    mail_classes = parse_csv(env.get("USPS_SCAN_LABEL_CLASSES"))
+    package_counts = parse_csv(env.get("USPS_SCAN_LABEL_COUNTS"))
+
+    max_len = max((len(label_ids), len(tracking_numbers), len(mail_classes), len(package_counts), 0))
+    labels: List[Dict[str, Any]] = []
+    for idx in range(max_len):
+        entry: Dict[str, Any] = {}
+        if idx < len(label_ids):
+            entry["labelId"] = label_ids[idx]
+        if idx < len(tracking_numbers):
+            entry["trackingNumber"] = tracking_numbers[idx]
+        if idx < len(mail_classes):
+            entry["mailClass"] = mail_classes[idx]
+        if idx < len(package_counts):
+            count_val = parse_int(package_counts[idx])
+            if count_val is not None:
+                entry["packageCount"] = count_val
+        entry = prune_none(entry)
+        if entry:
+            labels.append(entry)
+    return labels
+
+
+def begin_registry_manifest(env: Dict[str, str], registry: LabelRegistry) -> Optional[Tuple[Optional[int], List[Dict[str, Any]]]]:
+    """``(manifest ID, claimed labels)`` for a close tracked in the label registry, or None for an untracked one.
+
+    Label mode with no USPS_SCAN_LABEL_* lists claims the mail date's unmanifested labels, narrowed by
+    USPS_SCAN_ORIGIN_ZIP, ``scan_mid`` and USPS_SCAN_MAIL_CLASS; with none left it returns ``(None, [])``.
+    A single-day MID-mode close with USPS_SCAN_INCLUDE_UNFORMED=true covers every formless label of the
+    MID, so it claims those only to record the form they go on.
+    """
+    today = datetime.utcnow().date().isoformat()
+    mode = env.get("USPS_SCAN_FORM_MODE", "label").strip().lower()
+    if mode == "label" and not labels_from_env(env):
+        manifest = registry.begin_manifest(
+            env.get("USPS_SCAN_MAIL_DATE") or today,
+            origin_zip=env.get("USPS_SCAN_ORIGIN_ZIP"),
+            mid=scan_mid(env),
+            mail_class=env.get("USPS_SCAN_MAIL_CLASS"),
+        )
+        return manifest if manifest is not None else (None, [])
+    start_date = env.get("USPS_SCAN_START_DATE") or today
+    if mode == "mid" and parse_bool(env.get("USPS_SCAN_INCLUDE_UNFORMED")) and env.get("USPS_SCAN_END_DATE", start_date) == start_date:
+        return registry.begin_manifest(start_date, mid=scan_mid(env))
+    return None
+
+
+def scan_form_number(body: Any) -> Optional[str]:
+    if not isinstance(body, dict):
+        return None
+    metadata = body.get("SCANFormMetadata") if isinstance(body.get("SCANFormMetadata"), dict) else body
+    for key in ("SCANFormNumber", "scanFormNumber", "SCANFormId", "scanFormId"):
+        if metadata.get(key):
+            return str(metadata[key])
+    return None
+
+
+def build_request_body(env: Dict[str, str], errors: List[str], labels: Optional[List[Dict[str, Any]]] = None) -> Optional[Dict[str, Any]]:
+    """SCAN form request from env; in label mode ``labels`` replaces the comma-separated USPS_SCAN_LABEL_* lists."""
     today = datetime.utcnow().date().isoformat()
     mode = env.get("USPS_SCAN_FORM_MODE", "label").strip().lower()
     if mode not in SUPPORTED_MODES:
@@ -127,30 +164,13 @@ def build_request_body(env: Dict[str, str], errors: List[str]) -> Optional[Dict[
     body: Dict[str, Any] = {}
 
     if mode == "label":
-        label_ids = parse_csv(env.get("USPS_SCAN_LABEL_IDS"))
-        tracking_numbers = parse_csv(env.get("USPS_SCAN_LABEL_TRACKINGS"))
-        mail_classes = parse_csv(env.get("USPS_SCAN_LABEL_CLASSES"))
-        package_counts = parse_csv(env.get("USPS_SCAN_LABEL_COUNTS"))
-
-        max_len = max((len(label_ids), len(tracking_numbers), len(mail_classes), len(package_counts), 0))
-        labels: List[Dict[str, Any]] = []
-        for idx in range(max_len):
-            entry: Dict[str, Any] = {}
-            if idx < len(label_ids):
-                entry["labelId"] = label_ids[idx]
-            if idx < len(tracking_numbers):
-                entry["trackingNumber"] = tracking_numbers[idx]
-            if idx < len(mail_classes):
-                entry["mailClass"] = mail_classes[idx]
-            if idx < len(package_counts):
-                count_val = parse_int(package_counts[idx])
-                if count_val is not None:
-                    entry["packageCount"] = count_val
-            entry = prune_none(entry)
-            if entry:
-                labels.append(entry)
+        if labels is None:
+            labels = labels_from_env(env)
         if not labels:
-            errors.append("Label mode requires at least one labelId or trackingNumber via USPS_SCAN_LABEL_IDS or USPS_SCAN_LABEL_TRACKINGS")
+            errors.append(
+                "Label mode requires at least one labelId or trackingNumber via USPS_SCAN_LABEL_IDS, USPS_SCAN_LABEL_TRACKINGS "
+                "or an unmanifested label in USPS_LABEL_REGISTRY"
+            )
             return None
 
         label_payload: Dict[str, Any] = {
@@ -162,7 +182,7 @@ def build_request_body(env: Dict[str, str], errors: List[str]) -> Optional[Dict[
         body["labelShipment"] = prune_none(label_payload)
 
     elif mode == "mid":
-        mid = env.get("USPS_SCAN_MID") or env.get("USPS_MID")
+        mid = scan_mid(env)
         if not mid:
             errors.append("MID mode requires USPS_SCAN_MID or USPS_MID")
             return None
@@ -178,7 +198,7 @@ def build_request_body(env: Dict[str, str], errors: List[str]) -> Optional[Dict[
 
     elif mode == "manifest_mid":
         manifest_mid = env.get("USPS_SCAN_MANIFEST_MID")
-        mid = env.get("USPS_SCAN_MID") or env.get("USPS_MID")
+        mid = scan_mid(env)
         if not manifest_mid:
             errors.append("Manifest MID mode requires USPS_SCAN_MANIFEST_MID")
             return None
@@ -255,6 +275,20 @@ def main() -> int:
         OUTPUT_PATH.write_text(json.dumps(results, indent=2), encoding="utf-8")
         return 1
 
+    try:
+        sink = build_sink(env)
+    except (OSError, ValueError) as exc:
+        results["errors"].append(f"Failed to open results sink: {exc}")
+        exit_code = 1
+        sink = None
+
+    try:
+        registry = build_label_registry(env)
+    except (OSError, sqlite3.Error) as exc:
+        results["errors"].append(f"Failed to open label registry: {exc}")
+        exit_code = 1
+        registry = None
+
     missing = [key for key in REQUIRED_ENV_KEYS if not env.get(key)]
     if missing:
         results["errors"].append(f"Missing required env values: {', '.join(missing)}")
@@ -279,18 +313,21 @@ def main() -> int:
 
         if not results["errors"]:
             try:
-                auth_payload = {
-                    "grant_type": "client_credentials",
-                    "client_id": env["USPS_CLIENT_ID"],
-                    "client_secret": env["USPS_CLIENT_SECRET"],
-                }
-                results["auth"] = http_post_form(auth_url, auth_payload)
+                configure_rate_limiter(env)
+                token_provider = get_token_provider(
+                    base_url,
+                    env["USPS_CLIENT_ID"],
+                    env["USPS_CLIENT_SECRET"],
+                    cache_path=env.get("USPS_TOKEN_CACHE"),
+                )
+                results["auth"] = token_provider.authenticate()
             except urllib.error.HTTPError as err:
                 body = err.read().decode("utf-8", errors="replace") if err.fp else ""
                 results["auth"] = {
                     "status": err.code,
-                    "headers": dict(err.headers.items()) if err.headers else {},
+                    "headers": compact_headers(err.headers),
                     "body": {"raw": body},
+                    "timings": getattr(err, "timings", None),
                 }
                 results["errors"].append(f"Auth request failed with HTTP {err.code}")
                 exit_code = 1
@@ -314,17 +351,31 @@ def main() -> int:
         body = results["auth"].get("body")
         if isinstance(body, dict):
             token = body.get("access_token")
+    results["auth"] = record_call(sink, "auth", results["auth"])
 
     request_body = None
+    manifest_id = None
+    claimed: List[Dict[str, Any]] = []
     if token:
-        request_body = build_request_body(env, results["errors"])
-        if request_body is None:
-            exit_code = 1 if exit_code == 0 else exit_code
+        labels = None
+        claim = begin_registry_manifest(env, registry) if registry is not None else None
+        if claim is not None:
+            manifest_id, claimed = claim
+            if env.get("USPS_SCAN_FORM_MODE", "label").strip().lower() == "label":
+                labels = claimed
+        if labels == []:
+            # Every registered label is already on a form; an incremental close has nothing to send.
+            results["manifest"] = {"id": None, "labels": 0}
+        else:
+            request_body = build_request_body(env, results["errors"], labels)
+            if request_body is None:
+                exit_code = 1 if exit_code == 0 else exit_code
     else:
         if not results["errors"]:
             results["errors"].append("Access token not returned from auth response")
         exit_code = 1 if exit_code == 0 else exit_code
 
+    scan_error: Optional[BaseException] = None
     if token and request_body:
         headers = {"Authorization": f"Bearer {token}"}
         try:
@@ -332,15 +383,18 @@ def main() -> int:
             if results["scanForm"].get("status") != 200:
                 exit_code = 1
         except urllib.error.HTTPError as err:
+            scan_error = err
             body = err.read().decode("utf-8", errors="replace") if err.fp else ""
             results["scanForm"] = {
                 "status": err.code,
-                "headers": dict(err.headers.items()) if err.headers else {},
+                "headers": compact_headers(err.headers),
                 "body": {"raw": body},
+                "timings": getattr(err, "timings", None),
             }
             results["errors"].append(f"Scan form request failed with HTTP {err.code}")
             exit_code = 1
         except urllib.error.URLError as err:
+            scan_error = err
             results["scanForm"] = {
                 "status": "connection_error",
                 "body": {"message": str(err.reason)},
@@ -348,6 +402,7 @@ def main() -> int:
             results["errors"].append(f"Scan form request connection error: {err.reason}")
             exit_code = 1
         except Exception as exc:
+            scan_error = exc
             results["scanForm"] = {
                 "status": "error",
                 "body": {"message": str(exc)},
@@ -355,6 +410,29 @@ def main() -> int:
             results["errors"].append(f"Scan form request failed: {exc}")
             exit_code = 1
 
+    if registry is not None and manifest_id is not None:
+        scan_form = results["scanForm"]
+        created = scan_form is not None and scan_form.get("status") == 200
+        form_number = scan_form_number(scan_form.get("body")) if created else None
+        # A form that may exist (the request is ambiguous, or the reply did not say which form it is) is held for
+        # review; resending its labels could put them on a second one.
+        review = is_ambiguous(scan_error) or (created and not form_number)
+        if form_number:
+            registry.complete_manifest(manifest_id, form_number)
+        elif review:
+            reason = "SCAN form created but its number was not found in the response" if created else "; ".join(results["errors"])
+            registry.review_manifest(manifest_id, reason or "SCAN form request failed")
+        else:
+            registry.fail_manifest(manifest_id, "; ".join(results["errors"]) or "SCAN form request failed")
+        results["manifest"] = {"id": manifest_id, "labels": len(claimed), "scanFormNumber": form_number, "review": review}
+    results["scanForm"] = record_call(sink, "scanForm", results["scanForm"])
+    if registry is not None:
+        results["labelRegistry"] = registry.report()
+        registry.close()
+    if sink is not None:
+        sink.close()
+        results["resultsSink"] = [str(segment) for segment in sink.segments]
+    results["latency"] = get_metrics().report()
     OUTPUT_PATH.parent.mkdir(parents=True, exist_ok=True)
     OUTPUT_PATH.write_text(json.dumps(results, indent=2), encoding="utf-8")
     return exit_code
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+import urllib.parse
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from run_shipping_options_test import build_payload  # noqa: E402
+from usps_client.auth import get_token_provider  # noqa: E402
+from usps_client.batch import describe_error, read_rows, row_reference, run_items  # noqa: E402
+from usps_client.bucketing import build_bucketer  # noqa: E402
+from usps_client.cache import build_response_cache, cached_post  # noqa: E402
+from usps_client.concurrency import DEFAULT_MAX_LIMIT, ConcurrencyLimits  # noqa: E402
+from usps_client.config import load_env, parse_int, resolve_base_url  # noqa: E402
+from usps_client.jobs import build_job_queue  # noqa: E402
+from usps_client.metrics import get_metrics  # noqa: E402
+from usps_client.ratelimit import configure_rate_limiter  # noqa: E402
+from usps_client.records import QuoteRecord, set_retain_raw  # noqa: E402
+from usps_client.retry import get_retry_engine  # noqa: E402
+from usps_client.sink import open_sink  # noqa: E402
+from usps_client.transport import DEFAULT_POOL_SIZE, configure_transport, http_post_json  # noqa: E402
+
+FLOW = "shipping-options"
+OUTPUT_DIR = Path(__file__).resolve().parent / "output"
+DEFAULT_RESULTS_PATH = OUTPUT_DIR / "shipping-options-batch.jsonl"
+SUMMARY_PATH = OUTPUT_DIR / "shipping-options-batch-summary.json"
+REQUIRED_ENV_KEYS = ["USPS_CLIENT_ID", "USPS_CLIENT_SECRET"]
+DEFAULT_CONCURRENCY = 8
+
+
+def parse_args(argv: Optional[List[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Rate-shop many shipments against shipments/v3/options/search. "
+        "Each CSV column / JSONL key overrides the env value of the same name (USPS_ORIGIN_ZIP, USPS_DESTINATION_ZIP, USPS_WEIGHT_LBS, ...)."
+    )
+    parser.add_argument("--input", required=True, help="CSV (with header row) or JSONL file of shipments")
+    parser.add_argument("--output", default=str(DEFAULT_RESULTS_PATH), help="JSONL file receiving one result per shipment")
+    parser.add_argument("--concurrency", type=int, default=None, help="Maximum in-flight requests (default USPS_CONCURRENCY or 8)")
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Tune in-flight requests with AIMD on latency, timeouts and 429s, starting from --concurrency",
+    )
+    parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_LIMIT, help="Upper bound for --adaptive")
+    parser.add_argument(
+        "--retain-raw",
+        action="store_true",
+        help="Keep full response headers and bodies in the output (default: status, request ID and prices only; also USPS_RETAIN_RAW=1)",
+    )
+    parser.add_argument(
+        "--queue",
+        default=None,
+        help="SQLite job queue that makes the run resumable after a crash (default USPS_JOB_QUEUE; off when neither is set)",
+    )
+    parser.add_argument("--run-id", default=None, help="Queue run to create or resume (default: derived from the input file's path, size and mtime)")
+    parser.add_argument("--retry-dead", action="store_true", help="Requeue the run's dead-lettered jobs before processing")
+    return parser.parse_args(argv)
+
+
+def write_summary(summary: Dict[str, Any]) -> None:
+    SUMMARY_PATH.parent.mkdir(parents=True, exist_ok=True)
+    SUMMARY_PATH.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    env_file = os.environ.get("ENV_FILE", ".env.local")
+    summary: Dict[str, Any] = {
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "envFile": env_file,
+        "input": args.input,
+        "output": args.output,
+        "baseUrl": None,
+        "concurrency": None,
+        "total": 0,
+        "succeeded": 0,
+        "failed": 0,
+        "elapsedSeconds": None,
+        "errors": [],
+    }
+
+    try:
+        env = load_env(env_file)
+    except OSError as exc:
+        summary["errors"].append(f"Failed to read env file: {exc}")
+        write_summary(summary)
+        return 1
+
+    missing = [key for key in REQUIRED_ENV_KEYS if not env.get(key)]
+    if missing:
+        summary["errors"].append(f"Missing required env values: {', '.join(missing)}")
+        write_summary(summary)
+        return 1
+
+    base_url = resolve_base_url(env)
+    if not base_url:
+        summary["errors"].append("Could not determine USPS API base URL from env")
+        write_summary(summary)
+        return 1
+    summary["baseUrl"] = base_url
+    shipping_url = urllib.parse.urljoin(base_url, "shipments/v3/options/search")
+
+    concurrency = args.concurrency or parse_int(env.get("USPS_CONCURRENCY")) or DEFAULT_CONCURRENCY
+    summary["concurrency"] = concurrency
+    if args.retain_raw:
+        set_retain_raw(True)
+    limits = ConcurrencyLimits(initial=concurrency, maximum=max(concurrency, args.max_concurrency)) if args.adaptive else None
+    configure_transport(pool_size=max(limits.maximum if limits else concurrency, DEFAULT_POOL_SIZE))
+    rate_limiter = configure_rate_limiter(env)
+    token_provider = get_token_provider(
+        base_url,
+        env["USPS_CLIENT_ID"],
+        env["USPS_CLIENT_SECRET"],
+        cache_path=env.get("USPS_TOKEN_CACHE"),
+    )
+    bucketer = build_bucketer(env)
+    price_cache = build_response_cache(env, bucketer=bucketer)
+
+    def quote(item: Tuple[int, Dict[str, str]]) -> QuoteRecord:
+        _, row = item
+        payload = build_payload({**env, **row})
+        # Reduce on the worker thread so only the compact record waits in the completion queue.
+        return QuoteRecord.from_response(
+            cached_post(
+                price_cache,
+                shipping_url,
+                payload,
+                lambda: http_post_json(shipping_url, payload, headers={"Authorization": f"Bearer {token_provider.get_token()}"}),
+            )
+        )
+
+    # Running aggregates of each shipment's cheapest option, so no per-row state outlives its record.
+    price_min = price_max = None
+    price_sum = 0.0
+    priced = 0
+
+    try:
+        queue = build_job_queue(env, FLOW, args.input, args.queue, args.run_id)
+    except (OSError, sqlite3.Error) as exc:
+        summary["errors"].append(f"Failed to open job queue: {exc}")
+        write_summary(summary)
+        return 1
+    if queue is not None and args.retry_dead:
+        summary["requeuedDead"] = queue.requeue_dead()
+
+    started = time.monotonic()
+    try:
+        with open_sink(Path(args.output), env, append=queue is not None and queue.resumed) as writer:
+            for (index, row), outcome, dead_lettered in run_items(
+                enumerate(read_rows(args.input), 1),
+                quote,
+                concurrency,
+                controller=limits.controller(shipping_url) if limits else None,
+                queue=queue,
+            ):
+                record: Dict[str, Any] = {"line": index, "reference": row_reference(row, index)}
+                if isinstance(outcome, BaseException):
+                    record.update(describe_error(outcome))
+                    if dead_lettered:
+                        record["deadLettered"] = True
+                else:
+                    record.update(outcome.to_dict())
+                    lowest = outcome.lowest
+                    if lowest is not None:
+                        price_min = lowest if price_min is None else min(price_min, lowest)
+                        price_max = lowest if price_max is None else max(price_max, lowest)
+                        price_sum += lowest
+                        priced += 1
+                summary["total"] += 1
+                if record["status"] == 200:
+                    summary["succeeded"] += 1
+                else:
+                    summary["failed"] += 1
+                writer.write(record)
+        summary["outputSegments"] = [str(segment) for segment in writer.segments]
+    except (OSError, ValueError) as exc:
+        summary["errors"].append(f"Failed to process input: {exc}")
+
+    summary["elapsedSeconds"] = round(time.monotonic() - started, 3)
+    if priced:
+        summary["lowestPrice"] = {"min": price_min, "max": price_max, "mean": round(price_sum / priced, 2)}
+    if limits is not None:
+        summary["concurrencyLimits"] = limits.report()
+    summary["latency"] = get_metrics().report()
+    summary["circuitBreakers"] = get_retry_engine().breaker_states()
+    summary["rateLimitWaitSeconds"] = {name: round(waited, 3) for name, waited in rate_limiter.waited.items()}
+    if queue is not None:
+        summary["jobQueue"] = queue.report()
+        queue.close()
+    if price_cache is not None:
+        summary["priceCache"] = price_cache.stats()
+    if bucketer is not None and env.get("USPS_RATE_TIERS_PATH"):
+        bucketer.save(env["USPS_RATE_TIERS_PATH"])
+    write_summary(summary)
+    return 0 if not summary["errors"] and summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,11 +4,19 @@ import os
 import sys
 import urllib.error
 import urllib.parse
-import urllib.request
 from datetime import datetime
 from pathlib import Path
 from typing import Any, Dict, Optional
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from usps_client.auth import get_token_provider  # noqa: E402
+from usps_client.metrics import get_metrics  # noqa: E402
+from usps_client.ratelimit import configure_rate_limiter  # noqa: E402
+from usps_client.records import compact_headers  # noqa: E402
+from usps_client.sink import build_sink, record_call  # noqa: E402
+from usps_client.transport import http_post_json  # noqa: E402
+
 OUTPUT_PATH = Path(__file__).resolve().parent / "output" / "shipping-options-result.json"
 REQUIRED_ENV_KEYS = ["USPS_CLIENT_ID", "USPS_CLIENT_SECRET"]
 KNOWN_ENDPOINTS = {
@@ -39,26 +47,6 @@ def load_env(path: str) -> Dict[str, str]:
     return env
 
 
-def http_post(url: str, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None, timeout: int = 15):
-    data = json.dumps(payload).encode("utf-8")
-    hdrs = {"Content-Type": "application/json"}
-    if headers:
-        hdrs.update(headers)
-    request = urllib.request.Request(url, data=data, headers=hdrs, method="POST")
-    with urllib.request.urlopen(request, timeout=timeout) as response:
-        body_bytes = response.read()
-        body_text = body_bytes.decode("utf-8") if body_bytes else ""
-        try:
-            body_json = json.loads(body_text) if body_text else {}
-        except json.JSONDecodeError:
-            body_json = {"raw": body_text}
-        return {
-            "status": response.status,
-            "headers": dict(response.headers.items()),
-            "body": body_json,
-        }
-
-
 def parse_float(value: Optional[str]) -> Optional[float]:
     if value is None or value == "":
         return None
@@ -91,6 +79,56 @@ def prune_none(obj: Any) -> Any:
     return obj
 
 
+def build_payload(env: Dict[str, str]) -> Dict[str, Any]:
+    today = datetime.utcnow().date().isoformat()
+    extra_services = parse_int_list(env.get("USPS_EXTRA_SERVICES"))
+    default_mail_class = env.get("USPS_MAIL_CLASS") or "ALL"
+    package_description: Dict[str, Any] = {
+        "weight": parse_float(env.get("USPS_PACKAGE_WEIGHT"))
+            or parse_float(env.get("USPS_WEIGHT_LBS"))
+            or parse_float(env.get("USPS_WEIGHT_OZ"))
+            or 2.0,
+        "length": parse_float(env.get("USPS_DIM_LENGTH")) or 8.0,
+        "height": parse_float(env.get("USPS_DIM_HEIGHT")) or 4.0,
+        "width": parse_float(env.get("USPS_DIM_WIDTH")) or 6.0,
+        "girth": parse_float(env.get("USPS_DIM_GIRTH")),
+        "mailClass": default_mail_class,
+        "extraServices": extra_services,
+        "mailingDate": env.get("USPS_MAILING_DATE") or today,
+        "packageValue": parse_float(env.get("USPS_PACKAGE_VALUE")),
+    }
+    package_description = prune_none(package_description)
+
+    pricing_option: Dict[str, Any] = {}
+    price_type = env.get("USPS_PRICE_TYPE") or "COMMERCIAL"
+    if price_type:
+        pricing_option["priceType"] = price_type
+    account_number = env.get("USPS_ACCOUNT_NUMBER")
+    account_type = env.get("USPS_ACCOUNT_TYPE") or ("EPS" if account_number else None)
+    if account_number:
+        pricing_option["paymentAccount"] = {
+            "accountType": account_type,
+            "accountNumber": account_number,
+        }
+
+    payload: Dict[str, Any] = {
+        "originZIPCode": env.get("USPS_ORIGIN_ZIP", "10018"),
+        "destinationZIPCode": env.get("USPS_DESTINATION_ZIP", "95823"),
+        "packageDescription": package_description,
+    }
+    origin_country = env.get("USPS_ORIGIN_COUNTRY_CODE")
+    destination_country = env.get("USPS_DESTINATION_COUNTRY_CODE")
+    if origin_country:
+        payload["originCountryCode"] = origin_country
+    if destination_country:
+        payload["destinationCountryCode"] = destination_country
+    pricing_options = prune_none(pricing_option)
+    if pricing_options:
+        payload["pricingOptions"] = [pricing_options]
+
+    return prune_none(payload)
+
+
 def main() -> int:
     env_file = os.environ.get("ENV_FILE", ".env.local")
     results: Dict[str, Any] = {
@@ -116,6 +154,13 @@ def main() -> int:
         exit_code = 1
         env = {}
 
+    try:
+        sink = build_sink(env)
+    except (OSError, ValueError) as exc:
+        results["errors"].append(f"Failed to open results sink: {exc}")
+        exit_code = 1
+        sink = None
+
     missing = [key for key in REQUIRED_ENV_KEYS if not env.get(key)]
     if missing:
         results["errors"].append(f"Missing required env values: {', '.join(missing)}")
@@ -139,18 +184,21 @@ def main() -> int:
             results["shippingOptionsUrl"] = shipping_url
 
             try:
-                auth_payload = {
-                    "grant_type": "client_credentials",
-                    "client_id": env["USPS_CLIENT_ID"],
-                    "client_secret": env["USPS_CLIENT_SECRET"],
-                }
-                results["auth"] = http_post(auth_url, auth_payload)
+                configure_rate_limiter(env)
+                token_provider = get_token_provider(
+                    base_url,
+                    env["USPS_CLIENT_ID"],
+                    env["USPS_CLIENT_SECRET"],
+                    cache_path=env.get("USPS_TOKEN_CACHE"),
+                )
+                results["auth"] = token_provider.authenticate()
             except urllib.error.HTTPError as err:
                 body = err.read().decode("utf-8", errors="replace") if err.fp else ""
                 results["auth"] = {
                     "status": err.code,
-                    "headers": dict(err.headers.items()) if err.headers else {},
+                    "headers": compact_headers(err.headers),
                     "body": {"raw": body},
+                    "timings": getattr(err, "timings", None),
                 }
                 results["errors"].append(f"Auth request failed with HTTP {err.code}")
                 exit_code = 1
@@ -174,58 +222,13 @@ def main() -> int:
                 body = results["auth"].get("body")
                 if isinstance(body, dict):
                     token = body.get("access_token")
+            results["auth"] = record_call(sink, "auth", results["auth"])
 
             if token:
-                today = datetime.utcnow().date().isoformat()
-                extra_services = parse_int_list(env.get("USPS_EXTRA_SERVICES"))
-                default_mail_class = env.get("USPS_MAIL_CLASS") or "ALL"
-                package_description: Dict[str, Any] = {
-                    "weight": parse_float(env.get("USPS_PACKAGE_WEIGHT"))
-                        or parse_float(env.get("USPS_WEIGHT_LBS"))
-                        or parse_float(env.get("USPS_WEIGHT_OZ"))
-                        or 2.0,
-                    "length": parse_float(env.get("USPS_DIM_LENGTH")) or 8.0,
-                    "height": parse_float(env.get("USPS_DIM_HEIGHT")) or 4.0,
-                    "width": parse_float(env.get("USPS_DIM_WIDTH")) or 6.0,
-                    "girth": parse_float(env.get("USPS_DIM_GIRTH")),
-                    "mailClass": default_mail_class,
-                    "extraServices": extra_services,
-                    "mailingDate": env.get("USPS_MAILING_DATE") or today,
-                    "packageValue": parse_float(env.get("USPS_PACKAGE_VALUE")),
-                }
-                package_description = prune_none(package_description)
-
-                pricing_option: Dict[str, Any] = {}
-                price_type = env.get("USPS_PRICE_TYPE") or "COMMERCIAL"
-                if price_type:
-                    pricing_option["priceType"] = price_type
-                account_number = env.get("USPS_ACCOUNT_NUMBER")
-                account_type = env.get("USPS_ACCOUNT_TYPE") or ("EPS" if account_number else None)
-                if account_number:
-                    pricing_option["paymentAccount"] = {
-                        "accountType": account_type,
-                        "accountNumber": account_number,
-                    }
-
-                payload: Dict[str, Any] = {
-                    "originZIPCode": env.get("USPS_ORIGIN_ZIP", "10018"),
-                    "destinationZIPCode": env.get("USPS_DESTINATION_ZIP", "95823"),
-                    "packageDescription": package_description,
-                }
-                origin_country = env.get("USPS_ORIGIN_COUNTRY_CODE")
-                destination_country = env.get("USPS_DESTINATION_COUNTRY_CODE")
-                if origin_country:
-                    payload["originCountryCode"] = origin_country
-                if destination_country:
-                    payload["destinationCountryCode"] = destination_country
-                pricing_options = prune_none(pricing_option)
-                if pricing_options:
-                    payload["pricingOptions"] = [pricing_options]
-
-                payload = prune_none(payload)
+                payload = build_payload(env)
 
                 try:
-                    results["shippingOptions"] = http_post(
+                    results["shippingOptions"] = http_post_json(
                         shipping_url,
                         payload,
                         headers={
@@ -239,8 +242,9 @@ def main() -> int:
                     body = err.read().decode("utf-8", errors="replace") if err.fp else ""
                     results["shippingOptions"] = {
                         "status": err.code,
-                        "headers": dict(err.headers.items()) if err.headers else {},
+                        "headers": compact_headers(err.headers),
                         "body": {"raw": body},
+                        "timings": getattr(err, "timings", None),
                     }
                     results["errors"].append(f"Shipping options request failed with HTTP {err.code}")
                     exit_code = 1
@@ -263,6 +267,11 @@ def main() -> int:
                     results["errors"].append("Access token not returned from auth response")
                 exit_code = 1 if exit_code == 0 else exit_code
 
+    results["shippingOptions"] = record_call(sink, "shippingOptions", results["shippingOptions"])
+    if sink is not None:
+        sink.close()
+        results["resultsSink"] = [str(segment) for segment in sink.segments]
+    results["latency"] = get_metrics().report()
     OUTPUT_PATH.parent.mkdir(parents=True, exist_ok=True)
     OUTPUT_PATH.write_text(json.dumps(results, indent=2), encoding="utf-8")
     return exit_code
@@ -0,0 +1,82 @@
+import socketserver
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+# usps_client lives next to the harnesses, which import it the same way.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+OK = b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: 2\r\n\r\n{}"
+
+
+def read_request(rfile) -> bool:
+    length = 0
+    line = rfile.readline()
+    if not line:
+        return False
+    while True:
+        header = rfile.readline()
+        if header in (b"\r\n", b""):
+            break
+        name, _, value = header.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    rfile.read(length)
+    return True
+
+
+class DroppingServer(socketserver.ThreadingTCPServer):
+    """Answers the first request on the first connection, then reads the second and hangs up -- before replying,
+    or after the status line when ``partial`` -- as a server that processed a request on a keep-alive socket and
+    dropped it would. Later connections answer normally."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, partial: bool = False):
+        super().__init__(("127.0.0.1", 0), self.Handler)
+        self.partial = partial
+        self.connections = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            server = self.server
+            with server.lock:
+                server.connections += 1
+                first = server.connections == 1
+            served = 0
+            while read_request(self.rfile):
+                with server.lock:
+                    server.requests += 1
+                if first and served == 1:
+                    if server.partial:
+                        self.wfile.write(b"HTTP/1.1 200 OK\r\n")
+                        self.wfile.flush()
+                    return
+                self.wfile.write(OK)
+                self.wfile.flush()
+                served += 1
+
+
+@pytest.fixture
+def dropping_server():
+    servers = []
+
+    def start(partial: bool = False) -> DroppingServer:
+        server = DroppingServer(partial)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
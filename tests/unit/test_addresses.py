@@ -0,0 +1,151 @@
+import email.message
+import io
+import threading
+import time
+import urllib.error
+
+from usps_client.addresses import AddressCache, AddressValidator, address_key, address_result, normalize_address
+from usps_client.batch import run_items
+from usps_client.cache import MemoryTier
+from usps_client.jobs import JobQueue
+
+BASE_URL = "https://apis.usps.com/"
+MATCH = {"address": {"city": "WASHINGTON", "state": "DC", "ZIPCode": "20260"}, "additionalInfo": {"DPVConfirmation": "Y", "carrierRoute": "C000"}}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Validator(AddressValidator):
+    """Answers from ``answer(query)`` instead of the network, counting calls."""
+
+    def __init__(self, answer, cache=None):
+        super().__init__(BASE_URL, lambda: "token", cache=cache)
+        self.answer = answer
+        self.queries = []
+
+    def _fetch(self, query):
+        self.queries.append(dict(query))
+        self._count("fetched")
+        return self.answer(query)
+
+
+def matched(query):
+    return address_result(200, MATCH, query)
+
+
+def test_spelling_variants_share_one_key():
+    first = normalize_address({"streetAddress": "475 L'Enfant Plaza Southwest", "city": "washington", "state": "dc", "ZIPCode": "20260-0004"})
+    second = normalize_address({"USPS_ADDR_STREET": "475 l enfant plz. SW", "USPS_ADDR_CITY": "Washington", "USPS_ADDR_STATE": "DC", "zip": "20260"})
+    assert first["streetAddress"] == "475 L ENFANT PLZ SW"
+    assert first["ZIPCode"] == "20260"
+    assert address_key(first) == address_key(second)
+    # A directional or suffix that is the whole street name stays spelled out.
+    assert normalize_address({"streetAddress": "1 North Street"})["streetAddress"] == "1 NORTH ST"
+    assert normalize_address({"address2": "Suite 5"})["secondaryAddress"] == "STE 5"
+
+
+def test_result_verdict_follows_dpv_and_route():
+    query = normalize_address({"city": "Washington", "state": "DC", "ZIPCode": "20260"})
+    assert matched(query)["valid"] and not matched(query)["adjusted"]
+    phantom = address_result(200, dict(MATCH, additionalInfo={"DPVConfirmation": "Y", "carrierRoute": "R777"}), query)
+    assert not phantom["valid"] and phantom["error"] == "Delivery not available by USPS"
+    assert address_result(200, dict(MATCH, additionalInfo={"DPVConfirmation": "N"}), query)["error"] == "Invalid address"
+    assert address_result(404, {"error": {"message": "Address Not Found"}}, query) == {"status": 404, "valid": False, "error": "Address Not Found"}
+
+
+def test_cache_keeps_answers_for_their_ttl_and_never_transient_failures():
+    clock = Clock()
+    cache = AddressCache([MemoryTier()], ttl=100, not_found_ttl=10, clock=clock)
+    cache.put("match", {"status": 200, "valid": True})
+    cache.put("missing", {"status": 404, "valid": False})
+    cache.put("outage", {"status": 503, "valid": False})
+    assert cache.get("outage") is None
+    clock.now += 11
+    assert cache.get("missing") is None
+    assert cache.get("match") == {"status": 200, "valid": True}
+    assert cache.stats() == {"hits": 1, "misses": 2}
+
+
+def test_validate_many_dedupes_keeps_order_and_reports_transport_errors():
+    def answer(query):
+        if query["ZIPCode"] == "99999":
+            raise urllib.error.HTTPError(BASE_URL, 503, "error", email.message.Message(), io.BytesIO(b""))
+        return matched(query)
+
+    validator = Validator(answer, cache=AddressCache([MemoryTier()]))
+    rows = [
+        {"streetAddress": "1 Main Street", "ZIPCode": "20260"},
+        {"streetAddress": "9 Elm St", "ZIPCode": "99999"},
+        {"streetAddress": "1 MAIN ST.", "ZIPCode": "20260-0001"},
+    ]
+    results = validator.validate_many(rows, concurrency=2)
+    assert [result["status"] for result in results] == [200, 503, 200]
+    assert (results[1]["valid"], results[1]["error"]) == (False, "HTTP 503")
+    assert len(validator.queries) == 2
+    # The next chunk's repeat is a cache hit; the failed lookup was not cached and is tried again.
+    again = validator.validate_many(rows[:2])
+    assert again[0]["cached"] and len(validator.queries) == 3
+    assert validator.report()["lookups"] == 5
+
+
+def test_queued_chunk_with_a_transient_failure_is_retried_then_dead_lettered(tmp_path):
+    failures = {"2 MAIN ST": 1, "9 ELM ST": 5}
+
+    def answer(query):
+        if failures.get(query["streetAddress"]):
+            failures[query["streetAddress"]] -= 1
+            raise urllib.error.HTTPError(BASE_URL, 503, "error", email.message.Message(), io.BytesIO(b""))
+        return matched(query)
+
+    validator = Validator(answer, cache=AddressCache([MemoryTier()]))
+    chunks = [
+        (1, [{"streetAddress": "1 Main St", "ZIPCode": "20260"}, {"streetAddress": "2 Main St", "ZIPCode": "20260"}]),
+        (2, [{"streetAddress": "3 Main St", "ZIPCode": "20260"}, {"streetAddress": "9 Elm St", "ZIPCode": "99999"}]),
+    ]
+    queue = JobQueue(str(tmp_path / "queue.sqlite"), "run", max_attempts=3, retry_delay=0.0)
+    settled = {
+        chunk_id: (outcome, dead)
+        for (chunk_id, _), outcome, dead in run_items(
+            chunks, lambda item: validator.validate_many(item[1], raise_transient=True), 1, queue=queue
+        )
+    }
+    # Chunk 1 lost one lookup to a 503 and passed on its retry; only the failed address was fetched again.
+    assert [result["status"] for result in settled[1][0]] == [200, 200] and not settled[1][1]
+    assert isinstance(settled[2][0], urllib.error.HTTPError) and settled[2][1]
+    assert queue.report()["states"] == {"done": 1, "dead": 1}
+    fetched = [query["streetAddress"] for query in validator.queries]
+    assert (fetched.count("1 MAIN ST"), fetched.count("2 MAIN ST"), fetched.count("9 ELM ST")) == (1, 2, 3)
+    queue.close()
+
+
+def test_concurrent_lookups_of_one_key_share_a_request():
+    release = threading.Event()
+    entered = threading.Event()
+
+    def answer(query):
+        entered.set()
+        release.wait(5)
+        return matched(query)
+
+    validator = Validator(answer)
+    row = {"streetAddress": "1 Main St", "ZIPCode": "20260"}
+    results = []
+    first = threading.Thread(target=lambda: results.append(validator.validate(row)))
+    first.start()
+    entered.wait(5)
+    second = threading.Thread(target=lambda: results.append(validator.validate(dict(row, streetAddress="1 main street"))))
+    second.start()
+    deadline = time.monotonic() + 5
+    while validator.counts["coalesced"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    first.join()
+    second.join()
+    assert len(validator.queries) == 1
+    assert sorted(bool(result.get("coalesced")) for result in results) == [False, True]
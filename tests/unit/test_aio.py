@@ -0,0 +1,83 @@
+import asyncio
+import urllib.error
+
+import pytest
+
+from usps_client import auth
+from usps_client.aio import AsyncHttpTransport, AsyncUspsClient, _AsyncHostPool
+from usps_client.ratelimit import RateLimiter
+from usps_client.retry import RetryEngine, RetryPolicy
+
+
+def transport() -> AsyncHttpTransport:
+    return AsyncHttpTransport(retry_engine=RetryEngine(RetryPolicy(max_attempts=1)), rate_limiter=RateLimiter({}))
+
+
+async def twice(method: str, url: str):
+    client = transport()
+    try:
+        first = await client.request("GET", url)
+        return first, await client.request(method, url, body=b"{}" if method == "POST" else None)
+    finally:
+        client.close()
+
+
+def test_idempotent_request_is_resent_after_stale_keep_alive(dropping_server):
+    server = dropping_server()
+    _, second = asyncio.run(twice("GET", f"{server.base_url}/prices/v3/base-rates/search"))
+    assert second.status == 200
+    assert not second.timings["reused"]
+    assert server.requests == 3
+
+
+def test_label_post_is_not_resent_after_stale_keep_alive(dropping_server):
+    server = dropping_server()
+    with pytest.raises(urllib.error.URLError):
+        asyncio.run(twice("POST", f"{server.base_url}/labels/v3/label"))
+    assert server.requests == 2
+
+
+def test_request_is_not_resent_once_the_response_started(dropping_server):
+    server = dropping_server(partial=True)
+    with pytest.raises(urllib.error.URLError):
+        asyncio.run(twice("GET", f"{server.base_url}/prices/v3/base-rates/search"))
+    assert server.requests == 2
+
+
+def test_client_tokens_come_from_the_shared_provider(monkeypatch):
+    calls = []
+
+    def post(url, payload, timeout=15):
+        calls.append(url)
+        return {"status": 200, "body": {"access_token": "shared", "expires_in": 3600}}
+
+    monkeypatch.setattr(auth, "http_post_form", post)
+    monkeypatch.setattr(auth, "_providers", {})
+
+    async def tokens():
+        client = AsyncUspsClient("http://usps.test", client_id="client", client_secret="secret")
+        try:
+            return await asyncio.gather(*(client.access_token() for _ in range(4)))
+        finally:
+            client.close()
+
+    assert asyncio.run(tokens()) == ["shared"] * 4
+    assert auth.get_token_provider("http://usps.test/", "client", "secret").get_token() == "shared"
+    assert calls == ["http://usps.test/oauth2/v3/token"]
+
+
+def test_queue_ms_is_the_wait_for_a_pool_slot_not_the_connect():
+    async def run():
+        server = await asyncio.start_server(lambda reader, writer: None, "127.0.0.1", 0)
+        pool = _AsyncHostPool("http", "127.0.0.1", server.sockets[0].getsockname()[1], 1, 60, None)
+        try:
+            conn, reused, connect_timings, waited = await pool.acquire()
+            assert not reused and "connectMs" in connect_timings and waited < 20
+            asyncio.get_running_loop().call_later(0.05, pool.release, conn, True)
+            _, reused, connect_timings, waited = await pool.acquire()
+            assert reused and connect_timings == {} and waited >= 40
+        finally:
+            pool.close()
+            server.close()
+
+    asyncio.run(run())
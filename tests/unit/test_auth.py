@@ -0,0 +1,57 @@
+import threading
+import time
+
+from usps_client import auth
+from usps_client.auth import TokenProvider
+
+
+def fake_token_endpoint(monkeypatch, expires_in=3600, delay=0.0):
+    calls = []
+
+    def post(url, payload, timeout=15):
+        calls.append(payload["client_id"])
+        time.sleep(delay)
+        return {"status": 200, "body": {"access_token": f"token-{len(calls)}", "expires_in": expires_in}}
+
+    monkeypatch.setattr(auth, "http_post_form", post)
+    return calls
+
+
+def test_concurrent_callers_share_one_refresh(monkeypatch):
+    calls = fake_token_endpoint(monkeypatch, delay=0.05)
+    provider = TokenProvider("http://usps.test/", "client", "secret")
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(provider.get_token())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert tokens == ["token-1"] * 8
+    assert len(calls) == 1
+    assert provider.authenticate()["cached"] is True
+
+
+def test_invalidate_forces_a_new_token(monkeypatch):
+    calls = fake_token_endpoint(monkeypatch)
+    provider = TokenProvider("http://usps.test/", "client", "secret")
+    assert provider.get_token() == "token-1"
+    provider.invalidate()
+    assert provider.get_token() == "token-2"
+    assert len(calls) == 2
+
+
+def test_disk_cache_is_reused_by_a_new_provider(monkeypatch, tmp_path):
+    calls = fake_token_endpoint(monkeypatch)
+    path = tmp_path / "tokens.json"
+    assert TokenProvider("http://usps.test/", "client", "secret", cache_path=str(path)).get_token() == "token-1"
+    assert TokenProvider("http://usps.test", "client", "secret", cache_path=str(path)).get_token() == "token-1"
+    assert TokenProvider("http://usps.test/", "other", "secret", cache_path=str(path)).get_token() == "token-2"
+    assert len(calls) == 2
+
+
+def test_expired_token_is_refreshed(monkeypatch):
+    calls = fake_token_endpoint(monkeypatch, expires_in=auth.EXPIRY_MARGIN_SECONDS)
+    provider = TokenProvider("http://usps.test/", "client", "secret")
+    assert provider.get_token() == "token-1"
+    assert provider.get_token() == "token-2"
+    assert len(calls) == 2
@@ -0,0 +1,88 @@
+import gzip
+import threading
+import time
+
+import pytest
+
+from usps_client.batch import QUEUE_DEPTH_PER_WORKER, read_rows, row_reference, run_bounded
+from usps_client.config import load_env, parse_int, resolve_base_url
+
+
+def test_read_rows_csv_drops_blank_cells(tmp_path):
+    path = tmp_path / "rows.csv"
+    path.write_text("reference, USPS_WEIGHT_LBS ,USPS_ORIGIN_ZIP\nA1, 2.5 ,\n", encoding="utf-8")
+    assert list(read_rows(str(path))) == [{"reference": "A1", "USPS_WEIGHT_LBS": "2.5"}]
+
+
+def test_read_rows_jsonl_gzip_turns_values_into_env_strings(tmp_path):
+    path = tmp_path / "rows.jsonl.gz"
+    with gzip.open(path, "wt", encoding="utf-8") as handle:
+        handle.write('# comment\n{"id": 7, "codes": [1, 2], "flag": true, "skip": null}\n\n')
+    assert list(read_rows(str(path))) == [{"id": "7", "codes": "1,2", "flag": "true"}]
+
+
+def test_read_rows_rejects_non_object_lines(tmp_path):
+    path = tmp_path / "rows.jsonl"
+    path.write_text("[1, 2]\n", encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(read_rows(str(path)))
+
+
+def test_run_bounded_yields_every_outcome_and_bounds_pending_items():
+    in_flight = 0
+    peak = 0
+    lock = threading.Lock()
+    pulled = []
+
+    def items():
+        for index in range(40):
+            pulled.append(index)
+            yield index
+
+    def worker(item):
+        nonlocal in_flight, peak
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        time.sleep(0.002)
+        with lock:
+            in_flight -= 1
+        if item % 10 == 3:
+            raise RuntimeError(item)
+        return item * 2
+
+    seen = {}
+    for item, outcome in run_bounded(items(), worker, 4):
+        # Items are pulled lazily: at most the pending window, plus the one waiting for a slot, ahead of the output.
+        assert len(pulled) - len(seen) <= 4 * QUEUE_DEPTH_PER_WORKER + 1
+        seen[item] = outcome
+    assert sorted(seen) == list(range(40))
+    assert peak <= 4
+    assert isinstance(seen[13], RuntimeError)
+    assert seen[20] == 40
+
+
+def test_row_reference_prefers_reference_then_id_then_line():
+    assert row_reference({"reference": "R", "id": "I"}, 3) == "R"
+    assert row_reference({"orderId": "O"}, 3) == "O"
+    assert row_reference({}, 3) == "3"
+
+
+def test_load_env_strips_quotes_and_comments(tmp_path):
+    path = tmp_path / ".env"
+    path.write_text('# comment\nUSPS_CLIENT_ID = "abc"\nNOEQUALS\nUSPS_MID=123=4\n', encoding="utf-8")
+    assert load_env(str(path)) == {"USPS_CLIENT_ID": "abc", "USPS_MID": "123=4"}
+
+
+def test_resolve_base_url_prefers_known_environment_over_mock_default():
+    assert resolve_base_url({"MOCK_SERVER_BASEURL": "http://localhost:9091"}) == "http://localhost:9091/"
+    assert resolve_base_url({"MOCK_SERVER_BASEURL": "http://localhost:9091", "USPS_ENV": "prod"}) == "https://apis.usps.com/"
+    assert resolve_base_url({"USPS_BASE_URL": "https://example.test/api", "USPS_ENV": "TEM"}) == "https://example.test/api/"
+    assert resolve_base_url({}) is None
+
+
+def test_parse_int():
+    assert parse_int(" 12 ") == 12
+    assert parse_int("") is None
+    assert parse_int("x") is None
+    assert parse_int(None) is None
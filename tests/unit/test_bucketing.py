@@ -0,0 +1,103 @@
+from usps_client.bucketing import RateBucketer, build_bucketer, price_signature, weight_tier
+from usps_client.cache import MemoryTier, ResponseCache, cached_post
+
+URL = "https://apis.usps.com/shipments/v3/options/search"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def quote(weight, length=10.4, origin="20260", destination="90210"):
+    return {
+        "originZIPCode": origin,
+        "destinationZIPCode": destination,
+        "packageDescription": {"weight": weight, "length": length, "width": 6.0, "height": 4.0},
+    }
+
+
+def test_weight_tier_ceilings():
+    assert weight_tier(0.1) == 0.25
+    assert weight_tier(0.9) == 15.99 / 16
+    assert weight_tier(0.9996) == 1.0
+    assert weight_tier(1.0) == 1.0
+    assert weight_tier(1.01) == 2.0
+
+
+def test_key_payload_buckets_weight_but_keeps_dimensions_and_zips():
+    bucketer = RateBucketer()
+    payload = quote(1.2)
+    keyed = bucketer.key_payload(payload)
+    assert keyed["packageDescription"] == {"weight": 2.0, "length": 10.4, "width": 6.0, "height": 4.0}
+    assert keyed["destinationZIPCode"] == "90210"
+    assert payload == quote(1.2)
+    assert bucketer.key_payload(quote(1.2, length=10.6)) != keyed
+
+
+def test_zip3_collapse_is_opt_in():
+    assert build_bucketer({"USPS_RATE_BUCKETING": "on"}).key_payload(quote(1))["originZIPCode"] == "20260"
+    bucketer = build_bucketer({"USPS_RATE_BUCKETING": "on", "USPS_RATE_BUCKET_ZIP3": "true"})
+    assert bucketer.key_payload(quote(1))["originZIPCode"] == "202"
+    assert build_bucketer({}) is None
+
+
+def test_cached_post_sends_the_original_payload_and_shares_the_tier():
+    bucketer = RateBucketer()
+    cache = ResponseCache([MemoryTier()], bucketer=bucketer)
+    sent = []
+
+    def fetch(payload):
+        sent.append(payload)
+        return {"status": 200, "body": {"price": 9.5}}
+
+    first = quote(1.2)
+    assert cached_post(cache, URL, first, lambda: fetch(first))["body"] == {"price": 9.5}
+    second = quote(1.7)
+    assert cached_post(cache, URL, second, lambda: fetch(second))["cached"] is True
+    assert sent == [quote(1.2)]
+
+
+def test_learned_tiers_answer_weights_between_equal_prices(tmp_path):
+    bucketer = RateBucketer()
+    for weight, price in ((2, 10.0), (5, 10.0), (6, 12.0), (9, 15.0)):
+        bucketer.observe(URL, quote(weight), {"status": 200, "body": {"price": price}})
+    assert bucketer.lookup(URL, quote(3.5))["body"] == {"price": 10.0}
+    assert bucketer.lookup(URL, quote(5.5))["body"] == {"price": 12.0}
+    assert bucketer.lookup(URL, quote(7)) is None
+    assert bucketer.lookup(URL, quote(3.5, destination="10001")) is None
+    path = str(tmp_path / "tiers.json")
+    bucketer.save(path)
+    reloaded = RateBucketer()
+    reloaded.load(path)
+    assert list(reloaded.tier_boundaries().values()) == [[(2.0, 5.0), (6.0, 6.0), (9.0, 9.0)]]
+
+
+def test_learned_points_expire_and_are_pruned_when_saved(tmp_path):
+    clock = Clock()
+    bucketer = RateBucketer(clock=clock)
+    cache = ResponseCache([MemoryTier()], ttl=100, clock=clock, bucketer=bucketer)
+    for weight in (2, 5):
+        cache.put(URL, quote(weight), {"status": 200, "body": {"price": 10.0}})
+    bucketer.observe(URL, quote(2, destination="10001"), {"status": 200, "body": {"price": 8.0}}, expires_at=clock.now + 1000)
+    assert bucketer.lookup(URL, quote(3.5))["body"] == {"price": 10.0}
+    clock.now += 100
+    assert bucketer.lookup(URL, quote(3.5)) is None
+    path = str(tmp_path / "tiers.json")
+    bucketer.save(path)
+    reloaded = RateBucketer(clock=clock)
+    reloaded.load(path)
+    [context] = reloaded.tier_boundaries()
+    assert '"destinationZIPCode":"10001"' in context
+    clock.now += 1000
+    expired = RateBucketer(clock=clock)
+    expired.load(path)
+    assert expired.tier_boundaries() == {}
+
+
+def test_price_signature_collects_prices_in_order():
+    assert price_signature({"rates": [{"price": 1.5}, {"totalPrice": 2}]}) == "[1.5, 2]"
+    assert price_signature({"rates": []}) is None
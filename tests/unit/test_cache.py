@@ -0,0 +1,119 @@
+from datetime import datetime, timezone
+
+from usps_client.cache import (
+    EligibilityCache,
+    MemoryTier,
+    ResponseCache,
+    SqliteTier,
+    build_response_cache,
+    cached_post,
+    canonical_key,
+    end_of_mailing_day,
+)
+
+URL = "https://apis.usps.com/prices/v3/base-rates/search"
+
+
+class Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_canonical_key_ignores_key_order_and_none_values():
+    assert canonical_key(URL, {"a": 1, "b": None, "c": [1, None]}) == canonical_key(URL, {"c": [1], "a": 1})
+    assert canonical_key(URL, {"a": 1}) != canonical_key(URL + "x", {"a": 1})
+
+
+def test_end_of_mailing_day_is_the_next_utc_midnight():
+    expected = datetime(2025, 1, 21, tzinfo=timezone.utc).timestamp()
+    assert end_of_mailing_day({"mailingDate": "2025-01-20"}) == expected
+    assert end_of_mailing_day({"mailingDate": "soon"}) is None
+    assert end_of_mailing_day({}) is None
+
+
+def test_memory_tier_expires_and_evicts_least_recently_used():
+    tier = MemoryTier(max_entries=2)
+    tier.put("a", 1, 100)
+    tier.put("b", 2, 100)
+    assert tier.get("a", 0) == (100, 1)
+    tier.put("c", 3, 100)
+    assert tier.get("b", 0) is None
+    assert tier.get("a", 100) is None
+
+
+def test_sqlite_tier_persists_between_instances(tmp_path):
+    path = str(tmp_path / "cache.db")
+    first = SqliteTier(path)
+    first.put("k", {"status": 200}, 100)
+    first.close()
+    second = SqliteTier(path)
+    assert second.get("k", 50) == (100, {"status": 200})
+    second.purge(100)
+    assert second.get("k", 0) is None
+    second.close()
+
+
+def test_response_cache_stores_only_successes_and_promotes_hits(tmp_path):
+    clock = Clock()
+    memory = MemoryTier()
+    disk = SqliteTier(str(tmp_path / "cache.db"))
+    cache = ResponseCache([memory, disk], ttl=60, clock=clock)
+    cache.put(URL, {"weight": 1}, {"status": 503, "body": {}})
+    assert cache.get(URL, {"weight": 1}) is None
+    cache.put(URL, {"weight": 1}, {"status": 200, "headers": {}, "body": {"price": 1}, "timings": {}})
+    fresh = ResponseCache([MemoryTier(), disk], ttl=60, clock=clock)
+    assert fresh.get(URL, {"weight": 1}) == {"status": 200, "headers": {}, "body": {"price": 1}}
+    assert fresh.tiers[0].get(canonical_key(URL, {"weight": 1}), clock.now) is not None
+    clock.now += 61
+    assert fresh.get(URL, {"weight": 1}) is None
+    assert fresh.stats() == {"hits": 1, "misses": 1}
+
+
+def test_response_cache_expires_quotes_at_the_end_of_their_mailing_day():
+    midnight = datetime(2025, 1, 21, tzinfo=timezone.utc).timestamp()
+    clock = Clock(midnight - 10)
+    cache = ResponseCache([MemoryTier()], ttl=3600, clock=clock)
+    payload = {"mailingDate": "2025-01-20"}
+    cache.put(URL, payload, {"status": 200, "body": {}})
+    assert cache.get(URL, payload) is not None
+    clock.now = midnight
+    assert cache.get(URL, payload) is None
+
+
+def test_cached_post_fetches_once():
+    cache = ResponseCache([MemoryTier()])
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return {"status": 200, "body": {"n": len(calls)}}
+
+    assert cached_post(cache, URL, {"w": 1}, fetch)["body"] == {"n": 1}
+    second = cached_post(cache, URL, {"w": 1}, fetch)
+    assert second["cached"] is True and second["body"] == {"n": 1}
+    assert len(calls) == 1
+    assert cached_post(None, URL, {"w": 1}, fetch)["body"] == {"n": 2}
+
+
+def test_build_response_cache_honours_off_and_path(tmp_path):
+    assert build_response_cache({"USPS_PRICE_CACHE": "off"}) is None
+    cache = build_response_cache({"USPS_PRICE_CACHE_PATH": str(tmp_path / "c.db"), "USPS_PRICE_CACHE_TTL": "5"})
+    assert len(cache.tiers) == 2 and cache.ttl == 5
+
+
+def test_eligibility_cache_remembers_rejections_until_ttl(tmp_path):
+    clock = Clock()
+    path = str(tmp_path / "eligibility.json")
+    cache = EligibilityCache(path, ttl=100, clock=clock)
+    route = EligibilityCache.route_key("CA", "PRIORITY_MAIL_INTERNATIONAL")
+    cache.record(route, 930, 400)
+    cache.record(route, 931, 503)
+    cache.save()
+    reloaded = EligibilityCache(path, ttl=100, clock=clock)
+    assert reloaded.known_ineligible(route, 930)
+    assert not reloaded.known_ineligible(route, 931)
+    clock.now += 101
+    assert not reloaded.known_ineligible(route, 930)
@@ -0,0 +1,100 @@
+import email.message
+import io
+import urllib.error
+
+from usps_client.batch import run_bounded
+from usps_client.concurrency import AimdController, ConcurrencyLimits
+from usps_client.retry import RetryEngine, RetryPolicy
+
+PRICES = "https://apis.usps.com/prices/v3/base-rates/search"
+TOKEN = "https://apis.usps.com/oauth2/v3/token"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Response:
+    def __init__(self, total_ms, queue_ms=0.0):
+        self.timings = {"queueMs": queue_ms, "totalMs": total_ms}
+
+
+def http_error(code):
+    return urllib.error.HTTPError(PRICES, code, "error", email.message.Message(), io.BytesIO(b""))
+
+
+def test_success_near_baseline_grows_limit_by_about_one_per_window():
+    controller = AimdController("prices", initial=4, maximum=8)
+    for _ in range(4):
+        controller.on_result(0.1)
+    assert controller.limit == 4
+    assert 4.9 < controller._limit < 5.0
+    assert controller.baseline == 0.1
+
+
+def test_overload_and_slow_replies_halve_limit_once_per_baseline():
+    clock = Clock()
+    controller = AimdController("prices", initial=16, clock=clock)
+    controller.on_result(0.1)
+    controller.on_result(None, http_error(503))
+    assert controller.limit == 8
+    controller.on_result(0.5)
+    assert controller.limit == 8
+    clock.now = 0.2
+    controller.on_result(0.5)
+    assert controller.limit == 4
+    assert controller.decreases == 2
+
+
+def test_client_errors_and_missing_timings_are_ignored():
+    controller = AimdController("prices", initial=4)
+    controller.on_result(0.01, http_error(400))
+    controller.on_result(None)
+    assert controller.baseline is None
+    assert controller.snapshot()["increases"] == 0
+
+
+def test_limits_learn_from_each_transport_attempt_not_from_retry_sleeps():
+    engine = RetryEngine(RetryPolicy(max_attempts=2))
+    limits = ConcurrencyLimits(initial=8, engine=engine)
+    controller = limits.controller(PRICES)
+    attempts = [http_error(503), Response(total_ms=120.0, queue_ms=20.0)]
+
+    def send():
+        outcome = attempts.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    engine.call("POST", PRICES, send, sleep=lambda seconds: None)
+    snapshot = controller.snapshot()
+    assert snapshot["decreases"] == 1
+    assert snapshot["baselineLatencyMs"] == 100.0
+    # Endpoints without a controller (the token call) are not tracked.
+    engine.call("POST", TOKEN, lambda: Response(total_ms=5.0))
+    assert list(limits.report()) == ["apis.usps.com/prices/v3/base-rates/search"]
+    limits.close()
+    engine.call("POST", PRICES, lambda: Response(total_ms=1.0))
+    assert controller.baseline == 0.1
+
+
+def test_cache_hits_in_the_worker_never_reach_the_controller():
+    engine = RetryEngine()
+    limits = ConcurrencyLimits(initial=2, maximum=4, engine=engine)
+    controller = limits.controller(PRICES)
+
+    def worker(item):
+        if item % 2:
+            return "cached"
+        return engine.call("POST", PRICES, lambda: Response(total_ms=200.0))
+
+    results = dict(run_bounded(range(10), worker, 2, controller=controller))
+    limits.close()
+    assert len(results) == 10
+    assert controller.baseline == 0.2
+    assert controller.increases == 5
+    assert controller.decreases == 0
@@ -0,0 +1,183 @@
+import email.message
+import io
+import socket
+import urllib.error
+
+import pytest
+
+from usps_client.idempotency import (
+    AMBIGUOUS,
+    COMPLETED,
+    FAILED,
+    AmbiguousLabelError,
+    LabelInFlightError,
+    LabelLedger,
+    artifact_reconciler,
+    artifact_stem,
+    build_label_ledger,
+    idempotency_key,
+    outcome_state,
+)
+from usps_client.retry import CircuitOpenError
+
+LABELS = "https://apis.usps.com/labels/v3/label"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def http_error(code):
+    return urllib.error.HTTPError(LABELS, code, "error", email.message.Message(), io.BytesIO(b""))
+
+
+def raising(exc):
+    def send():
+        raise exc
+
+    return send
+
+
+def ledger_at(tmp_path, **kwargs):
+    kwargs.setdefault("reconcilers", [])
+    return LabelLedger(str(tmp_path / "ledger.sqlite"), **kwargs)
+
+
+def test_key_changes_with_payload_and_carries_the_reference():
+    key = idempotency_key(LABELS, {"weight": 1}, "order-1")
+    assert key.startswith("order-1:")
+    assert key != idempotency_key(LABELS, {"weight": 2}, "order-1")
+    assert idempotency_key(LABELS, {"weight": 1}) == key.split(":", 1)[1]
+
+
+@pytest.mark.parametrize(
+    "exc, state",
+    [
+        (http_error(400), FAILED),
+        (http_error(429), FAILED),
+        (http_error(503), AMBIGUOUS),
+        (CircuitOpenError("labels", 5.0), FAILED),
+        (urllib.error.URLError(ConnectionRefusedError()), FAILED),
+        (urllib.error.URLError(socket.timeout("timed out")), AMBIGUOUS),
+    ],
+)
+def test_outcome_state(exc, state):
+    assert outcome_state(exc) == state
+
+
+def test_completed_key_is_replayed_not_resent(tmp_path):
+    ledger = ledger_at(tmp_path)
+    sends = []
+
+    def send():
+        sends.append(1)
+        return {"status": 200, "trackingNumber": "9400"}
+
+    assert ledger.call("k", send) == {"status": 200, "trackingNumber": "9400"}
+    assert ledger.call("k", send) == {"status": 200, "trackingNumber": "9400", "replayed": True}
+    assert len(sends) == 1
+    assert ledger.report()["states"] == {COMPLETED: 1}
+    assert ledger.counts["replayed"] == 1
+
+
+def test_any_2xx_result_is_replayed_not_resent(tmp_path):
+    ledger = ledger_at(tmp_path)
+    assert ledger.call("k", lambda: {"status": 201, "trackingNumber": "9400"})["status"] == 201
+    assert ledger.call("k", lambda: pytest.fail("resent"))["replayed"] is True
+    assert ledger.entry("k")["state"] == COMPLETED
+
+
+def test_rejected_key_may_be_sent_again(tmp_path):
+    ledger = ledger_at(tmp_path)
+    with pytest.raises(urllib.error.HTTPError):
+        ledger.call("k", raising(http_error(400)))
+    assert ledger.entry("k")["state"] == FAILED
+    assert ledger.call("k", lambda: {"status": 200})["status"] == 200
+    assert ledger.entry("k")["attempts"] == 2
+
+
+def test_ambiguous_key_is_blocked_until_resend_is_allowed(tmp_path):
+    ledger = ledger_at(tmp_path)
+    with pytest.raises(urllib.error.HTTPError):
+        ledger.call("k", raising(http_error(502)))
+    with pytest.raises(AmbiguousLabelError):
+        ledger.call("k", lambda: {"status": 200})
+    assert ledger.counts["blocked"] == 1
+    ledger.close()
+    resending = ledger_at(tmp_path, resend_ambiguous=True)
+    assert resending.call("k", lambda: {"status": 200}) == {"status": 200}
+
+
+def test_pending_key_is_in_flight_until_abandoned(tmp_path):
+    clock = Clock()
+    ledger = ledger_at(tmp_path, clock=clock, in_flight_timeout=60)
+    observed = []
+
+    def send():
+        with pytest.raises(LabelInFlightError):
+            ledger.call("k", lambda: {"status": 200})
+        clock.now += 60
+        with pytest.raises(AmbiguousLabelError):
+            ledger.call("k", lambda: {"status": 200})
+        observed.append(ledger.entry("k")["error"])
+        return {"status": 200}
+
+    ledger.call("k", send)
+    assert observed == ["abandoned in flight"]
+
+
+def test_ambiguous_key_settled_by_a_fully_written_artifact(tmp_path):
+    clock = Clock()
+    ledger = LabelLedger(str(tmp_path / "ledger.sqlite"), clock=clock)
+    label = tmp_path / "label.pdf"
+
+    def send():
+        ledger.note_artifact("k", label)
+        label.write_bytes(b"%PDF-1.7")
+        raise urllib.error.URLError(socket.timeout("timed out"))
+
+    with pytest.raises(urllib.error.URLError):
+        ledger.call("k", send)
+    result = ledger.call("k", lambda: pytest.fail("resent"))
+    assert result["savedLabel"] == str(label) and result["replayed"] is True
+    assert ledger.entry("k")["state"] == COMPLETED
+    assert ledger.counts["reconciled"] == 1
+
+
+def test_artifact_reconciler_ignores_empty_and_older_files(tmp_path):
+    label = tmp_path / "label.pdf"
+    label.write_bytes(b"")
+    assert artifact_reconciler({"artifact": str(label), "sent_at": 0}) is None
+    label.write_bytes(b"data")
+    assert artifact_reconciler({"artifact": str(label), "sent_at": label.stat().st_mtime + 10}) is None
+    assert artifact_reconciler({"artifact": str(label), "sent_at": 0})["size"] == 4
+    assert artifact_reconciler({"artifact": None}) is None
+
+
+def test_artifact_noted_by_another_key_settles_neither(tmp_path):
+    ledger = LabelLedger(str(tmp_path / "ledger.sqlite"))
+    label = tmp_path / "label.pdf"
+    for key in ("first", "second"):
+
+        def send(key=key):
+            ledger.note_artifact(key, label)
+            label.write_bytes(b"%PDF-1.7")
+            raise urllib.error.URLError(socket.timeout("timed out"))
+
+        with pytest.raises(urllib.error.URLError):
+            ledger.call(key, send)
+    with pytest.raises(AmbiguousLabelError):
+        ledger.call("first", lambda: pytest.fail("resent"))
+    assert ledger.counts["reconciled"] == 0
+    assert artifact_stem("label", "first") != artifact_stem("label", "second")
+
+
+def test_build_label_ledger_reads_env(tmp_path, monkeypatch):
+    monkeypatch.delenv("USPS_LABEL_LEDGER", raising=False)
+    assert build_label_ledger({}) is None
+    ledger = build_label_ledger({"USPS_LABEL_LEDGER": str(tmp_path / "l.sqlite"), "USPS_LABEL_LEDGER_RESEND_AMBIGUOUS": "true"})
+    assert ledger.resend_ambiguous
@@ -0,0 +1,174 @@
+import email.message
+import io
+import socket
+import urllib.error
+
+import pytest
+
+from usps_client.batch import is_transient, run_items, run_queued
+from usps_client.idempotency import is_ambiguous
+from usps_client.jobs import DEAD, DEFER, DONE, LEASED, QUEUED, RETRY, JobQueue, build_job_queue, default_run_id
+from usps_client.retry import CircuitOpenError
+
+LABELS = "https://apis.usps.com/labels/v3/label"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def http_error(code):
+    return urllib.error.HTTPError(LABELS, code, "error", email.message.Message(), io.BytesIO(b""))
+
+
+def states(queue):
+    return queue.report()["states"]
+
+
+def open_queue(tmp_path, run="run", **kwargs):
+    kwargs.setdefault("retry_delay", 0.0)
+    return JobQueue(str(tmp_path / "queue.sqlite"), run, **kwargs)
+
+
+def test_load_resumes_and_skips_finished_jobs(tmp_path):
+    queue = open_queue(tmp_path)
+    assert not queue.resumed
+    assert queue.load((index, {"row": index}) for index in range(1, 6)) == 5
+    jobs = queue.claim(2)
+    assert [(job.id, job.payload, job.attempts) for job in jobs] == [(1, {"row": 1}, 1), (2, {"row": 2}, 1)]
+    queue.settle([(jobs[0], DONE, None, 0.0)])
+    queue.close()
+
+    resumed = open_queue(tmp_path)
+    assert resumed.resumed
+    assert resumed.load((index, {"row": index}) for index in range(1, 6)) == 0
+    # Job 2 is still leased by the first queue object (this process is alive), so it waits for the lease.
+    assert [job.id for job in resumed.claims(10)] == [3, 4, 5]
+    assert states(resumed) == {DONE: 1, LEASED: 4}
+
+
+def test_lapsed_lease_is_claimable_again(tmp_path):
+    clock = Clock()
+    queue = open_queue(tmp_path, clock=clock, lease_seconds=30)
+    queue.load([(1, "a")])
+    assert [job.id for job in queue.claim(1)] == [1]
+    assert queue.claim(1) == []
+    assert queue.next_due() == clock.now + 30
+    clock.now += 30
+    (job,) = queue.claim(1)
+    assert job.attempts == 2
+
+
+def test_settle_retries_with_backoff_then_dead_letters(tmp_path):
+    clock = Clock()
+    queue = open_queue(tmp_path, clock=clock, max_attempts=2, retry_delay=2.0)
+    queue.load([(1, "a")])
+    (job,) = queue.claim(1)
+    queue.settle([(job, RETRY, "boom", 0.0)])
+    assert queue.claim(1) == []
+    clock.now += 2
+    (job,) = queue.claim(1)
+    queue.settle([(job, RETRY, "boom", 0.0)])
+    assert states(queue) == {DEAD: 1}
+    assert queue.requeue_dead() == 1
+    assert queue.claim(1)[0].attempts == 1
+
+
+def test_deferred_job_keeps_its_attempt(tmp_path):
+    clock = Clock()
+    queue = open_queue(tmp_path, clock=clock)
+    queue.load([(1, "a")])
+    (job,) = queue.claim(1)
+    queue.settle([(job, DEFER, "circuit open", 5.0)])
+    clock.now += 5
+    assert queue.claim(1)[0].attempts == 1
+
+
+@pytest.mark.parametrize(
+    "outcome, expected",
+    [
+        ("ok", False),
+        (http_error(400), False),
+        (http_error(429), True),
+        (http_error(503), True),
+        (urllib.error.URLError(socket.timeout("timed out")), True),
+    ],
+)
+def test_is_transient(outcome, expected):
+    assert is_transient(outcome) is expected
+
+
+def test_jobs_are_settled_before_their_outcome_is_yielded(tmp_path):
+    queue = open_queue(tmp_path)
+    queue.load((index, index) for index in range(1, 4))
+    seen = []
+    for job, outcome, dead in run_queued(queue, lambda job: job.payload * 10, 2):
+        seen.append((job.id, outcome, dead))
+        # A crash here must not hand the job out again.
+        assert states(queue).get(DONE, 0) >= len(seen)
+    assert sorted(seen) == [(1, 10, False), (2, 20, False), (3, 30, False)]
+    assert states(queue) == {DONE: 3}
+
+
+def test_transient_failures_are_retried_and_refused_calls_deferred(tmp_path):
+    queue = open_queue(tmp_path, max_attempts=3)
+    queue.load([(1, "flaky"), (2, "broken")])
+    calls = {1: 0, 2: 0}
+
+    def worker(item):
+        job_id, _ = item
+        calls[job_id] += 1
+        if job_id == 1 and calls[job_id] == 1:
+            raise CircuitOpenError("labels", 0.0)
+        if job_id == 1 and calls[job_id] == 2:
+            raise http_error(429)
+        if job_id == 2:
+            raise http_error(503)
+        return "ok"
+
+    results = {job_id: (outcome, dead) for (job_id, _), outcome, dead in run_items([], worker, 1, queue=queue)}
+    assert results[1] == ("ok", False)
+    assert isinstance(results[2][0], urllib.error.HTTPError) and results[2][1] is True
+    assert calls == {1: 3, 2: 3}
+
+
+def test_ambiguous_label_outcomes_are_dead_lettered_without_retry(tmp_path):
+    queue = open_queue(tmp_path, max_attempts=3)
+    outcomes = {1: http_error(503), 2: urllib.error.URLError(socket.timeout("timed out")), 3: http_error(429), 4: "label"}
+    calls = {job_id: 0 for job_id in outcomes}
+
+    def worker(item):
+        job_id, _ = item
+        calls[job_id] += 1
+        outcome = outcomes[job_id]
+        if job_id == 3 and calls[job_id] > 1:
+            return "label"
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    results = {
+        job_id: dead
+        for (job_id, _), _, dead in run_items(((job_id, None) for job_id in outcomes), worker, 2, queue=queue, ambiguous=is_ambiguous)
+    }
+    assert results == {1: True, 2: True, 3: False, 4: False}
+    assert calls == {1: 1, 2: 1, 3: 2, 4: 1}
+    assert states(queue) == {DEAD: 2, DONE: 2}
+
+
+def test_default_run_id_tracks_the_input_file(tmp_path, monkeypatch):
+    rows = tmp_path / "rows.csv"
+    rows.write_text("a\n1\n")
+    first = default_run_id("flow", str(rows))
+    assert first == default_run_id("flow", str(rows))
+    rows.write_text("a\n1\n2\n")
+    assert default_run_id("flow", str(rows)) != first
+    monkeypatch.delenv("USPS_JOB_QUEUE", raising=False)
+    assert build_job_queue({}, "flow", str(rows)) is None
+    queue = build_job_queue({"USPS_JOB_MAX_ATTEMPTS": "5"}, "flow", str(rows), path=str(tmp_path / "q.sqlite"), run="r")
+    assert (queue.run, queue.max_attempts) == ("r", 5)
+    assert QUEUED not in states(queue)
@@ -0,0 +1,63 @@
+import math
+import random
+
+import pytest
+
+from usps_client.metrics import HISTOGRAM_GROWTH, LatencyHistogram, MetricsRegistry
+
+
+def exact_percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(fraction * len(ordered))) - 1]
+
+
+@pytest.mark.parametrize("fraction", [0.5, 0.95, 0.99])
+def test_percentiles_stay_within_one_bucket_of_exact(fraction):
+    rng = random.Random(7)
+    values = [rng.lognormvariate(4, 1) for _ in range(5000)]
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    exact = exact_percentile(values, fraction)
+    assert exact <= histogram.percentile(fraction) <= exact * HISTOGRAM_GROWTH
+
+
+def test_memory_depends_on_range_not_sample_count():
+    histogram = LatencyHistogram()
+    for _ in range(100_000):
+        histogram.record(42.0)
+    assert len(histogram.buckets) == 1
+    assert histogram.summary() == {"count": 100_000, "minMs": 42.0, "meanMs": 42.0, "p50Ms": 42.0, "p95Ms": 42.0, "p99Ms": 42.0, "maxMs": 42.0}
+
+
+def test_empty_and_tiny_samples():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(0.5) is None
+    assert histogram.summary()["meanMs"] is None
+    histogram.record(0.0)
+    assert histogram.buckets == {0: 1}
+    assert histogram.percentile(0.99) == 0.0
+
+
+def test_merge_matches_recording_everything_in_one():
+    left, right, combined = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+    for value in range(1, 101):
+        (left if value % 2 else right).record(float(value))
+        combined.record(float(value))
+    left.merge(right)
+    assert left.summary() == combined.summary()
+    empty = LatencyHistogram()
+    empty.merge(LatencyHistogram())
+    assert empty.min is None and empty.count == 0
+
+
+def test_registry_records_numeric_phases_per_endpoint():
+    registry = MetricsRegistry()
+    registry.record("apis.usps.com/prices", {"reused": True, "ttfbMs": 10.0, "totalMs": 12.5, "bodyMs": None})
+    registry.record("apis.usps.com/prices", {"ttfbMs": 20.0, "totalMs": 25.0})
+    report = registry.report()
+    assert list(report["apis.usps.com/prices"]) == ["ttfbMs", "totalMs"]
+    assert report["apis.usps.com/prices"]["totalMs"]["count"] == 2
+    assert report["apis.usps.com/prices"]["totalMs"]["maxMs"] == 25.0
+    registry.reset()
+    assert registry.report() == {}
@@ -0,0 +1,55 @@
+import pytest
+
+from usps_client.ratelimit import TokenBucket, build_rate_limiter, endpoint_family, parse_budget
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_endpoint_families():
+    assert endpoint_family("https://apis.usps.com/oauth2/v3/token") == "token"
+    assert endpoint_family("https://apis.usps.com/international-labels/v3/international-label") == "labels"
+    assert endpoint_family("https://apis.usps.com/shipments/v3/options/search") == "prices"
+    assert endpoint_family("https://apis.usps.com/addresses/v3/address?city=X") == "addresses"
+    assert endpoint_family("https://apis.usps.com/tracking/v3/tracking/1") == "default"
+
+
+@pytest.mark.parametrize(
+    "raw, expected",
+    [("10/s", (10.0, 10.0)), ("300/min:20", (5.0, 20.0)), ("1/h", (1 / 3600, 1.0)), ("0/s", None), ("x", None), ("5/day", None), ("", None)],
+)
+def test_parse_budget(raw, expected):
+    assert parse_budget(raw) == expected
+
+
+@pytest.mark.parametrize("shared_file", [False, True])
+def test_bucket_grants_burst_then_spaces_reservations(tmp_path, shared_file):
+    clock = Clock()
+    path = str(tmp_path / "prices.bucket") if shared_file else None
+    bucket = TokenBucket("prices", rate=2.0, capacity=2.0, state_path=path, clock=clock)
+    assert [bucket.reserve() for _ in range(4)] == [0.0, 0.0, 0.5, 1.0]
+    clock.now += 1.5
+    assert bucket.reserve() == 0.0
+
+
+def test_file_backed_buckets_share_one_quota(tmp_path):
+    clock = Clock()
+    path = str(tmp_path / "labels.bucket")
+    first = TokenBucket("labels", rate=1.0, capacity=1.0, state_path=path, clock=clock)
+    second = TokenBucket("labels", rate=1.0, capacity=1.0, state_path=path, clock=clock)
+    assert first.reserve() == 0.0
+    assert second.reserve() == 1.0
+
+
+def test_limiter_only_limits_configured_families(tmp_path):
+    limiter = build_rate_limiter({"USPS_RATE_LIMIT_LABELS": "1/s", "USPS_RATE_LIMIT_DIR": str(tmp_path)})
+    assert limiter.bucket_for("https://apis.usps.com/prices/v3/base-rates/search") is None
+    assert limiter.reserve("https://apis.usps.com/labels/v3/label") == 0.0
+    assert limiter.reserve("https://apis.usps.com/labels/v3/label") > 0
+    assert limiter.waited["labels"] > 0
+    assert limiter.bucket_for("https://apis-tem.usps.com/labels/v3/label") is not limiter.bucket_for("https://apis.usps.com/labels/v3/label")
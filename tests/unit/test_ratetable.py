@@ -0,0 +1,72 @@
+import json
+from pathlib import Path
+
+from usps_client.ratetable import RateTable
+
+RECORDED = Path(__file__).resolve().parents[1] / "international-prices" / "output" / "international-prices-result.json"
+REQUEST = {"destinationCountryCode": "CA", "mailClass": "PRIORITY_MAIL_INTERNATIONAL", "priceType": "COMMERCIAL", "weight": 2}
+
+
+class Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def body(price=29.66, price_type="COMMERCIAL_BASE", end_date=""):
+    rate = {"mailClass": "PRIORITY_MAIL_INTERNATIONAL", "priceType": price_type, "SKU": "IPFE0XXXXB01040", "price": price, "endDate": end_date}
+    return {"rateOptions": [{"rates": [dict(rate, description="Flat Rate Envelope")]}]}
+
+
+def test_recorded_list_response_can_be_quoted_with_the_request_fields():
+    recorded = json.loads(RECORDED.read_text(encoding="utf-8"))["baseRatesList"]["body"]
+    table = RateTable()
+    stored = table.harvest(REQUEST, recorded)
+    assert stored > 0
+    quotes = table.quote("CA", "PRIORITY_MAIL_INTERNATIONAL", "COMMERCIAL", 1.5)
+    assert quotes is not None
+    assert {quote["SKU"] for quote in quotes} == {rate["SKU"] for option in recorded["rateOptions"] for rate in option["rates"]}
+    assert table.quote("CA", "PRIORITY_MAIL_INTERNATIONAL", "COMMERCIAL_BASE", 2) is None
+
+
+def test_rate_indicator_is_part_of_the_route():
+    table = RateTable()
+    table.harvest(dict(REQUEST, rateIndicator="FE"), body())
+    assert table.quote("CA", "PRIORITY_MAIL_INTERNATIONAL", "COMMERCIAL", 2) is None
+    assert table.quote("CA", "PRIORITY_MAIL_INTERNATIONAL", "COMMERCIAL", 2, rate_indicator="FE")[0]["price"] == 29.66
+
+
+def test_rows_expire_at_end_date_or_max_age():
+    clock = Clock()
+    table = RateTable(max_age=100, clock=clock)
+    table.harvest(REQUEST, body())
+    assert table.quote("CA", "PRIORITY_MAIL_INTERNATIONAL", "COMMERCIAL", 2) is not None
+    clock.now += 100
+    assert table.quote("CA", "PRIORITY_MAIL_INTERNATIONAL", "COMMERCIAL", 2) is None
+    table.harvest(REQUEST, body(end_date="1970-01-01"))
+    assert table.freshness()["staleRows"] == 1
+
+
+def test_stale_can_be_iterated_while_harvesting():
+    clock = Clock()
+    table = RateTable(max_age=10, clock=clock)
+    table.harvest(REQUEST, body())
+    table.harvest(dict(REQUEST, weight=5), body(price=40.0))
+    clock.now += 10
+    for key, weight in table.stale():
+        # Re-harvesting from inside the loop must not deadlock on the table lock.
+        table.harvest(dict(REQUEST, weight=weight), body())
+    assert table.freshness()["staleRows"] == 0
+
+
+def test_save_and_load_round_trip(tmp_path):
+    table = RateTable()
+    table.harvest(REQUEST, body())
+    path = str(tmp_path / "rates.json")
+    table.save(path)
+    loaded = RateTable.load(path)
+    assert loaded.quote("CA", "PRIORITY_MAIL_INTERNATIONAL", "COMMERCIAL", 2)[0]["price"] == 29.66
+    (tmp_path / "rates.json").write_text(json.dumps({"version": 1, "series": []}), encoding="utf-8")
+    assert RateTable.load(path).freshness()["series"] == 0
@@ -0,0 +1,109 @@
+import email.message
+from array import array
+
+import pytest
+
+from usps_client import records
+from usps_client.records import LabelRecord, QuoteRecord, ResponseRecord, compact_headers, multipart_json, rate_amounts, request_id
+
+
+@pytest.fixture(autouse=True)
+def no_raw_retention():
+    records.set_retain_raw(False)
+    yield
+    records.set_retain_raw(False)
+
+
+MULTIPART = "multipart/mixed; boundary=b1"
+
+
+def label_multipart(metadata):
+    return (
+        b"--b1\r\nContent-Type: application/json\r\n\r\n" + metadata + b"\r\n"
+        b"--b1\r\nContent-Type: application/pdf\r\n\r\n%PDF-1.4 label\r\n--b1--\r\n"
+    )
+
+
+def headers(**values):
+    message = email.message.Message()
+    for name, value in values.items():
+        message[name.replace("_", "-")] = value
+    return message
+
+
+def test_compact_headers_drop_gateway_noise_unless_raw_is_retained():
+    response_headers = headers(Content_Type="application/json", Via="1.1 gateway", X_Amzn_RequestId="abc")
+    assert compact_headers(response_headers) == {"Content-Type": "application/json", "X-Amzn-RequestId": "abc"}
+    assert compact_headers(None) == {}
+    records.set_retain_raw(True)
+    assert "Via" in compact_headers(response_headers)
+
+
+def test_request_id_prefers_the_first_listed_header():
+    assert request_id({"apigw-requestid": "gw", "x-correlation-id": "corr"}) == "corr"
+    assert request_id({}) is None
+
+
+def test_rate_amounts_take_each_nodes_own_total_before_line_items():
+    body = {
+        "rateOptions": [
+            {"totalBasePrice": 12.5, "rates": [{"price": 10.0}]},
+            {"rates": [{"price": 7.25}], "extraServices": [{"price": True}]},
+        ]
+    }
+    assert list(rate_amounts(body)) == [12.5, 7.25]
+
+
+def test_quote_record_keeps_packed_amounts_and_no_successful_body():
+    record = QuoteRecord.from_response({"status": 200, "body": {"rates": [{"price": 9.0}, {"price": 4.5}]}, "cached": True})
+    assert isinstance(record.amounts, array)
+    assert record.lowest == 4.5
+    assert record.to_dict() == {"status": 200, "cached": True, "lowestPrice": 4.5, "prices": [9.0, 4.5]}
+    failed = QuoteRecord.from_response({"status": 400, "body": {"error": "bad"}})
+    assert not failed.ok and failed.lowest is None
+    assert failed.to_dict()["body"] == {"error": "bad"}
+
+
+def test_records_are_slotted():
+    with pytest.raises(AttributeError):
+        ResponseRecord(200).extra = 1
+
+
+def test_label_record_round_trips_through_to_dict():
+    response = {
+        "status": 200,
+        "headers": {"Content-Type": "application/json", "X-Request-ID": "req-1"},
+        "body": {"labelMetadata": {"trackingNumber": "9400", "labelId": "L1", "mailClass": "PRIORITY_MAIL", "postage": {"amount": 9.35}}},
+    }
+    record = LabelRecord.from_response(response)
+    assert (record.tracking_number, record.label_id, record.postage, record.request_id) == ("9400", "L1", 9.35, "req-1")
+    data = dict(record.to_dict(), replayed=True)
+    restored = LabelRecord.from_dict(data)
+    assert restored.replayed
+    assert restored.to_dict() == data
+
+
+def test_label_record_from_result_decodes_text_body_and_saved_artifact():
+    result = {"status": 200, "body": '{"trackingNumber": "9401"}', "savedLabel": "/tmp/label.pdf", "size": 10, "sha256": "ab"}
+    record = LabelRecord.from_result(result)
+    assert record.tracking_number == "9401"
+    assert record.to_dict()["savedLabel"] == "/tmp/label.pdf"
+    assert LabelRecord.from_result({"status": 200, "body": "not json"}).tracking_number is None
+
+
+def test_multipart_json_finds_the_metadata_part():
+    assert multipart_json(MULTIPART, label_multipart(b'{"trackingNumber": "9402"}')) == {"trackingNumber": "9402"}
+    assert multipart_json(MULTIPART, label_multipart(b"not json")) is None
+    assert multipart_json("application/pdf", b"%PDF") is None
+
+
+def test_label_record_reads_tracking_number_from_a_saved_multipart_label(tmp_path):
+    saved = tmp_path / "label.tif"
+    saved.write_bytes(label_multipart(b'{"trackingNumber": "9403", "labelId": "L3", "postage": 8.1}'))
+    record = LabelRecord.from_result({"status": 200, "headers": {"Content-Type": MULTIPART}, "savedLabel": str(saved), "size": 1})
+    assert (record.tracking_number, record.label_id, record.postage) == ("9403", "L3", 8.1)
+    # A header alone is not a tracking number; only the metadata the labels API returns is.
+    pdf = tmp_path / "label.pdf"
+    pdf.write_bytes(b"%PDF")
+    plain = LabelRecord.from_result({"status": 200, "headers": {"Content-Type": "application/pdf", "X-Tracking-Number": "92"}, "savedLabel": str(pdf)})
+    assert plain.tracking_number is None
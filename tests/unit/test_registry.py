@@ -0,0 +1,123 @@
+import pytest
+
+from usps_client.records import LabelRecord
+from usps_client.registry import COMPLETED, FAILED, MANIFESTED, REVIEW, SUBMITTED, UNMANIFESTED, LabelRegistry, build_label_registry, label_fields
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def payload(origin_zip="10001", mail_date="2026-10-17"):
+    return {
+        "fromAddress": {"ZIPCode": origin_zip},
+        "packageDescription": {"mailClass": "PRIORITY_MAIL", "mailingDate": mail_date},
+    }
+
+
+def label(tracking_number=None, label_id=None, status=200):
+    return LabelRecord(status, tracking_number=tracking_number, label_id=label_id, postage=9.35)
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = LabelRegistry(str(tmp_path / "registry.db"), clock=Clock())
+    yield registry
+    registry.close()
+
+
+def test_label_fields_read_domestic_and_international_payloads():
+    assert label_fields(payload()) == {"mail_date": "2026-10-17", "mail_class": "PRIORITY_MAIL", "origin_zip": "10001"}
+    assert label_fields({"mailingDate": "2026-10-18"})["mail_date"] == "2026-10-18"
+
+
+def test_labels_are_keyed_by_tracking_number_then_label_id(registry):
+    assert registry.add(label("9400"), payload(), reference="order-1", mid="900")
+    assert registry.add(label(label_id="L2"), payload())
+    assert not registry.add(label(), payload())
+    assert not registry.add(label("9401", status=500), payload())
+    entry = registry.get("9400")
+    assert (entry["reference"], entry["mid"], entry["manifest_state"], entry["manifest_id"]) == ("order-1", "900", UNMANIFESTED, None)
+    assert registry.get("L2")["tracking_number"] is None
+    assert registry.report()["added"] == 2 and registry.report()["unidentified"] == 1
+
+
+def test_re_adding_a_label_keeps_its_manifest_state(registry):
+    registry.add(label("9400"), payload())
+    manifest_id, _ = registry.begin_manifest("2026-10-17")
+    registry.add(label("9400"), payload(), reference="replayed")
+    entry = registry.get("9400")
+    assert (entry["manifest_state"], entry["manifest_id"], entry["reference"]) == (SUBMITTED, manifest_id, "replayed")
+
+
+def test_filters_select_by_mid_origin_and_date(registry):
+    registry.add(label("9400"), payload(), mid="900")
+    registry.add(label("9401"), payload(origin_zip="20002"), mid="900")
+    registry.add(label("9402"), payload(), mid="901")
+    registry.add(label("9403"), payload(mail_date="2026-10-18"), mid="900")
+    assert [entry["key"] for entry in registry.labels(mid="900", mail_date="2026-10-17")] == ["9400", "9401"]
+    assert registry.unmanifested("2026-10-17", origin_zip="10001", mid="900") == [
+        {"trackingNumber": "9400", "mailClass": "PRIORITY_MAIL"}
+    ]
+    assert registry.unmanifested_origins("2026-10-17", mid="900") == ["10001", "20002"]
+    with pytest.raises(ValueError):
+        registry.labels(carrier="usps")
+
+
+def test_manifests_claim_only_labels_no_earlier_close_took(registry):
+    for number in ("9400", "9401", "9402"):
+        registry.add(label(number), payload(), mid="900")
+    first, claimed = registry.begin_manifest("2026-10-17", mid="900", limit=2)
+    assert [entry["trackingNumber"] for entry in claimed] == ["9400", "9401"]
+    second, claimed = registry.begin_manifest("2026-10-17", mid="900")
+    assert [entry["trackingNumber"] for entry in claimed] == ["9402"]
+    assert registry.begin_manifest("2026-10-17", mid="900") is None
+    registry.complete_manifest(first, "SF1")
+    registry.fail_manifest(second, "HTTP 400")
+    assert (registry.get("9400")["manifest_state"], registry.get("9400")["scan_form"]) == (MANIFESTED, "SF1")
+    assert (registry.get("9402")["manifest_state"], registry.get("9402")["manifest_id"]) == (UNMANIFESTED, None)
+    assert [manifest["state"] for manifest in registry.manifests("2026-10-17")] == [COMPLETED, FAILED]
+    assert registry.report()["states"] == {MANIFESTED: 2, UNMANIFESTED: 1}
+
+
+def test_registry_reopens_with_its_labels(tmp_path, monkeypatch):
+    monkeypatch.delenv("USPS_LABEL_REGISTRY", raising=False)
+    assert build_label_registry({}) is None
+    path = str(tmp_path / "registry.db")
+    first = LabelRegistry(path)
+    first.add(label("9400"), payload())
+    first.close()
+    second = build_label_registry({"USPS_LABEL_REGISTRY": path})
+    assert second.get("9400")["origin_zip"] == "10001"
+    second.close()
+
+
+def test_manifests_abandoned_in_flight_are_held_for_review_not_resent(registry):
+    registry.add(label("9400"), payload())
+    stale, _ = registry.begin_manifest("2026-10-17")
+    registry.clock.now += registry.in_flight_timeout
+    registry.add(label("9401"), payload())
+    _, claimed = registry.begin_manifest("2026-10-17")
+    assert [entry["trackingNumber"] for entry in claimed] == ["9401"]
+    assert registry.get("9400")["manifest_state"] == REVIEW
+    assert [manifest["id"] for manifest in registry.manifests(state=REVIEW)] == [stale]
+    assert registry.begin_manifest("2026-10-17") is None
+
+
+def test_review_is_settled_by_complete_or_fail(registry):
+    registry.add(label("9400"), payload())
+    registry.add(label("9401"), payload())
+    first, _ = registry.begin_manifest("2026-10-17", limit=1)
+    second, _ = registry.begin_manifest("2026-10-17")
+    registry.review_manifest(first, "timed out")
+    registry.review_manifest(second, "HTTP 503")
+    assert registry.report()["manifests"] == {REVIEW: 2}
+    registry.complete_manifest(first, "SF1")
+    registry.fail_manifest(second, "no form on record")
+    assert (registry.get("9400")["manifest_state"], registry.get("9400")["scan_form"]) == (MANIFESTED, "SF1")
+    assert registry.get("9401")["manifest_state"] == UNMANIFESTED
+    assert registry.unmanifested("2026-10-17") == [{"trackingNumber": "9401", "mailClass": "PRIORITY_MAIL"}]
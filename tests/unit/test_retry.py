@@ -0,0 +1,114 @@
+import email.message
+import io
+import urllib.error
+
+import pytest
+
+from usps_client.retry import CircuitBreaker, CircuitOpenError, RetryEngine, RetryPolicy, is_idempotent, retry_after_seconds
+
+PRICES = "https://apis.usps.com/prices/v3/base-rates/search"
+LABELS = "https://apis.usps.com/labels/v3/label"
+
+
+def http_error(url, code, retry_after=None):
+    headers = email.message.Message()
+    if retry_after is not None:
+        headers["Retry-After"] = retry_after
+    return urllib.error.HTTPError(url, code, "error", headers, io.BytesIO(b""))
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def run(engine, method, url, failures):
+    """Call through ``engine`` with a sender that raises each of ``failures`` in turn, then succeeds."""
+    calls = []
+    sleeps = []
+
+    def send():
+        calls.append(1)
+        if len(calls) <= len(failures):
+            raise failures[len(calls) - 1]
+        return "ok"
+
+    result = engine.call(method, url, send, sleep=sleeps.append)
+    return result, len(calls), sleeps
+
+
+def test_label_and_scan_form_posts_are_not_idempotent():
+    assert is_idempotent("POST", PRICES)
+    assert not is_idempotent("POST", LABELS)
+    assert not is_idempotent("POST", "https://apis.usps.com/scan-forms/v3/scan-form/")
+    assert is_idempotent("GET", LABELS)
+
+
+def test_retry_after_accepts_seconds_and_dates():
+    headers = email.message.Message()
+    headers["Retry-After"] = "7"
+    assert retry_after_seconds(headers) == 7.0
+    headers.replace_header("Retry-After", "Thu, 01 Jan 1970 00:01:40 GMT")
+    assert retry_after_seconds(headers, now=40) == 60.0
+    assert retry_after_seconds(None) is None
+
+
+def test_quotes_retry_5xx_and_connection_errors():
+    engine = RetryEngine(RetryPolicy(max_attempts=3, base_delay=0.01))
+    result, calls, sleeps = run(engine, "POST", PRICES, [http_error(PRICES, 503), urllib.error.URLError("reset")])
+    assert (result, calls, len(sleeps)) == ("ok", 3, 2)
+
+
+def test_labels_are_not_retried_after_5xx_or_timeout_but_are_after_429():
+    engine = RetryEngine(RetryPolicy(max_attempts=3))
+    with pytest.raises(urllib.error.HTTPError):
+        run(engine, "POST", LABELS, [http_error(LABELS, 503)])
+    with pytest.raises(urllib.error.URLError):
+        run(engine, "POST", LABELS, [urllib.error.URLError(TimeoutError("timed out"))])
+    result, calls, sleeps = run(engine, "POST", LABELS, [http_error(LABELS, 429, "2")])
+    assert (result, calls, sleeps) == ("ok", 2, [2.0])
+    result, calls, _ = run(engine, "POST", LABELS, [urllib.error.URLError(ConnectionRefusedError())])
+    assert (result, calls) == ("ok", 2)
+
+
+def test_long_retry_after_is_surfaced():
+    engine = RetryEngine(RetryPolicy(max_attempts=3, max_retry_after=10))
+    with pytest.raises(urllib.error.HTTPError):
+        run(engine, "POST", PRICES, [http_error(PRICES, 429, "60")])
+
+
+def test_breaker_opens_after_threshold_and_lets_one_trial_through():
+    clock = Clock()
+    breaker = CircuitBreaker("prices", failure_threshold=2, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError) as raised:
+        breaker.before_call()
+    assert raised.value.retry_in == 30
+    clock.now = 30
+    assert breaker.state == "half-open"
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.now = 60
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_4xx_does_not_count_toward_the_breaker():
+    engine = RetryEngine(RetryPolicy(max_attempts=1), failure_threshold=1)
+    with pytest.raises(urllib.error.HTTPError):
+        run(engine, "POST", PRICES, [http_error(PRICES, 400)])
+    assert engine.breaker_states()["apis.usps.com/prices/v3/base-rates/search"] == {"state": "closed", "failures": 0}
+    with pytest.raises(urllib.error.HTTPError):
+        run(engine, "POST", PRICES, [http_error(PRICES, 500)])
+    with pytest.raises(CircuitOpenError):
+        run(engine, "POST", PRICES, [])
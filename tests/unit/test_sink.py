@@ -0,0 +1,72 @@
+import gzip
+import json
+
+import pytest
+
+from usps_client.batch import read_rows
+from usps_client.sink import NdjsonSink, build_sink, call_summary, open_sink, open_text, record_call
+
+
+def read_lines(path):
+    with open_text(path) as handle:
+        return [json.loads(line) for line in handle]
+
+
+def test_records_are_compact_lines_synced_in_batches(tmp_path, monkeypatch):
+    syncs = []
+    monkeypatch.setattr("usps_client.sink.os.fsync", syncs.append)
+    with NdjsonSink(tmp_path / "out.jsonl", fsync_every=3, fsync_interval=3600) as sink:
+        for index in range(7):
+            sink.write({"line": index, "nested": {"a": 1}})
+        assert len(syncs) == 2
+        sink.flush()
+        assert len(syncs) == 3
+    assert (tmp_path / "out.jsonl").read_text().splitlines()[0] == '{"line":0,"nested":{"a":1}}'
+    assert sink.records == 7
+
+
+def test_rotation_starts_numbered_segments(tmp_path):
+    with NdjsonSink(tmp_path / "out.jsonl", max_bytes=100, fsync_every=1) as sink:
+        for index in range(10):
+            sink.write({"line": index, "padding": "x" * 40})
+    assert [segment.name for segment in sink.segments][:3] == ["out.jsonl", "out.0001.jsonl", "out.0002.jsonl"]
+    lines = [record["line"] for segment in sink.segments for record in read_lines(segment)]
+    assert lines == list(range(10))
+
+
+def test_gzip_segments_are_readable_by_read_rows(tmp_path):
+    sink = open_sink(tmp_path / "out.jsonl", {"USPS_RESULTS_COMPRESSION": "gzip", "USPS_RESULTS_FSYNC_EVERY": "2"})
+    for index in range(5):
+        sink.write({"reference": f"R{index}", "status": 200})
+    sink.close()
+    assert sink.path.name == "out.jsonl.gz"
+    with gzip.open(sink.path, "rt") as handle:
+        assert len(handle.readlines()) == 5
+    assert [row["reference"] for row in read_rows(str(sink.path))] == [f"R{index}" for index in range(5)]
+
+
+def test_append_keeps_earlier_records(tmp_path):
+    path = tmp_path / "out.jsonl"
+    with NdjsonSink(path) as sink:
+        sink.write({"line": 1})
+    with NdjsonSink(path, append=True) as sink:
+        sink.write({"line": 2})
+    assert [record["line"] for record in read_lines(path)] == [1, 2]
+
+
+def test_unknown_compression_fails_before_writing(tmp_path):
+    with pytest.raises(ValueError):
+        open_sink(tmp_path / "out.jsonl", {"USPS_RESULTS_COMPRESSION": "lz4"})
+
+
+def test_record_call_keeps_only_a_summary_once_the_sink_has_the_result(tmp_path):
+    result = {"status": 200, "url": "https://apis.usps.com/labels/v3/label", "headers": {"a": "b"}, "body": {"x": [1]}}
+    assert record_call(None, "label", result) is result
+    assert build_sink({}) is None
+    sink = build_sink({"USPS_RESULTS_SINK": str(tmp_path / "calls.jsonl")})
+    kept = record_call(sink, "label", result)
+    assert record_call(sink, "scanForm", None) is None
+    sink.close()
+    assert kept == call_summary(result) == {"status": 200, "url": "https://apis.usps.com/labels/v3/label"}
+    (written,) = read_lines(tmp_path / "calls.jsonl")
+    assert written["call"] == "label" and written["body"] == {"x": [1]}
@@ -0,0 +1,47 @@
+import threading
+import time
+import urllib.error
+
+import pytest
+
+from usps_client.ratelimit import RateLimiter
+from usps_client.retry import RetryEngine, RetryPolicy
+from usps_client.transport import HttpTransport, _HostPool
+
+
+def transport() -> HttpTransport:
+    return HttpTransport(retry_engine=RetryEngine(RetryPolicy(max_attempts=1)), rate_limiter=RateLimiter({}))
+
+
+def test_idempotent_request_is_resent_after_stale_keep_alive(dropping_server):
+    server = dropping_server()
+    client = transport()
+    base = server.base_url
+    assert client.request("GET", f"{base}/prices/v3/base-rates/search").status == 200
+    response = client.request("GET", f"{base}/prices/v3/base-rates/search")
+    assert response.status == 200
+    assert not response.timings["reused"]
+    assert server.requests == 3
+    client.close()
+
+
+def test_label_post_is_not_resent_after_stale_keep_alive(dropping_server):
+    server = dropping_server()
+    client = transport()
+    base = server.base_url
+    assert client.request("GET", f"{base}/prices/v3/base-rates/search").status == 200
+    with pytest.raises(urllib.error.URLError):
+        client.request("POST", f"{base}/labels/v3/label", body=b"{}", headers={"Content-Type": "application/json"})
+    assert server.requests == 2
+    assert server.connections == 1
+    client.close()
+
+
+def test_queue_ms_is_the_wait_for_a_pool_slot():
+    pool = _HostPool("http", "127.0.0.1", 9, 1, 60, None)
+    conn, reused, waited = pool.acquire(1)
+    assert not reused and waited < 20
+    threading.Timer(0.05, pool.release, (conn, False)).start()
+    started = time.monotonic()
+    _, _, waited = pool.acquire(1)
+    assert 40 <= waited <= (time.monotonic() - started) * 1000
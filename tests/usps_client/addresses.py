@@ -0,0 +1,340 @@
+import json
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional
+
+from .batch import describe_error, is_transient, run_bounded
+from .cache import INELIGIBLE_STATUSES, MemoryTier, SqliteTier, canonical_key
+from .config import parse_int
+from .transport import decode_json_body, get_transport
+
+ADDRESS_PATH = "addresses/v3/address"
+# Street addresses rarely change; a validated one is good for a month.
+DEFAULT_ADDRESS_TTL_SECONDS = 30 * 24 * 60 * 60
+# An address USPS could not match may be new construction that appears within days.
+DEFAULT_NOT_FOUND_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 65536
+# Request fields and the input keys each is read from, first match wins: USPS_ADDR_* env/CSV names, then
+# the API's own names, then common aliases.
+ADDRESS_FIELDS = {
+    "streetAddress": ("USPS_ADDR_STREET", "streetAddress", "address1", "addressLine1"),
+    "secondaryAddress": ("USPS_ADDR_SECONDARY", "secondaryAddress", "address2", "addressLine2"),
+    "city": ("USPS_ADDR_CITY", "city"),
+    "state": ("USPS_ADDR_STATE", "state"),
+    "ZIPCode": ("USPS_ADDR_ZIP", "ZIPCode", "zip", "postalCode"),
+}
+# Publication 28 abbreviations, applied only where the word is a directional or suffix, not inside a street name.
+DIRECTIONALS = {
+    "NORTH": "N",
+    "SOUTH": "S",
+    "EAST": "E",
+    "WEST": "W",
+    "NORTHEAST": "NE",
+    "NORTHWEST": "NW",
+    "SOUTHEAST": "SE",
+    "SOUTHWEST": "SW",
+}
+STREET_SUFFIXES = {
+    "ALLEY": "ALY",
+    "AVENUE": "AVE",
+    "BOULEVARD": "BLVD",
+    "CIRCLE": "CIR",
+    "COURT": "CT",
+    "DRIVE": "DR",
+    "EXPRESSWAY": "EXPY",
+    "HIGHWAY": "HWY",
+    "LANE": "LN",
+    "PARKWAY": "PKWY",
+    "PLACE": "PL",
+    "PLAZA": "PLZ",
+    "ROAD": "RD",
+    "SQUARE": "SQ",
+    "STREET": "ST",
+    "TERRACE": "TER",
+    "TRAIL": "TRL",
+}
+UNIT_DESIGNATORS = {
+    "APARTMENT": "APT",
+    "BUILDING": "BLDG",
+    "DEPARTMENT": "DEPT",
+    "FLOOR": "FL",
+    "ROOM": "RM",
+    "SUITE": "STE",
+}
+PUNCTUATION = re.compile(r"[.,;:'\"]+")
+
+
+def _tokens(value: Optional[str]) -> List[str]:
+    text = PUNCTUATION.sub(" ", (value or "").upper()).replace("#", " # ")
+    return text.split()
+
+
+def _street(value: Optional[str]) -> str:
+    """House number, optional pre-directional, street name, optional suffix, optional post-directional. A
+    directional or suffix word that is the whole street name ("1 NORTH ST", "9 AVENUE") is left spelled out."""
+    tokens = _tokens(value)
+    end = len(tokens)
+    if end > 3 and (tokens[-1] in DIRECTIONALS or tokens[-1] in DIRECTIONALS.values()):
+        tokens[-1] = DIRECTIONALS.get(tokens[-1], tokens[-1])
+        end -= 1
+    if end > 2 and tokens[end - 1] in STREET_SUFFIXES:
+        tokens[end - 1] = STREET_SUFFIXES[tokens[end - 1]]
+        end -= 1
+    if end > 2 and tokens[1] in DIRECTIONALS:
+        tokens[1] = DIRECTIONALS[tokens[1]]
+    return " ".join(tokens)
+
+
+def normalize_address(address: Mapping[str, Any]) -> Dict[str, str]:
+    """The request fields of ``address`` in canonical form: upper case, no punctuation, single spaces, Pub 28
+    directionals, suffixes and unit designators, and a 5-digit ZIP. Spelling variants of one address share a key."""
+    raw = {field: next((str(address[key]) for key in keys if address.get(key)), "") for field, keys in ADDRESS_FIELDS.items()}
+    secondary = [UNIT_DESIGNATORS.get(token, token) for token in _tokens(raw["secondaryAddress"])]
+    return {
+        "streetAddress": _street(raw["streetAddress"]),
+        "secondaryAddress": " ".join(secondary),
+        "city": " ".join(_tokens(raw["city"])),
+        "state": raw["state"].strip().upper()[:2],
+        "ZIPCode": re.sub(r"\D", "", raw["ZIPCode"])[:5],
+    }
+
+
+def address_key(normalized: Mapping[str, str]) -> str:
+    return canonical_key(ADDRESS_PATH, {field: value for field, value in normalized.items() if value})
+
+
+def address_result(status: Any, body: Any, query: Mapping[str, str]) -> Dict[str, Any]:
+    """The parts of an ``addresses/v3/address`` response worth keeping, with the same verdict as the C# client:
+    valid when DPV-confirmed (anything but ``N``) on a route USPS delivers to (not an R7 phantom route)."""
+    if status != 200 or not isinstance(body, dict):
+        error = body.get("error") if isinstance(body, dict) else None
+        message = error.get("message") if isinstance(error, dict) else None
+        return {"status": status, "valid": False, "error": message or f"HTTP {status}"}
+    address = body.get("address") or {}
+    info = body.get("additionalInfo") or {}
+    dpv = (info.get("DPVConfirmation") or "").upper()
+    carrier_route = info.get("carrierRoute") or ""
+    result: Dict[str, Any] = {
+        "status": status,
+        "valid": bool(dpv) and dpv != "N",
+        "address": {
+            key: address.get(key)
+            for key in ("streetAddress", "secondaryAddress", "city", "state", "ZIPCode", "ZIPPlus4")
+            if address.get(key)
+        },
+        "dpvConfirmation": dpv or None,
+        "carrierRoute": carrier_route or None,
+        "corrections": [item.get("code") for item in body.get("corrections") or [] if isinstance(item, dict) and item.get("code")],
+    }
+    if info.get("business"):
+        result["residential"] = info["business"].upper() == "N"
+    if result["valid"] and "R7" in carrier_route.upper():
+        result["valid"] = False
+        result["error"] = "Delivery not available by USPS"
+    elif not result["valid"]:
+        result["error"] = "Invalid address"
+    if result["valid"]:
+        result["adjusted"] = (
+            " ".join(_tokens(address.get("city"))) != query["city"]
+            or (address.get("state") or "").upper() != query["state"]
+            or (address.get("ZIPCode") or "") != query["ZIPCode"]
+        )
+    return result
+
+
+class AddressCache:
+    """Read-through tiers (fastest first) of address results by ``address_key``.
+
+    Matches live ``ttl`` seconds; USPS "no such address" answers (``INELIGIBLE_STATUSES``) live
+    ``not_found_ttl``. Transient failures are never stored.
+    """
+
+    def __init__(
+        self,
+        tiers: List[Any],
+        ttl: float = DEFAULT_ADDRESS_TTL_SECONDS,
+        not_found_ttl: float = DEFAULT_NOT_FOUND_TTL_SECONDS,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.tiers = tiers
+        self.ttl = ttl
+        self.not_found_ttl = not_found_ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = self.clock()
+        for index, tier in enumerate(self.tiers):
+            entry = tier.get(key, now)
+            if entry is not None:
+                expires_at, value = entry
+                for faster in self.tiers[:index]:
+                    faster.put(key, value, expires_at)
+                with self._lock:
+                    self.hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, result: Mapping[str, Any]) -> None:
+        status = result.get("status")
+        if status == 200:
+            ttl = self.ttl
+        elif status in INELIGIBLE_STATUSES:
+            ttl = self.not_found_ttl
+        else:
+            return
+        expires_at = self.clock() + ttl
+        for tier in self.tiers:
+            tier.put(key, dict(result), expires_at)
+
+    def purge(self) -> None:
+        now = self.clock()
+        for tier in self.tiers:
+            tier.purge(now)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self) -> None:
+        for tier in self.tiers:
+            close = getattr(tier, "close", None)
+            if close is not None:
+                close()
+
+
+class AddressValidator:
+    """Validates addresses against ``addresses/v3/address``, looking each canonical address up at most once.
+
+    A lookup is answered from ``cache`` when possible; otherwise concurrent lookups of the same key share one
+    request, whose result is cached for the next run. ``validate_many`` dedupes a whole batch up front and
+    fans the remaining misses out over ``concurrency`` threads.
+    """
+
+    def __init__(self, base_url: str, token: Callable[[], str], cache: Optional[AddressCache] = None, timeout: float = 15):
+        self.url = urllib.parse.urljoin(base_url, ADDRESS_PATH)
+        self.token = token
+        self.cache = cache
+        self.timeout = timeout
+        self.counts = {"lookups": 0, "fetched": 0, "coalesced": 0}
+        self._inflight: Dict[str, "Future[Dict[str, Any]]"] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counts[name] += amount
+
+    def _fetch(self, query: Mapping[str, str]) -> Dict[str, Any]:
+        params = urllib.parse.urlencode({field: value for field, value in query.items() if value})
+        headers = {"Authorization": f"Bearer {self.token()}", "Accept": "application/json"}
+        self._count("fetched")
+        try:
+            response = get_transport().request("GET", f"{self.url}?{params}", headers=headers, timeout=self.timeout)
+        except urllib.error.HTTPError as exc:
+            if exc.code not in INELIGIBLE_STATUSES:
+                raise
+            # USPS answered: there is no such address. That verdict is cached like a match.
+            body = exc.read().decode("utf-8", errors="replace") if exc.fp else ""
+            try:
+                parsed: Any = json.loads(body) if body else {}
+            except ValueError:
+                parsed = {"raw": body}
+            return address_result(exc.code, parsed, query)
+        return address_result(response.status, decode_json_body(response.body), query)
+
+    def _lookup(self, key: str, query: Mapping[str, str]) -> Dict[str, Any]:
+        if self.cache is not None:
+            hit = self.cache.get(key)
+            if hit is not None:
+                return dict(hit, cached=True)
+        with self._lock:
+            shared = self._inflight.get(key)
+            if shared is None:
+                owned: "Future[Dict[str, Any]]" = Future()
+                self._inflight[key] = owned
+        if shared is not None:
+            self._count("coalesced")
+            return dict(shared.result(), coalesced=True)
+        try:
+            result = self._fetch(query)
+            if self.cache is not None:
+                self.cache.put(key, result)
+            owned.set_result(result)
+            return result
+        except BaseException as exc:
+            owned.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def validate(self, address: Mapping[str, Any]) -> Dict[str, Any]:
+        """Result for one address; raises on transport errors (a 4xx "not found" is a result, not an error)."""
+        query = normalize_address(address)
+        self._count("lookups")
+        return self._lookup(address_key(query), query)
+
+    def validate_many(
+        self,
+        addresses: Iterable[Mapping[str, Any]],
+        concurrency: int = 8,
+        controller: Optional[Any] = None,
+        raise_transient: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """Results in input order; a lookup that failed in transit is reported with ``describe_error`` fields.
+
+        With ``raise_transient`` a failure worth retrying (see ``batch.is_transient``) is raised instead, once
+        every lookup has finished, so a job queue retries the whole batch; the answers it did get are already
+        cached. With an ``AimdController`` the fan-out follows ``controller.limit`` instead of ``concurrency``.
+        """
+        keys: List[str] = []
+        unique: Dict[str, Dict[str, str]] = {}
+        for address in addresses:
+            query = normalize_address(address)
+            key = address_key(query)
+            keys.append(key)
+            unique.setdefault(key, query)
+        self._count("lookups", len(keys))
+        outcomes: Dict[str, Any] = {}
+        for (key, query), outcome in run_bounded(unique.items(), lambda item: self._lookup(*item), concurrency, controller=controller):
+            outcomes[key] = outcome
+        if raise_transient:
+            for key in keys:
+                if is_transient(outcomes[key]):
+                    raise outcomes[key]
+        results = {
+            key: dict(describe_error(outcome), valid=False) if isinstance(outcome, BaseException) else outcome
+            for key, outcome in outcomes.items()
+        }
+        return [results[key] for key in keys]
+
+    def report(self) -> Dict[str, Any]:
+        report: Dict[str, Any] = dict(self.counts)
+        if self.cache is not None:
+            report["cache"] = self.cache.stats()
+        return report
+
+
+def build_address_cache(env: Mapping[str, str]) -> Optional[AddressCache]:
+    """Cache configured from env: USPS_ADDRESS_CACHE=off disables it, USPS_ADDRESS_CACHE_PATH adds a SQLite tier,
+    USPS_ADDRESS_CACHE_TTL / USPS_ADDRESS_CACHE_NOT_FOUND_TTL (seconds) and USPS_ADDRESS_CACHE_SIZE tune it. The env
+    file wins over the process environment."""
+    env = {**os.environ, **env}
+    if (env.get("USPS_ADDRESS_CACHE") or "").strip().lower() in ("0", "off", "false", "no"):
+        return None
+    tiers: List[Any] = [MemoryTier(parse_int(env.get("USPS_ADDRESS_CACHE_SIZE")) or DEFAULT_MAX_ENTRIES)]
+    if env.get("USPS_ADDRESS_CACHE_PATH"):
+        tiers.append(SqliteTier(env["USPS_ADDRESS_CACHE_PATH"]))
+    return AddressCache(
+        tiers,
+        ttl=parse_int(env.get("USPS_ADDRESS_CACHE_TTL")) or DEFAULT_ADDRESS_TTL_SECONDS,
+        not_found_ttl=parse_int(env.get("USPS_ADDRESS_CACHE_NOT_FOUND_TTL")) or DEFAULT_NOT_FOUND_TTL_SECONDS,
+    )
@@ -0,0 +1,355 @@
+import asyncio
+import http.client
+import io
+import json
+import socket
+import ssl
+import time
+import urllib.error
+import urllib.parse
+from typing import Any, Dict, List, Optional, Tuple
+
+from .auth import TokenProvider, get_token_provider
+from .metrics import get_metrics
+from .ratelimit import RateLimiter, get_rate_limiter
+from .records import compact_headers
+from .retry import RetryEngine, endpoint_key, get_retry_engine, is_idempotent
+from .transport import DEFAULT_IDLE_TIMEOUT, TransportResponse, decode_json_body
+
+DEFAULT_CONCURRENCY = 8
+READ_CHUNK_SIZE = 64 * 1024
+
+Connection = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class _AsyncHostPool:
+    def __init__(self, scheme: str, host: str, port: int, size: int, idle_timeout: float, ssl_context: Optional[ssl.SSLContext]):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.idle_timeout = idle_timeout
+        self.ssl_context = ssl_context
+        self._slots = asyncio.Semaphore(size)
+        self._idle: List[Tuple[Connection, float]] = []
+
+    async def acquire(self) -> Tuple[Connection, bool, Dict[str, float], float]:
+        """``(connection, reused, connect timings, queueMs)``; queueMs is the wait for a free pool slot, as in the sync pool."""
+        started = time.monotonic()
+        await self._slots.acquire()
+        now = time.monotonic()
+        waited = round((now - started) * 1000, 3)
+        while self._idle:
+            conn, idle_since = self._idle.pop()
+            if not conn[1].is_closing() and not conn[0].at_eof() and now - idle_since < self.idle_timeout:
+                return conn, True, {}, waited
+            conn[1].close()
+        try:
+            conn, timings = await self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+        return conn, False, timings, waited
+
+    async def _connect(self) -> Tuple[Connection, Dict[str, float]]:
+        """Open a connection, timing DNS, TCP connect and the TLS handshake separately."""
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        addresses = await loop.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)
+        resolved = time.monotonic()
+        tls = self.ssl_context if self.scheme == "https" else None
+        # StreamWriter.start_tls (3.11+) lets the handshake be timed on its own; otherwise it is part of connectMs.
+        upgrade_later = tls is not None and hasattr(asyncio.StreamWriter, "start_tls")
+        last_error: Optional[OSError] = None
+        for _, _, _, _, address in addresses:
+            try:
+                reader, writer = await asyncio.open_connection(
+                    address[0],
+                    address[1],
+                    ssl=None if upgrade_later else tls,
+                    server_hostname=self.host if tls is not None and not upgrade_later else None,
+                )
+            except OSError as exc:
+                last_error = exc
+                continue
+            connected = time.monotonic()
+            timings = {"dnsMs": round((resolved - started) * 1000, 3), "connectMs": round((connected - resolved) * 1000, 3)}
+            if upgrade_later:
+                await writer.start_tls(tls, server_hostname=self.host)
+                timings["tlsMs"] = round((time.monotonic() - connected) * 1000, 3)
+            return (reader, writer), timings
+        raise last_error or OSError(f"getaddrinfo returned no addresses for {self.host}")
+
+    def release(self, conn: Connection, reusable: bool) -> None:
+        if reusable and not conn[1].is_closing():
+            self._idle.append((conn, time.monotonic()))
+        else:
+            conn[1].close()
+        self._slots.release()
+
+    def close(self) -> None:
+        while self._idle:
+            conn, _ = self._idle.pop()
+            conn[1].close()
+
+
+class AsyncHttpTransport:
+    """Minimal HTTP/1.1 client on asyncio streams with keep-alive connection pooling."""
+
+    def __init__(
+        self,
+        pool_size: int = DEFAULT_CONCURRENCY,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+        ssl_context: Optional[ssl.SSLContext] = None,
+        retry_engine: Optional[RetryEngine] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
+        self.pool_size = max(1, pool_size)
+        self.idle_timeout = idle_timeout
+        self.ssl_context = ssl_context or ssl.create_default_context()
+        self.retry_engine = retry_engine or get_retry_engine()
+        self.rate_limiter = rate_limiter
+        self._pools: Dict[Tuple[str, str, int], _AsyncHostPool] = {}
+
+    def _pool_for(self, parsed: urllib.parse.SplitResult) -> _AsyncHostPool:
+        scheme = parsed.scheme.lower()
+        if scheme not in ("http", "https"):
+            raise urllib.error.URLError(f"unsupported URL scheme '{parsed.scheme}'")
+        port = parsed.port or (443 if scheme == "https" else 80)
+        key = (scheme, parsed.hostname or "", port)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = _AsyncHostPool(scheme, key[1], port, self.pool_size, self.idle_timeout, self.ssl_context)
+            self._pools[key] = pool
+        return pool
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        body: Optional[bytes] = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: float = 15,
+    ) -> TransportResponse:
+        return await self.retry_engine.call_async(method, url, lambda: self._send(method, url, body, headers, timeout))
+
+    async def _send(self, method: str, url: str, body: Optional[bytes], headers: Optional[Dict[str, str]], timeout: float) -> TransportResponse:
+        wait = await asyncio.to_thread((self.rate_limiter or get_rate_limiter()).reserve, url)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        parsed = urllib.parse.urlsplit(url)
+        pool = self._pool_for(parsed)
+        target = parsed.path or "/"
+        if parsed.query:
+            target = f"{target}?{parsed.query}"
+        host_header = parsed.netloc.rsplit("@", 1)[-1]
+        hdrs = {"Host": host_header, "Connection": "keep-alive", "Accept-Encoding": "identity"}
+        if headers:
+            hdrs.update(headers)
+        if body is not None or method in ("POST", "PUT", "PATCH"):
+            hdrs["Content-Length"] = str(len(body or b""))
+        head = f"{method} {target} HTTP/1.1\r\n" + "".join(f"{k}: {v}\r\n" for k, v in hdrs.items()) + "\r\n"
+        request_bytes = head.encode("latin-1") + (body or b"")
+
+        while True:
+            queued = time.monotonic()
+            try:
+                conn, reused, connect_timings, queue_ms = await asyncio.wait_for(pool.acquire(), timeout)
+            except asyncio.TimeoutError as exc:
+                raise urllib.error.URLError(f"timed out connecting to {pool.host}") from exc
+            except OSError as exc:
+                raise urllib.error.URLError(exc) from exc
+            acquired = time.monotonic()
+            marks: Dict[str, float] = {}
+            reusable = False
+            try:
+                status, reason, response_headers, payload, reusable = await asyncio.wait_for(
+                    self._exchange(conn, request_bytes, method, marks), timeout
+                )
+            except (ConnectionResetError, BrokenPipeError, asyncio.IncompleteReadError) as exc:
+                # A reused socket the server closed while idle fails before any response byte arrives. The request
+                # may still have been processed, so only idempotent calls are resent on a fresh connection.
+                if reused and "firstByte" not in marks and is_idempotent(method, url):
+                    continue
+                raise urllib.error.URLError(exc) from exc
+            except asyncio.TimeoutError as exc:
+                raise urllib.error.URLError(f"timed out waiting for {pool.host}") from exc
+            except (OSError, ValueError) as exc:
+                raise urllib.error.URLError(exc) from exc
+            finally:
+                pool.release(conn, reusable)
+            break
+
+        finished = time.monotonic()
+        timings: Dict[str, Any] = {
+            "reused": reused,
+            "queueMs": queue_ms,
+            **connect_timings,
+            "sendMs": round((marks["sent"] - acquired) * 1000, 3),
+            "ttfbMs": round((marks["firstByte"] - marks["sent"]) * 1000, 3),
+            "bodyMs": round((finished - marks["firstByte"]) * 1000, 3),
+            "totalMs": round((finished - queued) * 1000, 3),
+        }
+        get_metrics().record(endpoint_key(url), timings)
+
+        if not 200 <= status < 300:
+            error = urllib.error.HTTPError(url, status, reason, response_headers, io.BytesIO(payload))
+            error.timings = timings  # type: ignore[attr-defined]
+            raise error
+        response = TransportResponse(status, reason, response_headers, payload)
+        response.timings = timings
+        return response
+
+    async def _exchange(self, conn: Connection, request_bytes: bytes, method: str, marks: Dict[str, float]):
+        reader, writer = conn
+        writer.write(request_bytes)
+        await writer.drain()
+        marks["sent"] = time.monotonic()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise asyncio.IncompleteReadError(b"", None)
+        marks["firstByte"] = time.monotonic()
+        parts = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+            raise ValueError(f"malformed status line {status_line!r}")
+        version, status = parts[0], int(parts[1])
+        reason = parts[2] if len(parts) > 2 else ""
+
+        raw_headers = bytearray()
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise asyncio.IncompleteReadError(bytes(raw_headers), None)
+            raw_headers += line
+            if line in (b"\r\n", b"\n"):
+                break
+        response_headers = http.client.parse_headers(io.BytesIO(bytes(raw_headers)))
+
+        connection_header = (response_headers.get("Connection") or "").lower()
+        keep_alive = connection_header != "close" and (version != "HTTP/1.0" or connection_header == "keep-alive")
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            return status, reason, response_headers, b"", keep_alive
+        if "chunked" in (response_headers.get("Transfer-Encoding") or "").lower():
+            payload = await self._read_chunked(reader)
+        elif response_headers.get("Content-Length") is not None:
+            payload = await reader.readexactly(int(response_headers["Content-Length"]))
+        else:
+            payload = await reader.read()
+            keep_alive = False
+        return status, reason, response_headers, payload, keep_alive
+
+    async def _read_chunked(self, reader: asyncio.StreamReader) -> bytes:
+        chunks = bytearray()
+        while True:
+            size_line = await reader.readline()
+            size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+            if size == 0:
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return bytes(chunks)
+            chunks += await reader.readexactly(size)
+            await reader.readexactly(2)
+
+    def close(self) -> None:
+        for pool in self._pools.values():
+            pool.close()
+        self._pools.clear()
+
+
+def _response_dict(response: TransportResponse) -> Dict[str, Any]:
+    return {
+        "status": response.status,
+        "headers": compact_headers(response.headers),
+        "body": decode_json_body(response.body),
+        "timings": response.timings,
+    }
+
+
+class AsyncUspsClient:
+    """asyncio client for the USPS v3 endpoints used by the harnesses; in-flight calls are bounded by a semaphore."""
+
+    def __init__(
+        self,
+        base_url: str,
+        client_id: Optional[str] = None,
+        client_secret: Optional[str] = None,
+        token_provider: Optional[TokenProvider] = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        token_cache_path: Optional[str] = None,
+        timeout: float = 15,
+    ):
+        self.base_url = base_url.rstrip("/") + "/"
+        # Tokens come from the process-wide provider, so sync and asyncio callers share one token and one refresh.
+        self.token_provider = token_provider or get_token_provider(
+            self.base_url, client_id or "", client_secret or "", cache_path=token_cache_path
+        )
+        self.timeout = timeout
+        self.transport = AsyncHttpTransport(pool_size=concurrency)
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def __aenter__(self) -> "AsyncUspsClient":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.transport.close()
+
+    def url(self, path: str) -> str:
+        return urllib.parse.urljoin(self.base_url, path)
+
+    async def authenticate(self) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.token_provider.authenticate)
+
+    async def access_token(self) -> Optional[str]:
+        body = (await self.authenticate()).get("body")
+        return body.get("access_token") if isinstance(body, dict) else None
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        payload: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> TransportResponse:
+        token = await self.access_token()
+        hdrs = {"Accept": "application/json", "Authorization": f"Bearer {token}"}
+        data = None
+        if payload is not None:
+            data = json.dumps(payload).encode("utf-8")
+            hdrs["Content-Type"] = "application/json"
+        if headers:
+            hdrs.update(headers)
+        async with self._semaphore:
+            return await self.transport.request(method, self.url(path), body=data, headers=hdrs, timeout=timeout or self.timeout)
+
+    async def post_json(self, path: str, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+        return _response_dict(await self.request("POST", path, payload, headers=headers, timeout=timeout))
+
+    async def create_label(self, payload: Dict[str, Any], payment_token: str, timeout: float = 40) -> TransportResponse:
+        headers = {"X-Payment-Authorization-Token": payment_token}
+        return await self.request("POST", "labels/v3/label", payload, headers=headers, timeout=timeout)
+
+    async def create_international_label(self, payload: Dict[str, Any], payment_token: str, timeout: float = 60) -> TransportResponse:
+        headers = {"X-Payment-Authorization-Token": payment_token, "Accept": "application/json, multipart/mixed"}
+        return await self.request("POST", "international-labels/v3/international-label", payload, headers=headers, timeout=timeout)
+
+    async def international_base_rates(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.post_json("international-prices/v3/base-rates/search", payload)
+
+    async def international_base_rates_list(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.post_json("international-prices/v3/base-rates-list/search", payload)
+
+    async def international_extra_service_rates(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.post_json("international-prices/v3/extra-service-rates/search", payload)
+
+    async def international_total_rates(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.post_json("international-prices/v3/total-rates/search", payload)
+
+    async def shipping_options(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.post_json("shipments/v3/options/search", payload)
+
+    async def create_scan_form(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.post_json("scan-forms/v3/scan-form", payload)
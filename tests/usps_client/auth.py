@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from .transport import http_post_form
+
+# Same safety margin as ValidateRestTokenAsync in the C# processors (expires_in - 20).
+EXPIRY_MARGIN_SECONDS = 20
+# Start a background refresh once less than this fraction of the token lifetime remains.
+REFRESH_AHEAD_FRACTION = 0.1
+
+
+def token_cache_key(client_id: str, base_url: str) -> str:
+    raw = f"{client_id}|{base_url.rstrip('/')}/"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TokenProvider:
+    """Caches a client-credentials token and shares a single in-flight refresh between callers."""
+
+    def __init__(
+        self,
+        base_url: str,
+        client_id: str,
+        client_secret: str,
+        cache_path: Optional[str] = None,
+        margin: int = EXPIRY_MARGIN_SECONDS,
+        timeout: int = 15,
+    ):
+        self.base_url = base_url.rstrip("/") + "/"
+        self.auth_url = urllib.parse.urljoin(self.base_url, "oauth2/v3/token")
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.margin = margin
+        self.timeout = timeout
+        self.key = token_cache_key(client_id, self.base_url)
+        self._lock = threading.Lock()
+        self._refreshed = threading.Condition(self._lock)
+        self._refreshing = False
+        self._error: Optional[BaseException] = None
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+        self._lifetime = 0.0
+        self._last_response: Optional[Dict[str, Any]] = None
+        self._load_disk_cache()
+
+    def get_token(self) -> Optional[str]:
+        body = self.authenticate().get("body")
+        return body.get("access_token") if isinstance(body, dict) else None
+
+    def authenticate(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.time()
+            if self._token and now < self._expires_at:
+                if now >= self._refresh_at and not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh, name="usps-token-refresh", daemon=True).start()
+                return self._cached_response(now)
+            owner = not self._refreshing
+            if owner:
+                self._refreshing = True
+            else:
+                while self._refreshing:
+                    self._refreshed.wait()
+        if owner:
+            self._refresh()
+        with self._lock:
+            now = time.time()
+            if not owner and self._token and now < self._expires_at:
+                return self._cached_response(now)
+            if self._error is not None:
+                raise self._error
+            return self._last_response or {"status": "error", "body": {}}
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._token = None
+            self._expires_at = 0.0
+            self._refresh_at = 0.0
+
+    def _refresh(self) -> None:
+        response: Optional[Dict[str, Any]] = None
+        error: Optional[BaseException] = None
+        try:
+            response = http_post_form(
+                self.auth_url,
+                {
+                    "grant_type": "client_credentials",
+                    "client_id": self.client_id,
+                    "client_secret": self.client_secret,
+                },
+                timeout=self.timeout,
+            )
+        except BaseException as exc:
+            error = exc
+        with self._lock:
+            self._error = error
+            if response is not None:
+                self._last_response = response
+                self._store(response.get("body"), time.time())
+            self._refreshing = False
+            self._refreshed.notify_all()
+        if response is not None and self._token:
+            self._save_disk_cache()
+
+    def _store(self, body: Any, issued_at: float) -> None:
+        if not isinstance(body, dict) or not body.get("access_token"):
+            return
+        try:
+            lifetime = float(body.get("expires_in") or 0)
+        except (TypeError, ValueError):
+            lifetime = 0.0
+        self._token = body["access_token"]
+        self._set_expiry(issued_at + max(lifetime - self.margin, 0.0), lifetime)
+
+    def _set_expiry(self, expires_at: float, lifetime: float) -> None:
+        self._lifetime = lifetime
+        self._expires_at = expires_at
+        self._refresh_at = expires_at - max(lifetime - self.margin, 0.0) * REFRESH_AHEAD_FRACTION
+
+    def _cached_response(self, now: float) -> Dict[str, Any]:
+        return {
+            "status": 200,
+            "cached": True,
+            "body": {
+                "access_token": self._token,
+                "expires_in": int(self._expires_at - now) + self.margin,
+            },
+        }
+
+    def _load_disk_cache(self) -> None:
+        if not self.cache_path:
+            return
+        entries = read_token_cache(self.cache_path)
+        entry = entries.get(self.key)
+        if not isinstance(entry, dict):
+            return
+        expires_at = entry.get("expiresAt")
+        token = entry.get("accessToken")
+        if token and isinstance(expires_at, (int, float)) and time.time() < expires_at:
+            self._token = token
+            self._set_expiry(float(expires_at), float(entry.get("lifetime") or 0))
+
+    def _save_disk_cache(self) -> None:
+        if not self.cache_path:
+            return
+        with self._lock:
+            entry = {
+                "accessToken": self._token,
+                "expiresAt": self._expires_at,
+                "lifetime": self._lifetime,
+            }
+        write_token_cache(self.cache_path, self.key, entry)
+
+
+_file_lock = threading.Lock()
+
+
+def read_token_cache(path: Path) -> Dict[str, Any]:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def write_token_cache(path: Path, key: str, entry: Dict[str, Any]) -> None:
+    with _file_lock:
+        entries = read_token_cache(path)
+        now = time.time()
+        entries = {k: v for k, v in entries.items() if isinstance(v, dict) and (v.get("expiresAt") or 0) > now}
+        entries[key] = entry
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as handle:
+            json.dump(entries, handle)
+        os.replace(tmp_path, path)
+
+
+_providers: Dict[Tuple[str, str], TokenProvider] = {}
+_providers_lock = threading.Lock()
+
+
+def get_token_provider(base_url: str, client_id: str, client_secret: str, cache_path: Optional[str] = None) -> TokenProvider:
+    key = (client_id, base_url.rstrip("/") + "/")
+    with _providers_lock:
+        provider = _providers.get(key)
+        if provider is None:
+            provider = TokenProvider(base_url, client_id, client_secret, cache_path=cache_path)
+            _providers[key] = provider
+        return provider
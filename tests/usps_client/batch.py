@@ -0,0 +1,175 @@
+import csv
+import json
+import time
+import urllib.error
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Set, Tuple, TypeVar
+
+from .jobs import DEAD, DEFER, DONE, RETRY, Job, JobQueue
+from .retry import CircuitOpenError
+from .sink import COMPRESSION_SUFFIXES, open_text
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# How many submitted-but-unfinished items to keep per worker, so huge inputs are never fully buffered.
+QUEUE_DEPTH_PER_WORKER = 2
+
+
+def read_rows(path: str) -> Iterator[Dict[str, str]]:
+    """Stream rows from a CSV (header row required) or JSONL file, optionally .gz/.zst, as env-style string mappings."""
+    suffix = Path(path).suffix.lower()
+    if suffix in COMPRESSION_SUFFIXES.values():
+        suffix = Path(Path(path).stem).suffix.lower()
+    with open_text(Path(path)) as handle:
+        if suffix == ".csv":
+            for row in csv.DictReader(handle):
+                yield {key.strip(): value.strip() for key, value in row.items() if key and value is not None and value.strip() != ""}
+            return
+        for line in handle:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError(f"Expected a JSON object per line in {path}")
+            yield {key: _env_value(value) for key, value in record.items() if value is not None}
+
+
+def _env_value(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return ",".join(_env_value(item) for item in value)
+    return json.dumps(value)
+
+
+def run_bounded(items: Iterable[T], worker: Callable[[T], R], concurrency: int, controller: Optional[Any] = None) -> Iterator[Tuple[T, Any]]:
+    """Run ``worker`` over ``items`` on a thread pool and yield ``(item, result_or_exception)`` as each finishes.
+
+    With an ``AimdController`` the number of in-flight items follows ``controller.limit`` (up to its maximum)
+    instead of the fixed ``concurrency``; the controller learns from the transport attempts the workers make.
+    """
+    concurrency = max(1, concurrency)
+    if controller is not None:
+        concurrency = controller.maximum
+
+    def max_pending() -> int:
+        if controller is not None:
+            return controller.limit
+        return concurrency * QUEUE_DEPTH_PER_WORKER
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="usps-batch") as pool:
+        pending: Dict[Future, T] = {}
+
+        def drain(done: Set[Future]) -> Iterator[Tuple[T, Any]]:
+            for future in done:
+                item = pending.pop(future)
+                error = future.exception()
+                yield item, error if error is not None else future.result()
+
+        for item in items:
+            while len(pending) >= max_pending():
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                yield from drain(done)
+            pending[pool.submit(worker, item)] = item
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            yield from drain(done)
+
+
+def is_transient(outcome: Any) -> bool:
+    """Whether a worker outcome deserves another attempt: any exception except a 4xx other than 429."""
+    if not isinstance(outcome, BaseException):
+        return False
+    if isinstance(outcome, urllib.error.HTTPError):
+        return outcome.code == 429 or outcome.code >= 500
+    return True
+
+
+def run_queued(
+    queue: JobQueue,
+    worker: Callable[[Job], R],
+    concurrency: int,
+    controller: Optional[Any] = None,
+    transient: Callable[[Any], bool] = is_transient,
+    ambiguous: Optional[Callable[[Any], bool]] = None,
+) -> Iterator[Tuple[Job, Any, bool]]:
+    """``run_bounded`` over the claimable jobs of ``queue``, yielding ``(job, outcome, dead_lettered)`` for final outcomes.
+
+    Transient failures are requeued with backoff and not yielded until the job runs out of attempts; calls
+    refused by an open circuit breaker wait for it without using an attempt. Outcomes ``ambiguous`` accepts
+    (a call that may have taken effect, such as a label POST that timed out) are dead-lettered at once for
+    someone to check instead of being retried. Every job is settled before its outcome is yielded, so a
+    crash never hands a finished call out again; at worst its output record is lost.
+    """
+    queue.start_heartbeat()
+    try:
+        while True:
+            for job, outcome in run_bounded(queue.claims(max(1, concurrency)), worker, concurrency, controller=controller):
+                error = (str(outcome) or type(outcome).__name__) if isinstance(outcome, BaseException) else None
+                if isinstance(outcome, CircuitOpenError):
+                    # Never sent; wait for the breaker instead of spending an attempt.
+                    queue.settle([(job, DEFER, error, outcome.retry_in)])
+                elif ambiguous is not None and ambiguous(outcome):
+                    queue.settle([(job, DEAD, error, 0.0)])
+                    yield job, outcome, True
+                elif transient(outcome):
+                    if job.attempts < queue.max_attempts:
+                        queue.settle([(job, RETRY, error, 0.0)])
+                    else:
+                        queue.settle([(job, DEAD, error, 0.0)])
+                        yield job, outcome, True
+                else:
+                    queue.settle([(job, DONE, None, 0.0)])
+                    yield job, outcome, False
+            due = queue.next_due()
+            if due is None:
+                return
+            time.sleep(max(0.0, min(due - queue.clock(), queue.lease_seconds)))
+    finally:
+        queue.stop_heartbeat()
+
+
+def run_items(
+    items: Iterable[Tuple[int, Any]],
+    worker: Callable[[Tuple[int, Any]], R],
+    concurrency: int,
+    controller: Optional[Any] = None,
+    queue: Optional[JobQueue] = None,
+    ambiguous: Optional[Callable[[Any], bool]] = None,
+) -> Iterator[Tuple[Tuple[int, Any], Any, bool]]:
+    """``(id, payload)`` items through ``run_bounded``, or, with a queue, loaded into it and run with ``run_queued``.
+
+    Yields ``((id, payload), outcome, dead_lettered)``. Payloads must be JSON-serializable when a queue is used,
+    and a resumed queue run only yields the items earlier runs did not finish.
+    """
+    if queue is None:
+        for item, outcome in run_bounded(items, worker, concurrency, controller=controller):
+            yield item, outcome, False
+        return
+    queue.load(items)
+    for job, outcome, dead in run_queued(queue, lambda job: worker((job.id, job.payload)), concurrency, controller, ambiguous=ambiguous):
+        yield (job.id, job.payload), outcome, dead
+
+
+def describe_error(exc: BaseException) -> Dict[str, Any]:
+    if isinstance(exc, urllib.error.HTTPError):
+        body = exc.read().decode("utf-8", errors="replace") if exc.fp else ""
+        try:
+            parsed: Any = json.loads(body) if body else {}
+        except json.JSONDecodeError:
+            parsed = {"raw": body}
+        return {"status": exc.code, "body": parsed, "error": f"HTTP {exc.code}", "timings": getattr(exc, "timings", None)}
+    if isinstance(exc, urllib.error.URLError):
+        return {"status": "connection_error", "error": str(exc.reason)}
+    return {"status": "error", "error": str(exc)}
+
+
+def row_reference(row: Dict[str, str], index: int, keys: Tuple[str, ...] = ("reference", "id", "orderId")) -> str:
+    for key in keys:
+        value: Optional[str] = row.get(key)
+        if value:
+            return value
+    return str(index)
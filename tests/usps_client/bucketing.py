@@ -0,0 +1,216 @@
+import bisect
+import copy
+import json
+import math
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# (price signature, response, expires_at) learned for one weight
+Point = Tuple[str, Dict[str, Any], float]
+
+# Sub-pound weights price in 4 oz steps (1-4, 5-8, 9-12, 13-15.99 oz); from 1 lb up USPS rounds to the next whole pound.
+DEFAULT_SUB_POUND_TIERS = (0.25, 0.5, 0.75, 15.99 / 16)
+ZIP_KEYS = ("originZIPCode", "destinationZIPCode")
+PRICE_KEYS = ("price", "totalBasePrice", "totalPrice")
+
+
+def weight_tier(weight: float, sub_pound_tiers: Tuple[float, ...] = DEFAULT_SUB_POUND_TIERS) -> float:
+    if weight <= 0:
+        return weight
+    for ceiling in sub_pound_tiers:
+        if weight <= ceiling:
+            return ceiling
+    if weight < 1:
+        return 1.0
+    return float(math.ceil(round(weight, 6)))
+
+
+def _package_sections(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    sections = [payload]
+    nested = payload.get("packageDescription")
+    if isinstance(nested, dict):
+        sections.append(nested)
+    return sections
+
+
+def price_signature(body: Any) -> Optional[str]:
+    """Every price figure in a response, in document order; equal signatures mean the same pricing tier."""
+    prices: List[Any] = []
+
+    def walk(node: Any) -> None:
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key in PRICE_KEYS and isinstance(value, (int, float)):
+                    prices.append(value)
+                else:
+                    walk(value)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+
+    walk(body)
+    return json.dumps(prices) if prices else None
+
+
+class RateBucketer:
+    """Keys quote payloads by pricing tier and learns, per context, which weights share a price.
+
+    Each learned point expires with the cache entry it came from (the cache TTL, capped at the end of its
+    mailing day), so past mailing dates drop out of lookups and out of the saved table.
+    """
+
+    def __init__(
+        self,
+        sub_pound_tiers: Tuple[float, ...] = DEFAULT_SUB_POUND_TIERS,
+        max_points_per_context: int = 256,
+        zip3: bool = False,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.sub_pound_tiers = tuple(sorted(sub_pound_tiers))
+        self.max_points_per_context = max_points_per_context
+        self.zip3 = zip3
+        self.clock = clock
+        self._lock = threading.Lock()
+        # context -> (sorted weights, points aligned with weights)
+        self._observed: Dict[str, Tuple[List[float], List[Point]]] = {}
+        self.hits = 0
+
+    def key_payload(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Cache-key form of a quote payload; the payload sent to USPS is never changed.
+
+        Weights become their tier ceiling, the weight USPS rates them at. Dimensions stay exact because they
+        drive cubic and dimensional-weight prices. With ``zip3`` (``USPS_RATE_BUCKET_ZIP3``), ZIP codes are cut to
+        the 3-digit prefix that usually decides the zone; it is off by default because ZIPs sharing a prefix can
+        still price differently (local zones, 5-digit zone exceptions).
+        """
+        keyed = copy.deepcopy(payload)
+        for section in _package_sections(keyed):
+            weight = section.get("weight")
+            if isinstance(weight, (int, float)):
+                section["weight"] = weight_tier(float(weight), self.sub_pound_tiers)
+        if self.zip3:
+            for key in ZIP_KEYS:
+                value = keyed.get(key)
+                if isinstance(value, str) and len(value) >= 3:
+                    keyed[key] = value[:3]
+        return keyed
+
+    def _context(self, endpoint: str, payload: Dict[str, Any]) -> Tuple[str, Optional[float]]:
+        keyed = self.key_payload(payload)
+        weight: Optional[float] = None
+        for section in _package_sections(keyed):
+            if isinstance(section.get("weight"), (int, float)):
+                weight = float(section.pop("weight"))
+        return endpoint + "\n" + json.dumps(keyed, sort_keys=True, separators=(",", ":")), weight
+
+    def _prune(self, context: str, now: float) -> None:
+        """Drop the context's expired points, and the context once none are left. Caller holds the lock."""
+        weights, entries = self._observed[context]
+        live = [index for index, entry in enumerate(entries) if entry[2] > now]
+        if len(live) == len(entries):
+            return
+        if not live:
+            del self._observed[context]
+            return
+        self._observed[context] = ([weights[index] for index in live], [entries[index] for index in live])
+
+    def lookup(self, endpoint: str, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        context, weight = self._context(endpoint, payload)
+        if weight is None:
+            return None
+        with self._lock:
+            if context not in self._observed:
+                return None
+            self._prune(context, self.clock())
+            observed = self._observed.get(context)
+            if not observed:
+                return None
+            weights, entries = observed
+            index = bisect.bisect_left(weights, weight)
+            if index < len(weights) and weights[index] == weight:
+                self.hits += 1
+                return entries[index][1]
+            # Prices are monotone step functions of weight: two observations with the same price bracket one tier.
+            if 0 < index < len(weights) and entries[index - 1][0] == entries[index][0]:
+                self.hits += 1
+                return entries[index - 1][1]
+        return None
+
+    def observe(self, endpoint: str, payload: Dict[str, Any], response: Dict[str, Any], expires_at: float = math.inf) -> None:
+        """Learn a successful quote, answerable until ``expires_at`` (the cache entry's own expiry)."""
+        if response.get("status") != 200:
+            return
+        signature = price_signature(response.get("body"))
+        context, weight = self._context(endpoint, payload)
+        if signature is None or weight is None:
+            return
+        with self._lock:
+            if context in self._observed:
+                self._prune(context, self.clock())
+            weights, entries = self._observed.setdefault(context, ([], []))
+            index = bisect.bisect_left(weights, weight)
+            if index < len(weights) and weights[index] == weight:
+                entries[index] = (signature, response, expires_at)
+                return
+            if len(weights) >= self.max_points_per_context:
+                return
+            weights.insert(index, weight)
+            entries.insert(index, (signature, response, expires_at))
+
+    def tier_boundaries(self) -> Dict[str, List[Tuple[float, float]]]:
+        """Learned [low, high] weight ranges that share a price, per context."""
+        learned: Dict[str, List[Tuple[float, float]]] = {}
+        with self._lock:
+            for context, (weights, entries) in self._observed.items():
+                ranges: List[Tuple[float, float]] = []
+                for index, weight in enumerate(weights):
+                    if ranges and entries[index - 1][0] == entries[index][0]:
+                        ranges[-1] = (ranges[-1][0], weight)
+                    else:
+                        ranges.append((weight, weight))
+                learned[context] = ranges
+        return learned
+
+    def save(self, path: str) -> None:
+        """Write the unexpired points; a point that never expires is saved with a null expiry."""
+        with self._lock:
+            now = self.clock()
+            for context in list(self._observed):
+                self._prune(context, now)
+            data = {
+                context: [[w, sig, resp, None if math.isinf(expires_at) else expires_at] for w, (sig, resp, expires_at) in zip(weights, entries)]
+                for context, (weights, entries) in self._observed.items()
+            }
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps(data, separators=(",", ":")), encoding="utf-8")
+
+    def load(self, path: str) -> None:
+        try:
+            data = json.loads(Path(path).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        now = self.clock()
+        with self._lock:
+            for context, points in data.items():
+                points = sorted(
+                    (
+                        (float(p[0]), p[1], p[2], math.inf if p[3] is None else float(p[3]))
+                        for p in points
+                        if isinstance(p, list) and len(p) == 4
+                    ),
+                    key=lambda point: point[0],
+                )
+                points = [point for point in points if point[3] > now]
+                if points:
+                    self._observed[context] = ([p[0] for p in points], [(p[1], p[2], p[3]) for p in points])
+
+
+def build_bucketer(env: Dict[str, str]) -> Optional[RateBucketer]:
+    if (env.get("USPS_RATE_BUCKETING") or "").strip().lower() not in ("1", "true", "yes", "on"):
+        return None
+    bucketer = RateBucketer(zip3=(env.get("USPS_RATE_BUCKET_ZIP3") or "").strip().lower() in ("1", "true", "yes", "on"))
+    if env.get("USPS_RATE_TIERS_PATH"):
+        bucketer.load(env["USPS_RATE_TIERS_PATH"])
+    return bucketer
@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_TTL_SECONDS = 6 * 60 * 60
+DEFAULT_ELIGIBILITY_TTL_SECONDS = 7 * 24 * 60 * 60
+# Statuses meaning USPS rejected the combination itself, as opposed to a transient failure.
+INELIGIBLE_STATUSES = (400, 404, 422)
+
+
+def prune_none(obj: Any) -> Any:
+    if isinstance(obj, dict):
+        return {k: prune_none(v) for k, v in obj.items() if v is not None}
+    if isinstance(obj, list):
+        return [prune_none(v) for v in obj if v is not None]
+    return obj
+
+
+def canonical_key(endpoint: str, payload: Dict[str, Any]) -> str:
+    canonical = json.dumps(prune_none(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{endpoint}\n{canonical}".encode("utf-8")).hexdigest()
+
+
+def end_of_mailing_day(payload: Dict[str, Any]) -> Optional[float]:
+    # Prices are quoted for a mailingDate; once that UTC day is over the quote is stale.
+    raw = payload.get("mailingDate")
+    if not isinstance(raw, str):
+        return None
+    try:
+        mailing_day = date.fromisoformat(raw[:10])
+    except ValueError:
+        return None
+    rollover = datetime(mailing_day.year, mailing_day.month, mailing_day.day, tzinfo=timezone.utc) + timedelta(days=1)
+    return rollover.timestamp()
+
+
+class MemoryTier:
+    """In-process LRU with per-entry expiry."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, now: float) -> Optional[Tuple[float, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, value: Any, expires_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def purge(self, now: float) -> None:
+        with self._lock:
+            for key in [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]:
+                del self._entries[key]
+
+
+class SqliteTier:
+    """On-disk tier shared between runs and processes; values are stored as JSON."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value TEXT NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_expires_at ON responses (expires_at)")
+
+    def get(self, key: str, now: float) -> Optional[Tuple[float, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT expires_at, value FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] <= now:
+            return None
+        return row[0], json.loads(row[1])
+
+    def put(self, key: str, value: Any, expires_at: float) -> None:
+        encoded = json.dumps(value, separators=(",", ":"))
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses (key, expires_at, value) VALUES (?, ?, ?)", (key, expires_at, encoded))
+
+    def purge(self, now: float) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """Read-through cache over ordered tiers (fastest first); hits in slower tiers are promoted."""
+
+    def __init__(
+        self,
+        tiers: List[Any],
+        ttl: float = DEFAULT_TTL_SECONDS,
+        clock: Callable[[], float] = time.time,
+        bucketer: Optional[Any] = None,
+    ):
+        self.tiers = tiers
+        self.ttl = ttl
+        self.clock = clock
+        # Optional usps_client.bucketing.RateBucketer: keys on pricing tiers and answers in-tier misses locally.
+        self.bucketer = bucketer
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, endpoint: str, payload: Dict[str, Any]) -> str:
+        return canonical_key(endpoint, self.bucketer.key_payload(payload) if self.bucketer is not None else payload)
+
+    def get(self, endpoint: str, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        key = self._key(endpoint, payload)
+        now = self.clock()
+        for index, tier in enumerate(self.tiers):
+            entry = tier.get(key, now)
+            if entry is not None:
+                expires_at, value = entry
+                for faster in self.tiers[:index]:
+                    faster.put(key, value, expires_at)
+                self.hits += 1
+                return value
+        if self.bucketer is not None:
+            learned = self.bucketer.lookup(endpoint, payload)
+            if learned is not None:
+                self.hits += 1
+                return dict(learned, bucketed=True)
+        self.misses += 1
+        return None
+
+    def put(self, endpoint: str, payload: Dict[str, Any], response: Dict[str, Any]) -> None:
+        # Only successful quotes are worth replaying.
+        if response.get("status") != 200:
+            return
+        now = self.clock()
+        expires_at = self._expires_at(payload, now)
+        if expires_at <= now:
+            return
+        key = self._key(endpoint, payload)
+        value = {"status": response.get("status"), "headers": response.get("headers", {}), "body": response.get("body")}
+        for tier in self.tiers:
+            tier.put(key, value, expires_at)
+        if self.bucketer is not None:
+            self.bucketer.observe(endpoint, payload, value, expires_at)
+
+    def purge(self) -> None:
+        now = self.clock()
+        for tier in self.tiers:
+            tier.purge(now)
+
+    def stats(self) -> Dict[str, int]:
+        stats = {"hits": self.hits, "misses": self.misses}
+        if self.bucketer is not None:
+            stats["tierHits"] = self.bucketer.hits
+        return stats
+
+    def _expires_at(self, payload: Dict[str, Any], now: float) -> float:
+        expires_at = now + self.ttl
+        rollover = end_of_mailing_day(payload)
+        return min(expires_at, rollover) if rollover is not None else expires_at
+
+
+class EligibilityCache:
+    """Remembers which codes USPS accepted or rejected per route so later runs can skip known failures."""
+
+    def __init__(self, path: str, ttl: float = DEFAULT_ELIGIBILITY_TTL_SECONDS, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as handle:
+                self._entries: Dict[str, Dict[str, Any]] = json.load(handle)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    @staticmethod
+    def route_key(*parts: Any) -> str:
+        return "|".join(str(part) for part in parts)
+
+    def known_ineligible(self, route: str, code: Any) -> bool:
+        with self._lock:
+            entry = self._entries.get(route, {}).get(str(code))
+        return bool(entry) and not entry["eligible"] and entry["checkedAt"] + self.ttl > self.clock()
+
+    def record(self, route: str, code: Any, status: Any) -> None:
+        if status == 200:
+            eligible = True
+        elif status in INELIGIBLE_STATUSES:
+            eligible = False
+        else:
+            return
+        with self._lock:
+            self._entries.setdefault(route, {})[str(code)] = {"eligible": eligible, "status": status, "checkedAt": self.clock()}
+
+    def save(self) -> None:
+        with self._lock:
+            encoded = json.dumps(self._entries, indent=2)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            handle.write(encoded)
+        os.replace(temp_path, self.path)
+
+
+def cached_post(cache: Optional[ResponseCache], url: str, payload: Dict[str, Any], fetch: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    if cache is None:
+        return fetch()
+    hit = cache.get(url, payload)
+    if hit is not None:
+        return dict(hit, cached=True)
+    response = fetch()
+    cache.put(url, payload, response)
+    return response
+
+
+def build_response_cache(env: Dict[str, str], bucketer: Optional[Any] = None) -> Optional[ResponseCache]:
+    """Cache configured from env: USPS_PRICE_CACHE=off disables it, USPS_PRICE_CACHE_PATH adds a SQLite tier."""
+    if (env.get("USPS_PRICE_CACHE") or "").strip().lower() in ("0", "off", "false", "no"):
+        return None
+    ttl_value = env.get("USPS_PRICE_CACHE_TTL", "")
+    max_entries = env.get("USPS_PRICE_CACHE_SIZE", "")
+    tiers: List[Any] = [MemoryTier(int(max_entries) if max_entries.isdigit() else DEFAULT_MAX_ENTRIES)]
+    if env.get("USPS_PRICE_CACHE_PATH"):
+        tiers.append(SqliteTier(env["USPS_PRICE_CACHE_PATH"]))
+    return ResponseCache(tiers, ttl=float(ttl_value) if ttl_value.isdigit() else DEFAULT_TTL_SECONDS, bucketer=bucketer)
@@ -0,0 +1,143 @@
+import socket
+import threading
+import time
+import urllib.error
+from typing import Any, Callable, Dict, Optional
+
+from .retry import RETRYABLE_STATUSES, CircuitOpenError, RetryEngine, endpoint_key, get_retry_engine
+
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 64
+BACKOFF_FACTOR = 0.5
+# A call slower than this multiple of the best recent latency counts as a congestion signal.
+LATENCY_TOLERANCE = 2.0
+# The latency baseline drifts toward recent samples so a permanently slower USPS does not pin the limit at the floor.
+BASELINE_DECAY = 0.01
+
+
+def is_timeout(exc: BaseException) -> bool:
+    if isinstance(exc, (socket.timeout, TimeoutError)):
+        return True
+    if isinstance(exc, urllib.error.URLError):
+        reason = exc.reason
+        return isinstance(reason, (socket.timeout, TimeoutError)) or "timed out" in str(reason)
+    return False
+
+
+def is_overload(exc: BaseException) -> bool:
+    """429s, 5xx, timeouts and open breakers all mean "send less"; other failures say nothing about load."""
+    if isinstance(exc, CircuitOpenError) or is_timeout(exc):
+        return True
+    return isinstance(exc, urllib.error.HTTPError) and (exc.code == 429 or exc.code in RETRYABLE_STATUSES)
+
+
+class AimdController:
+    """Additive-increase/multiplicative-decrease limit on in-flight requests for one endpoint.
+
+    Each success grows the limit by ``1/limit`` (about +1 per round trip of the whole window). An overload
+    signal or a latency above ``LATENCY_TOLERANCE`` times the baseline halves it, at most once per
+    baseline latency so one burst of slow replies is not punished repeatedly. Samples are single transport
+    attempts, so cache hits, rate-limiter waits and retry sleeps never reach the controller.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        initial: int = 4,
+        minimum: int = DEFAULT_MIN_LIMIT,
+        maximum: int = DEFAULT_MAX_LIMIT,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.endpoint = endpoint
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self._limit = float(min(max(initial, self.minimum), self.maximum))
+        self.clock = clock
+        self.baseline: Optional[float] = None
+        self.peak = self._limit
+        self.increases = 0
+        self.decreases = 0
+        self._last_decrease = float("-inf")
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def on_result(self, latency: Optional[float], exc: Optional[BaseException] = None) -> None:
+        with self._lock:
+            if exc is None:
+                if latency is None:
+                    return
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    self.baseline += (latency - self.baseline) * BASELINE_DECAY
+                congested = latency > self.baseline * LATENCY_TOLERANCE
+            elif is_overload(exc):
+                congested = True
+            else:
+                return
+            if congested:
+                now = self.clock()
+                if now - self._last_decrease >= (self.baseline or 0.0):
+                    self._limit = max(float(self.minimum), self._limit * BACKOFF_FACTOR)
+                    self._last_decrease = now
+                    self.decreases += 1
+                return
+            self._limit = min(float(self.maximum), self._limit + 1.0 / self._limit)
+            self.peak = max(self.peak, self._limit)
+            self.increases += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "peak": int(self.peak),
+                "min": self.minimum,
+                "max": self.maximum,
+                "baselineLatencyMs": round(self.baseline * 1000, 1) if self.baseline is not None else None,
+                "increases": self.increases,
+                "decreases": self.decreases,
+            }
+
+
+class ConcurrencyLimits:
+    """One AIMD controller per endpoint, created on first use and fed by every attempt ``engine`` makes to it."""
+
+    def __init__(
+        self,
+        initial: int = 4,
+        minimum: int = DEFAULT_MIN_LIMIT,
+        maximum: int = DEFAULT_MAX_LIMIT,
+        engine: Optional[RetryEngine] = None,
+    ):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self._controllers: Dict[str, AimdController] = {}
+        self._lock = threading.Lock()
+        self.engine = engine or get_retry_engine()
+        self.engine.add_observer(self.observe)
+
+    def observe(self, url: str, latency: Optional[float], exc: Optional[BaseException]) -> None:
+        with self._lock:
+            controller = self._controllers.get(endpoint_key(url))
+        if controller is not None:
+            controller.on_result(latency, exc)
+
+    def close(self) -> None:
+        self.engine.remove_observer(self.observe)
+
+    def controller(self, url: str) -> AimdController:
+        endpoint = endpoint_key(url)
+        with self._lock:
+            controller = self._controllers.get(endpoint)
+            if controller is None:
+                controller = self._controllers[endpoint] = AimdController(endpoint, self.initial, self.minimum, self.maximum)
+            return controller
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            controllers = list(self._controllers.values())
+        return {controller.endpoint: controller.snapshot() for controller in controllers}
@@ -0,0 +1,48 @@
+from typing import Dict, Optional
+
+KNOWN_ENDPOINTS = {
+    "TEM": "https://apis-tem.usps.com/",
+    "CAT": "https://apis-tem.usps.com/",
+    "PROD": "https://apis.usps.com/",
+}
+
+
+def load_env(path: str) -> Dict[str, str]:
+    env: Dict[str, str] = {}
+    with open(path, "r", encoding="utf-8") as handle:
+        for raw_line in handle:
+            line = raw_line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            key = key.strip()
+            value = value.strip()
+            if value.startswith('"') and value.endswith('"') and len(value) >= 2:
+                value = value[1:-1]
+            env[key] = value
+    return env
+
+
+def resolve_base_url(env: Dict[str, str]) -> Optional[str]:
+    # Same precedence as the harnesses: explicit base URL, unless USPS_ENV names a known environment
+    # and the configured URL is only the local mock default.
+    raw_base = env.get("USPS_BASE_URL") or env.get("USPS_API_BASEURL") or env.get("MOCK_SERVER_BASEURL")
+    usps_env = env.get("USPS_ENV")
+    if usps_env:
+        override = KNOWN_ENDPOINTS.get(usps_env.upper())
+        if override and (not raw_base or "localhost" in raw_base or raw_base.rstrip("/").endswith("9091")):
+            raw_base = override
+    if not raw_base:
+        return None
+    return raw_base.rstrip("/") + "/"
+
+
+def parse_int(value: Optional[str]) -> Optional[int]:
+    if value is None or value.strip() == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.error
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Mapping, Optional, TypeVar
+
+from .cache import canonical_key
+from .retry import NOT_SENT_ERRORS, CircuitOpenError
+
+T = TypeVar("T")
+
+# A pending entry older than this belongs to a run that died mid-call; its outcome is unknown.
+DEFAULT_IN_FLIGHT_TIMEOUT = 10 * 60
+PENDING = "pending"
+COMPLETED = "completed"
+FAILED = "failed"
+AMBIGUOUS = "ambiguous"
+
+
+class IdempotencyError(Exception):
+    """A label call was refused because sending it could buy postage twice."""
+
+    def __init__(self, key: str, message: str):
+        super().__init__(message)
+        self.key = key
+
+
+class LabelInFlightError(IdempotencyError):
+    pass
+
+
+class AmbiguousLabelError(IdempotencyError):
+    pass
+
+
+def idempotency_key(endpoint: str, payload: Dict[str, Any], reference: Optional[str] = None) -> str:
+    """``<reference>:<payload hash>``, or the bare hash; any change to the payload is a different label."""
+    fingerprint = canonical_key(endpoint, payload)[:32]
+    return f"{reference}:{fingerprint}" if reference else fingerprint
+
+
+def artifact_stem(prefix: str, key: str) -> str:
+    """``<prefix>-<hash of key>``, a label file name only this key writes, so ``artifact_reconciler`` can trust it."""
+    return f"{prefix}-{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}"
+
+
+def outcome_state(exc: BaseException) -> str:
+    """FAILED when ``exc`` proves no label was bought (rejected or never sent), AMBIGUOUS otherwise."""
+    if isinstance(exc, CircuitOpenError):
+        return FAILED
+    if isinstance(exc, urllib.error.HTTPError):
+        # 4xx (including 429) is a rejection; a 5xx may have been raised after the label was created.
+        return FAILED if exc.code < 500 else AMBIGUOUS
+    if isinstance(exc, urllib.error.URLError) and isinstance(exc.reason, NOT_SENT_ERRORS):
+        return FAILED
+    return AMBIGUOUS
+
+
+def is_ambiguous(outcome: Any) -> bool:
+    """Whether a batch outcome is an error after which the label may still have been bought."""
+    return isinstance(outcome, BaseException) and outcome_state(outcome) == AMBIGUOUS
+
+
+def artifact_reconciler(entry: Mapping[str, Any]) -> Optional[Dict[str, Any]]:
+    """A label artifact is only renamed into place once fully received, so a non-empty file written after the
+    request went out proves success."""
+    artifact = entry.get("artifact")
+    if not artifact:
+        return None
+    path = Path(artifact)
+    if not path.is_file():
+        return None
+    stat = path.stat()
+    # Reserved names start empty, and a harness that reuses one file name may find a previous run's label.
+    if stat.st_size == 0 or stat.st_mtime < (entry.get("sent_at") or 0):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(64 * 1024), b""):
+            digest.update(chunk)
+    return {"status": 200, "savedLabel": str(path), "size": stat.st_size, "sha256": digest.hexdigest()}
+
+
+class LabelLedger:
+    """SQLite record of every paid label call, written before the request is sent and again after.
+
+    ``call`` refuses to resend a key whose last attempt is ``completed`` (the stored result is replayed),
+    still in flight in another worker, or ``ambiguous`` -- a timeout or 5xx after the request went out. An
+    ambiguous entry is first passed to each ``reconcilers`` callable; one that returns a result settles it
+    as completed. Otherwise it stays blocked until ``resend_ambiguous`` is set, once someone has confirmed
+    with USPS that no postage was bought. Keys that ``failed`` definitively may be sent again.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        in_flight_timeout: float = DEFAULT_IN_FLIGHT_TIMEOUT,
+        resend_ambiguous: bool = False,
+        reconcilers: Optional[List[Callable[[Mapping[str, Any]], Optional[Dict[str, Any]]]]] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.in_flight_timeout = in_flight_timeout
+        self.resend_ambiguous = resend_ambiguous
+        self.reconcilers = list(reconcilers) if reconcilers is not None else [artifact_reconciler]
+        self.clock = clock
+        self.counts = {"sent": 0, "replayed": 0, "reconciled": 0, "blocked": 0}
+        self._lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS label_calls ("
+            "key TEXT PRIMARY KEY, reference TEXT, state TEXT NOT NULL, attempts INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, sent_at REAL NOT NULL, updated_at REAL NOT NULL, artifact TEXT, result TEXT, error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS label_calls_state ON label_calls (state)")
+
+    def entry(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM label_calls WHERE key = ?", (key,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] += 1
+
+    def _update(self, key: str, state: str, **fields: Any) -> None:
+        assignments = "".join(f", {name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE label_calls SET state = ?, updated_at = ?{assignments} WHERE key = ?",
+                (state, self.clock(), *fields.values(), key),
+            )
+
+    def _claim(self, key: str, reference: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Mark ``key`` pending and return None, or return the existing entry that prevents sending it."""
+        now = self.clock()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                entry = self._claim_locked(key, reference, now)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return entry
+
+    def _claim_locked(self, key: str, reference: Optional[str], now: float) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute("SELECT * FROM label_calls WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self._conn.execute(
+                "INSERT INTO label_calls (key, reference, state, attempts, created_at, sent_at, updated_at) VALUES (?, ?, ?, 1, ?, ?, ?)",
+                (key, reference, PENDING, now, now, now),
+            )
+            return None
+        entry = dict(row)
+        if entry["state"] == PENDING and now - entry["updated_at"] >= self.in_flight_timeout:
+            entry.update(state=AMBIGUOUS, error="abandoned in flight")
+            self._conn.execute("UPDATE label_calls SET state = ?, error = ? WHERE key = ?", (AMBIGUOUS, entry["error"], key))
+        if entry["state"] == FAILED or (entry["state"] == AMBIGUOUS and self.resend_ambiguous):
+            self._conn.execute(
+                "UPDATE label_calls SET state = ?, attempts = attempts + 1, sent_at = ?, updated_at = ?, artifact = NULL, error = NULL WHERE key = ?",
+                (PENDING, now, now, key),
+            )
+            return None
+        return entry
+
+    def _reconcile(self, entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if entry.get("artifact"):
+            with self._lock:
+                shared = self._conn.execute(
+                    "SELECT 1 FROM label_calls WHERE artifact = ? AND key != ? LIMIT 1", (entry["artifact"], entry["key"])
+                ).fetchone()
+            if shared is not None:
+                # Another key may have written that file since; it proves nothing about this one.
+                entry = dict(entry, artifact=None)
+        for reconciler in self.reconcilers:
+            result = reconciler(entry)
+            if result is not None:
+                self._update(entry["key"], COMPLETED, result=json.dumps(result, separators=(",", ":"), default=str))
+                return result
+        return None
+
+    def note_artifact(self, key: str, path: Optional[Path]) -> Optional[Path]:
+        """Remember where a streamed label will land, for ``artifact_reconciler``; returns ``path`` for chaining."""
+        if path is not None:
+            with self._lock:
+                self._conn.execute("UPDATE label_calls SET artifact = ? WHERE key = ?", (str(path), key))
+        return path
+
+    def call(
+        self,
+        key: str,
+        send: Callable[[], T],
+        encode: Optional[Callable[[T], Dict[str, Any]]] = None,
+        decode: Optional[Callable[[Dict[str, Any]], T]] = None,
+        reference: Optional[str] = None,
+    ) -> T:
+        """Run ``send`` at most once per ``key``; a completed key returns its stored result instead.
+
+        ``encode`` turns a result into the JSON object stored (and must carry ``status``); ``decode`` turns a
+        stored object, marked ``"replayed": true``, back into a result. Both default to the identity, for
+        callers whose results are already plain dicts.
+        """
+        encode = encode or (lambda result: result)  # type: ignore[assignment,return-value]
+        decode = decode or (lambda stored: stored)  # type: ignore[assignment,return-value]
+        entry = self._claim(key, reference)
+        if entry is not None:
+            if entry["state"] == COMPLETED:
+                self._count("replayed")
+                return decode(dict(json.loads(entry["result"]), replayed=True))
+            if entry["state"] == AMBIGUOUS:
+                result = self._reconcile(entry)
+                if result is not None:
+                    self._count("reconciled")
+                    return decode(dict(result, replayed=True))
+                self._count("blocked")
+                raise AmbiguousLabelError(
+                    key,
+                    f"label '{key}' may already have been bought ({entry['error'] or 'outcome unknown'}); "
+                    "check USPS before resending with USPS_LABEL_LEDGER_RESEND_AMBIGUOUS=true",
+                )
+            self._count("blocked")
+            raise LabelInFlightError(key, f"label '{key}' is already being created by another worker")
+
+        self._count("sent")
+        try:
+            result = send()
+        except BaseException as exc:
+            self._update(key, outcome_state(exc), error=str(exc) or type(exc).__name__)
+            raise
+        encoded = encode(result)
+        status = encoded.get("status")
+        # The transport only returns 2xx responses, and any of them means the postage was bought.
+        state = COMPLETED if isinstance(status, int) and 200 <= status < 300 else FAILED
+        self._update(key, state, result=json.dumps(encoded, separators=(",", ":"), default=str))
+        return result
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM label_calls GROUP BY state").fetchall()
+        return {"path": self.path, "states": {state: count for state, count in rows}, **self.counts}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def build_label_ledger(env: Mapping[str, str], path: Optional[str] = None) -> Optional[LabelLedger]:
+    """Ledger at ``path`` or ``USPS_LABEL_LEDGER`` (env file, then process environment); None when neither is set."""
+    env = {**os.environ, **env}
+    path = path or env.get("USPS_LABEL_LEDGER")
+    if not path:
+        return None
+    resend = (env.get("USPS_LABEL_LEDGER_RESEND_AMBIGUOUS") or "").strip().lower() in ("1", "true", "yes", "on")
+    return LabelLedger(path, resend_ambiguous=resend)
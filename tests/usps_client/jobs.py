@@ -0,0 +1,298 @@
+import hashlib
+import itertools
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+from .config import parse_int
+
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+DEAD = "dead"
+# Settlement for a transient failure: back to QUEUED after a delay, or DEAD once attempts run out.
+RETRY = "retry"
+# Settlement for a job that was never really attempted (e.g. an open circuit): requeued without using up an attempt.
+DEFER = "defer"
+DEFAULT_LEASE_SECONDS = 30.0
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_DELAY = 2.0
+LOAD_BATCH = 1000
+
+
+class Job:
+    __slots__ = ("id", "payload", "attempts")
+
+    def __init__(self, id: int, payload: Any, attempts: int):
+        self.id = id
+        self.payload = payload
+        self.attempts = attempts
+
+
+def default_run_id(flow: str, input_path: str) -> str:
+    """Stable for one input file: the same path, size and mtime resume the same run."""
+    path = Path(input_path).resolve()
+    stat = path.stat()
+    digest = hashlib.sha256(f"{path}\n{stat.st_size}\n{stat.st_mtime_ns}".encode("utf-8")).hexdigest()[:16]
+    return f"{flow}:{digest}"
+
+
+def _is_dead_local_owner(owner: str, host: str) -> bool:
+    """Owners are ``host:pid:token``; only a process on this host can be checked for liveness."""
+    owner_host, _, pid = owner.rpartition(":")[0].rpartition(":")
+    if owner_host != host or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        # The process exists but belongs to another user, or the check is unsupported here.
+        return False
+    try:
+        # A killed process stays visible as a zombie until its parent reaps it.
+        with open(f"/proc/{pid}/stat", "r", encoding="utf-8") as handle:
+            return handle.read().rpartition(")")[2].split()[0] == "Z"
+    except (OSError, IndexError):
+        return False
+
+
+class JobQueue:
+    """Durable work queue for one batch run, in a SQLite WAL database that can hold many runs.
+
+    ``load`` enqueues items in transactions of ``LOAD_BATCH`` and records how far it got, so loading also
+    resumes. Workers ``claim`` jobs under a lease that a heartbeat thread renews while it runs;
+    the jobs of a run that died become claimable again once their lease lapses. ``settle`` marks finished
+    jobs done, requeues transient failures with exponential backoff and dead-letters a job after
+    ``max_attempts``. Done jobs are never handed out again, so rerunning a run only processes the rest.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        run: str,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        retry_delay: float = DEFAULT_RETRY_DELAY,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.run = run
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{id(self):x}"
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat: Optional[threading.Thread] = None
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL keeps commits durable across a process crash without an fsync per transaction.
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS runs (run TEXT PRIMARY KEY, loaded INTEGER NOT NULL, complete INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (run TEXT NOT NULL, id INTEGER NOT NULL, payload TEXT NOT NULL, state TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL DEFAULT 0, lease_owner TEXT, lease_expires REAL, "
+            "error TEXT, updated_at REAL NOT NULL, PRIMARY KEY (run, id))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_claimable ON jobs (run, state, available_at)")
+        now = self.clock()
+
+        def open_run() -> Optional[Tuple[int, int]]:
+            row = self._conn.execute("SELECT loaded, complete FROM runs WHERE run = ?", (run,)).fetchone()
+            if row is None:
+                self._conn.execute("INSERT INTO runs (run, loaded, complete, created_at, updated_at) VALUES (?, 0, 0, ?, ?)", (run, now, now))
+            return row
+
+        row = self._transaction(open_run)
+        # A resumed run skips what earlier attempts loaded and finished; its output should be appended to.
+        self.resumed = row is not None
+        self.loaded, self.loaded_all = (row[0], bool(row[1])) if row is not None else (0, False)
+        if self.resumed:
+            self.release_orphans()
+
+    def _transaction(self, work: Callable[[], Any]) -> Any:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work()
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def load(self, items: Iterable[Tuple[int, Any]]) -> int:
+        """Enqueue ``(id, payload)`` items, skipping those a previous load of this run already committed."""
+        if self.loaded_all:
+            return 0
+        remaining = itertools.islice(items, self.loaded, None)
+        added = 0
+        while True:
+            batch = list(itertools.islice(remaining, LOAD_BATCH))
+            now = self.clock()
+            rows = [(self.run, job_id, json.dumps(payload, separators=(",", ":")), QUEUED, now) for job_id, payload in batch]
+
+            def insert() -> None:
+                self._conn.executemany("INSERT OR IGNORE INTO jobs (run, id, payload, state, updated_at) VALUES (?, ?, ?, ?, ?)", rows)
+                self._conn.execute(
+                    "UPDATE runs SET loaded = loaded + ?, complete = ?, updated_at = ? WHERE run = ?",
+                    (len(batch), int(len(batch) < LOAD_BATCH), now, self.run),
+                )
+
+            self._transaction(insert)
+            self.loaded += len(batch)
+            added += len(batch)
+            if len(batch) < LOAD_BATCH:
+                self.loaded_all = True
+                return added
+
+    def release_orphans(self) -> int:
+        """Requeue jobs leased by processes on this host that no longer exist, instead of waiting out their lease."""
+        host = socket.gethostname()
+        with self._lock:
+            owners = [row[0] for row in self._conn.execute("SELECT DISTINCT lease_owner FROM jobs WHERE run = ? AND state = ?", (self.run, LEASED))]
+        orphans = [owner for owner in owners if owner and _is_dead_local_owner(owner, host)]
+        released = 0
+        for owner in orphans:
+            with self._lock:
+                released += self._conn.execute(
+                    "UPDATE jobs SET state = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ? WHERE run = ? AND state = ? AND lease_owner = ?",
+                    (QUEUED, self.clock(), self.run, LEASED, owner),
+                ).rowcount
+        return released
+
+    def claim(self, limit: int) -> List[Job]:
+        """Lease up to ``limit`` claimable jobs, in id order: queued and due, or leased by a run whose lease lapsed."""
+        now = self.clock()
+
+        def take() -> List[Job]:
+            rows = self._conn.execute(
+                "SELECT id, payload, attempts FROM jobs WHERE run = ? AND ((state = ? AND available_at <= ?) OR (state = ? AND lease_expires <= ?)) "
+                "ORDER BY id LIMIT ?",
+                (self.run, QUEUED, now, LEASED, now, limit),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE jobs SET state = ?, attempts = attempts + 1, lease_owner = ?, lease_expires = ?, updated_at = ? WHERE run = ? AND id = ?",
+                [(LEASED, self.owner, now + self.lease_seconds, now, self.run, row[0]) for row in rows],
+            )
+            return [Job(row[0], json.loads(row[1]), row[2] + 1) for row in rows]
+
+        return self._transaction(take)
+
+    def claims(self, batch: int) -> Iterator[Job]:
+        """Claim ``batch`` jobs at a time until none are claimable right now."""
+        while True:
+            jobs = self.claim(max(1, batch))
+            if not jobs:
+                return
+            yield from jobs
+
+    def settle(self, outcomes: List[Tuple[Job, str, Optional[str], float]]) -> None:
+        """Apply ``(job, DONE | DEAD | RETRY | DEFER, error, delay)`` settlements in one transaction.
+
+        ``delay`` is the wait before a deferred job is due again; retries back off exponentially instead.
+        """
+        if not outcomes:
+            return
+        now = self.clock()
+        rows = []
+        for job, state, error, delay in outcomes:
+            available_at, spent = 0.0, 0
+            if state == RETRY:
+                state = QUEUED if job.attempts < self.max_attempts else DEAD
+                available_at = now + self.retry_delay * 2 ** (job.attempts - 1)
+            elif state == DEFER:
+                state, available_at, spent = QUEUED, now + delay, 1
+            rows.append((state, available_at, spent, error, now, self.run, job.id, self.owner))
+        self._transaction(
+            lambda: self._conn.executemany(
+                "UPDATE jobs SET state = ?, available_at = ?, attempts = attempts - ?, error = ?, lease_owner = NULL, lease_expires = NULL, "
+                "updated_at = ? WHERE run = ? AND id = ? AND lease_owner = ?",
+                rows,
+            )
+        )
+
+    def next_due(self) -> Optional[float]:
+        """When the next unfinished job becomes claimable (a retry delay or another worker's lease), or None if none remain."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(CASE WHEN state = ? THEN available_at ELSE lease_expires END) FROM jobs WHERE run = ? AND state IN (?, ?)",
+                (QUEUED, self.run, QUEUED, LEASED),
+            ).fetchone()
+        return row[0]
+
+    def requeue_dead(self) -> int:
+        def requeue() -> int:
+            return self._conn.execute(
+                "UPDATE jobs SET state = ?, attempts = 0, available_at = 0, updated_at = ? WHERE run = ? AND state = ?",
+                (QUEUED, self.clock(), self.run, DEAD),
+            ).rowcount
+
+        return self._transaction(requeue)
+
+    def renew(self) -> None:
+        now = self.clock()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE run = ? AND state = ? AND lease_owner = ?",
+                (now + self.lease_seconds, self.run, LEASED, self.owner),
+            )
+
+    def _beat(self) -> None:
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.renew()
+            except sqlite3.Error:
+                # A busy database only delays renewal; the next beat tries again well before the lease lapses.
+                pass
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM jobs WHERE run = ? GROUP BY state", (self.run,)).fetchall()
+        return {"path": self.path, "run": self.run, "resumed": self.resumed, "loaded": self.loaded, "states": {state: count for state, count in rows}}
+
+    def start_heartbeat(self) -> None:
+        if self._heartbeat is None:
+            self._stop.clear()
+            self._heartbeat = threading.Thread(target=self._beat, name="usps-queue-heartbeat", daemon=True)
+            self._heartbeat.start()
+
+    def stop_heartbeat(self) -> None:
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+
+    def close(self) -> None:
+        self.stop_heartbeat()
+        with self._lock:
+            self._conn.close()
+
+
+def build_job_queue(env: Mapping[str, str], flow: str, input_path: str, path: Optional[str] = None, run: Optional[str] = None) -> Optional[JobQueue]:
+    """Queue at ``path`` or ``USPS_JOB_QUEUE``, for run ``run`` (default: derived from the input file); None when unset.
+
+    ``USPS_JOB_MAX_ATTEMPTS`` and ``USPS_JOB_LEASE_SECONDS`` tune dead-lettering and leases.
+    """
+    env = {**os.environ, **env}
+    path = path or env.get("USPS_JOB_QUEUE")
+    if not path:
+        return None
+    lease = env.get("USPS_JOB_LEASE_SECONDS")
+    return JobQueue(
+        path,
+        run or default_run_id(flow, input_path),
+        lease_seconds=float(lease) if lease else DEFAULT_LEASE_SECONDS,
+        max_attempts=parse_int(env.get("USPS_JOB_MAX_ATTEMPTS")) or DEFAULT_MAX_ATTEMPTS,
+    )
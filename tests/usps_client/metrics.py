@@ -0,0 +1,103 @@
+import math
+import threading
+from typing import Any, Dict, Mapping, Optional
+
+# Phase keys written by the transports into each call's ``timings`` (milliseconds).
+PHASES = ("queueMs", "dnsMs", "connectMs", "tlsMs", "sendMs", "ttfbMs", "bodyMs", "totalMs")
+HISTOGRAM_FLOOR_MS = 0.01
+HISTOGRAM_GROWTH = 1.02  # about 1% relative error per reported percentile
+
+
+class LatencyHistogram:
+    """Log-bucketed histogram of millisecond samples; memory depends on the value range, not the sample count."""
+
+    def __init__(self) -> None:
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    @staticmethod
+    def _index(value: float) -> int:
+        if value <= HISTOGRAM_FLOOR_MS:
+            return 0
+        return int(math.log(value / HISTOGRAM_FLOOR_MS, HISTOGRAM_GROWTH)) + 1
+
+    def record(self, value: float) -> None:
+        index = self._index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                upper = HISTOGRAM_FLOOR_MS * HISTOGRAM_GROWTH ** index
+                return min(upper, self.max) if self.max is not None else upper
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        def rounded(value: Optional[float]) -> Optional[float]:
+            return round(value, 2) if value is not None else None
+
+        return {
+            "count": self.count,
+            "minMs": rounded(self.min),
+            "meanMs": rounded(self.total / self.count) if self.count else None,
+            "p50Ms": rounded(self.percentile(0.50)),
+            "p95Ms": rounded(self.percentile(0.95)),
+            "p99Ms": rounded(self.percentile(0.99)),
+            "maxMs": rounded(self.max),
+        }
+
+
+class MetricsRegistry:
+    """Per-endpoint histograms of every transport call, one per timing phase."""
+
+    def __init__(self) -> None:
+        self._histograms: Dict[str, Dict[str, LatencyHistogram]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, timings: Mapping[str, Any]) -> None:
+        with self._lock:
+            phases = self._histograms.setdefault(endpoint, {})
+            for phase in PHASES:
+                value = timings.get(phase)
+                if isinstance(value, (int, float)):
+                    phases.setdefault(phase, LatencyHistogram()).record(float(value))
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """``{endpoint: {"totalMs": {...p50/p95/p99...}, "ttfbMs": {...}, ...}}`` for phases that were observed."""
+        with self._lock:
+            return {
+                endpoint: {phase: phases[phase].summary() for phase in PHASES if phase in phases}
+                for endpoint, phases in self._histograms.items()
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+
+
+_default_registry = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    return _default_registry
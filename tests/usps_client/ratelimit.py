@@ -0,0 +1,177 @@
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import time
+import urllib.parse
+from typing import Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: buckets are shared between threads only.
+    fcntl = None  # type: ignore[assignment]
+
+# Endpoint families with their own USPS quota, matched on the URL path.
+ENDPOINT_FAMILIES = (
+    ("token", ("oauth2/",)),
+    ("labels", ("labels/v3/", "international-labels/v3/")),
+    ("scanForms", ("scan-forms/v3/",)),
+    ("prices", ("prices/v3/", "shipments/v3/options")),
+    ("addresses", ("addresses/v3/",)),
+)
+BUDGET_ENV_KEYS = {
+    "token": "USPS_RATE_LIMIT_TOKEN",
+    "labels": "USPS_RATE_LIMIT_LABELS",
+    "scanForms": "USPS_RATE_LIMIT_SCAN_FORMS",
+    "prices": "USPS_RATE_LIMIT_PRICES",
+    "addresses": "USPS_RATE_LIMIT_ADDRESSES",
+    "default": "USPS_RATE_LIMIT_DEFAULT",
+}
+UNIT_SECONDS = {"s": 1.0, "sec": 1.0, "m": 60.0, "min": 60.0, "h": 3600.0, "hr": 3600.0}
+STATE_FORMAT = "dd"  # tokens, wall-clock timestamp of the last update
+STATE_SIZE = struct.calcsize(STATE_FORMAT)
+
+
+def endpoint_family(url: str) -> str:
+    path = urllib.parse.urlsplit(url).path
+    for family, markers in ENDPOINT_FAMILIES:
+        if any(marker in path for marker in markers):
+            return family
+    return "default"
+
+
+def parse_budget(raw: Optional[str]) -> Optional[Tuple[float, float]]:
+    """Parse ``"<count>[/<unit>][:<burst>]"`` (e.g. ``10/s``, ``300/min:20``) into (tokens per second, capacity)."""
+    if not raw or not raw.strip():
+        return None
+    spec, _, burst = raw.strip().partition(":")
+    count, _, unit = spec.partition("/")
+    try:
+        rate = float(count) / UNIT_SECONDS[unit.strip().lower() or "s"]
+        capacity = float(burst) if burst else max(1.0, rate)
+    except (KeyError, ValueError, ZeroDivisionError):
+        return None
+    if rate <= 0 or capacity <= 0:
+        return None
+    return rate, capacity
+
+
+class TokenBucket:
+    """Token bucket whose state lives in a small file guarded by ``flock``, so every process on the host shares it.
+
+    ``reserve`` always takes a token, letting the balance go negative, and returns how long the caller must
+    wait before sending. Reservations are therefore granted in arrival order with a single locked update,
+    which works the same from threads (``time.sleep``) and coroutines (``asyncio.sleep``).
+    """
+
+    def __init__(self, name: str, rate: float, capacity: float, state_path: Optional[str] = None, clock=time.time):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.state_path = state_path if fcntl is not None else None
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._tokens = capacity
+        self._updated = clock()
+
+    def _advance(self, tokens: float, updated: float, now: float) -> float:
+        return min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = self.clock()
+            if self.state_path is None:
+                self._tokens = self._advance(self._tokens, self._updated, now) - 1
+                self._updated = now
+                return max(0.0, -self._tokens / self.rate)
+            fd = os.open(self.state_path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                raw = os.pread(fd, STATE_SIZE, 0)
+                tokens, updated = struct.unpack(STATE_FORMAT, raw) if len(raw) == STATE_SIZE else (self.capacity, now)
+                tokens = self._advance(tokens, updated, now) - 1
+                os.pwrite(fd, struct.pack(STATE_FORMAT, tokens, now), 0)
+            finally:
+                os.close(fd)  # also releases the flock
+            return max(0.0, -tokens / self.rate)
+
+    def acquire(self) -> float:
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class RateLimiter:
+    """One bucket per (endpoint family, host); families without a configured budget are not limited."""
+
+    def __init__(self, budgets: Dict[str, Tuple[float, float]], state_dir: Optional[str] = None):
+        self.budgets = budgets
+        self.state_dir = state_dir
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._lock = threading.Lock()
+        self.waited: Dict[str, float] = {}
+
+    def bucket_for(self, url: str) -> Optional[TokenBucket]:
+        family = endpoint_family(url)
+        budget = self.budgets.get(family)
+        if budget is None:
+            return None
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            bucket = self._buckets.get((family, host))
+            if bucket is None:
+                state_path = None
+                if self.state_dir:
+                    os.makedirs(self.state_dir, mode=0o700, exist_ok=True)
+                    digest = hashlib.sha256(f"{family}\n{host}".encode("utf-8")).hexdigest()[:16]
+                    state_path = os.path.join(self.state_dir, f"{family}-{digest}.bucket")
+                bucket = self._buckets[(family, host)] = TokenBucket(family, budget[0], budget[1], state_path)
+            return bucket
+
+    def reserve(self, url: str) -> float:
+        bucket = self.bucket_for(url)
+        if bucket is None:
+            return 0.0
+        wait = bucket.reserve()
+        if wait > 0:
+            with self._lock:
+                self.waited[bucket.name] = self.waited.get(bucket.name, 0.0) + wait
+        return wait
+
+    def acquire(self, url: str) -> None:
+        wait = self.reserve(url)
+        if wait > 0:
+            time.sleep(wait)
+
+
+_default_limiter: Optional[RateLimiter] = None
+_default_lock = threading.Lock()
+
+
+def build_rate_limiter(env: Dict[str, str]) -> RateLimiter:
+    budgets = {}
+    for family, key in BUDGET_ENV_KEYS.items():
+        budget = parse_budget(env.get(key))
+        if budget is not None:
+            budgets[family] = budget
+    default_dir = os.path.join(tempfile.gettempdir(), f"usps-rate-limit-{os.getuid() if hasattr(os, 'getuid') else 0}")
+    return RateLimiter(budgets, state_dir=env.get("USPS_RATE_LIMIT_DIR") or default_dir)
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Process-wide limiter configured from ``USPS_RATE_LIMIT_*`` environment variables."""
+    global _default_limiter
+    with _default_lock:
+        if _default_limiter is None:
+            _default_limiter = build_rate_limiter(dict(os.environ))
+        return _default_limiter
+
+
+def configure_rate_limiter(env: Dict[str, str]) -> RateLimiter:
+    """Replace the process-wide limiter, e.g. with budgets read from the harness env file."""
+    global _default_limiter
+    with _default_lock:
+        _default_limiter = build_rate_limiter({**os.environ, **env})
+        return _default_limiter
@@ -0,0 +1,215 @@
+import bisect
+import json
+import os
+import threading
+import time
+from array import array
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .bucketing import weight_tier
+
+DEFAULT_MAX_AGE_SECONDS = 7 * 24 * 60 * 60
+TABLE_VERSION = 2
+
+RouteKey = Tuple[str, str, str, str]  # (country, mailClass, priceType, rateIndicator) as requested
+SeriesKey = Tuple[str, str, str, str, str]  # route + (SKU or description)
+
+
+def _end_of_day(raw: Any) -> Optional[float]:
+    if not isinstance(raw, str) or not raw:
+        return None
+    try:
+        day = date.fromisoformat(raw[:10])
+    except ValueError:
+        return None
+    return (datetime(day.year, day.month, day.day, tzinfo=timezone.utc) + timedelta(days=1)).timestamp()
+
+
+def route_key(country: Any, mail_class: Any, price_type: Any, rate_indicator: Any = None) -> RouteKey:
+    return (country or "", mail_class or "", price_type or "", rate_indicator or "")
+
+
+class RateSeries:
+    """Prices for one rate option, held in parallel arrays sorted by weight tier."""
+
+    __slots__ = ("description", "weights", "prices", "harvested_at", "expires_at")
+
+    def __init__(self, description: Optional[str] = None):
+        self.description = description
+        self.weights = array("d")
+        self.prices = array("d")
+        self.harvested_at = array("d")
+        self.expires_at = array("d")
+
+    def put(self, weight: float, price: float, harvested_at: float, expires_at: float) -> None:
+        index = bisect.bisect_left(self.weights, weight)
+        if index < len(self.weights) and self.weights[index] == weight:
+            self.prices[index] = price
+            self.harvested_at[index] = harvested_at
+            self.expires_at[index] = expires_at
+            return
+        self.weights.insert(index, weight)
+        self.prices.insert(index, price)
+        self.harvested_at.insert(index, harvested_at)
+        self.expires_at.insert(index, expires_at)
+
+    def find(self, weight: float, now: float) -> Optional[int]:
+        index = bisect.bisect_left(self.weights, weight)
+        if index < len(self.weights) and self.weights[index] == weight and self.expires_at[index] > now:
+            return index
+        return None
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "description": self.description,
+            "weights": self.weights.tolist(),
+            "prices": self.prices.tolist(),
+            "harvestedAt": self.harvested_at.tolist(),
+            "expiresAt": self.expires_at.tolist(),
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "RateSeries":
+        series = cls(data.get("description"))
+        series.weights = array("d", data.get("weights", []))
+        series.prices = array("d", data.get("prices", []))
+        series.harvested_at = array("d", data.get("harvestedAt", []))
+        series.expires_at = array("d", data.get("expiresAt", []))
+        return series
+
+
+class RateTable:
+    """Local international rate table harvested from base-rates-list responses.
+
+    Rows are indexed by the request's (country, mailClass, priceType, rateIndicator), then by option,
+    then by weight tier, so a quote is a dict lookup plus a bisect. The route comes from the request
+    rather than the rates, which report their own price type (``COMMERCIAL_BASE`` for a ``COMMERCIAL``
+    request). Each row carries when it was harvested and when it stops being trustworthy: the rate's
+    endDate, or ``max_age`` after harvest, whichever is first.
+    """
+
+    def __init__(self, max_age: float = DEFAULT_MAX_AGE_SECONDS, clock=time.time):
+        self.max_age = max_age
+        self.clock = clock
+        self._series: Dict[SeriesKey, RateSeries] = {}
+        self._by_route: Dict[RouteKey, List[str]] = {}
+        self._lock = threading.Lock()
+
+    def harvest(self, payload: Dict[str, Any], body: Any) -> int:
+        """Record every weight-priced rate in a base-rates-list body; returns the number of rows stored."""
+        country = payload.get("destinationCountryCode")
+        weight = payload.get("weight")
+        if not isinstance(body, dict) or not isinstance(country, str) or not isinstance(weight, (int, float)):
+            return 0
+        tier = weight_tier(float(weight))
+        route = route_key(country, payload.get("mailClass"), payload.get("priceType"), payload.get("rateIndicator"))
+        now = self.clock()
+        stored = 0
+        with self._lock:
+            for option in body.get("rateOptions") or []:
+                for rate in (option or {}).get("rates") or []:
+                    price = rate.get("price")
+                    if not isinstance(price, (int, float)):
+                        continue
+                    # Dimensionally weighted rates depend on the package size, not just the weight tier.
+                    dim_weight = rate.get("dimWeight") or rate.get("dimensionalWeight")
+                    if isinstance(dim_weight, (int, float)) and dim_weight > tier:
+                        continue
+                    option_key = rate.get("SKU") or rate.get("description") or ""
+                    expires_at = now + self.max_age
+                    end_of_rate = _end_of_day(rate.get("endDate"))
+                    if end_of_rate is not None:
+                        expires_at = min(expires_at, end_of_rate)
+                    self._series_for(route + (option_key,), rate.get("description")).put(
+                        tier, float(price), now, expires_at
+                    )
+                    stored += 1
+        return stored
+
+    def _series_for(self, key: SeriesKey, description: Optional[str]) -> RateSeries:
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = RateSeries(description)
+            self._by_route.setdefault(key[:4], []).append(key[4])
+        return series
+
+    def quote(
+        self, country: str, mail_class: str, price_type: str, weight: float, rate_indicator: Optional[str] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Fresh local prices for every option harvested for this request route, or None if any row is missing or stale."""
+        tier = weight_tier(float(weight))
+        now = self.clock()
+        route = route_key(country, mail_class, price_type, rate_indicator)
+        quotes: List[Dict[str, Any]] = []
+        with self._lock:
+            for option_key in self._by_route.get(route, ()):
+                series = self._series[route + (option_key,)]
+                index = series.find(tier, now)
+                if index is None:
+                    return None
+                quotes.append(
+                    {
+                        "SKU": option_key,
+                        "description": series.description,
+                        "price": series.prices[index],
+                        "weight": tier,
+                        "harvestedAt": series.harvested_at[index],
+                        "expiresAt": series.expires_at[index],
+                    }
+                )
+        return quotes or None
+
+    def stale(self, horizon: float = 0.0) -> Iterator[Tuple[SeriesKey, float]]:
+        """(series key, weight tier) rows that expire within ``horizon`` seconds and should be re-harvested."""
+        cutoff = self.clock() + horizon
+        # Collected under the lock and yielded after it is released, so callers may harvest while iterating.
+        with self._lock:
+            rows = [
+                (key, weight)
+                for key, series in self._series.items()
+                for weight, expires_at in zip(series.weights, series.expires_at)
+                if expires_at <= cutoff
+            ]
+        yield from rows
+
+    def freshness(self) -> Dict[str, Any]:
+        with self._lock:
+            expiries = [expires for series in self._series.values() for expires in series.expires_at]
+            harvests = [harvested for series in self._series.values() for harvested in series.harvested_at]
+        now = self.clock()
+        return {
+            "series": len(self._series),
+            "rows": len(expiries),
+            "staleRows": sum(1 for expires in expiries if expires <= now),
+            "oldestHarvest": min(harvests) if harvests else None,
+            "nextExpiry": min((expires for expires in expiries if expires > now), default=None),
+        }
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            data = {
+                "version": TABLE_VERSION,
+                "series": [{"key": list(key), **series.to_json()} for key, series in self._series.items()],
+            }
+        target = Path(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        temp = target.with_suffix(target.suffix + ".tmp")
+        temp.write_text(json.dumps(data, separators=(",", ":")), encoding="utf-8")
+        os.replace(temp, target)
+
+    @classmethod
+    def load(cls, path: str, max_age: float = DEFAULT_MAX_AGE_SECONDS) -> "RateTable":
+        table = cls(max_age=max_age)
+        try:
+            data = json.loads(Path(path).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return table
+        if data.get("version") != TABLE_VERSION:
+            return table
+        for entry in data.get("series", []):
+            key = tuple(entry["key"])
+            table._series_for(key, entry.get("description"))  # registers the route index
+            table._series[key] = RateSeries.from_json(entry)
+        return table
@@ -0,0 +1,324 @@
+import email.parser
+import email.policy
+import json
+import os
+import threading
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterator, Mapping, Optional
+
+# Headers worth keeping from a USPS response; the rest is API gateway noise (x-amzn-*, via, x-cache, ...).
+KEPT_HEADERS = frozenset(
+    name.lower()
+    for name in (
+        "Content-Type",
+        "Retry-After",
+        "X-Request-ID",
+        "X-Correlation-ID",
+        "X-Amzn-RequestId",
+        "Apigw-Requestid",
+        "X-RateLimit-Limit",
+        "X-RateLimit-Remaining",
+        "X-RateLimit-Reset",
+    )
+)
+# Checked in order; the first present header is the request ID quoted to USPS support.
+REQUEST_ID_HEADERS = ("X-Request-ID", "X-Correlation-ID", "X-Amzn-RequestId", "Apigw-Requestid")
+# A node's own total wins over the line items beneath it (rates[].price, extraServices[].price).
+AMOUNT_KEYS = ("totalPrice", "totalBasePrice", "price")
+
+_retain_raw: Optional[bool] = None
+_retain_lock = threading.Lock()
+
+
+def retain_raw() -> bool:
+    """Whether full headers and successful bodies are kept; ``USPS_RETAIN_RAW=1`` unless set by ``set_retain_raw``."""
+    global _retain_raw
+    with _retain_lock:
+        if _retain_raw is None:
+            _retain_raw = os.environ.get("USPS_RETAIN_RAW", "").strip().lower() in ("1", "true", "yes", "on")
+        return _retain_raw
+
+
+def set_retain_raw(enabled: bool) -> None:
+    global _retain_raw
+    with _retain_lock:
+        _retain_raw = enabled
+
+
+def compact_headers(headers: Optional[Any]) -> Dict[str, str]:
+    """The ``KEPT_HEADERS`` of a response (all of them with raw retention on); ``{}`` for None."""
+    if not headers:
+        return {}
+    if retain_raw():
+        return dict(headers.items())
+    return {name: value for name, value in headers.items() if name.lower() in KEPT_HEADERS}
+
+
+def request_id(headers: Optional[Any]) -> Optional[str]:
+    if not headers:
+        return None
+    lowered = {name.lower(): value for name, value in headers.items()}
+    for name in REQUEST_ID_HEADERS:
+        value = lowered.get(name.lower())
+        if value:
+            return value
+    return None
+
+
+def rate_amounts(node: Any) -> Iterator[float]:
+    """One amount per priced node of a response body (each rate option, or the base rate), in document order."""
+    if isinstance(node, dict):
+        for key in AMOUNT_KEYS:
+            value = node.get(key)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield float(value)
+                return
+        for value in node.values():
+            yield from rate_amounts(value)
+    elif isinstance(node, list):
+        for item in node:
+            yield from rate_amounts(item)
+
+
+def label_postage(value: Any) -> Optional[float]:
+    """``labelMetadata.postage``, a number or an ``{"amount": ...}`` object."""
+    if isinstance(value, dict):
+        value = value.get("amount", value.get("value"))
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+def multipart_json(content_type: Optional[str], data: Optional[bytes]) -> Optional[Dict[str, Any]]:
+    """The JSON part of a ``multipart/*`` body, e.g. the label API's metadata beside the label image; None if there is none."""
+    if not content_type or not data or not content_type.lower().startswith("multipart/"):
+        return None
+    head = f"Content-Type: {content_type}\r\n\r\n".encode("latin-1")
+    message = email.parser.BytesParser(policy=email.policy.default).parsebytes(head + data)
+    for part in message.walk():
+        if part.get_content_type() != "application/json":
+            continue
+        try:
+            value = json.loads(part.get_payload(decode=True) or b"")
+        except ValueError:
+            continue
+        if isinstance(value, dict):
+            return value
+    return None
+
+
+def saved_multipart_json(content_type: Optional[str], path: Optional[Path]) -> Optional[Dict[str, Any]]:
+    """``multipart_json`` of a response streamed to ``path``; None for other content types or an unreadable file."""
+    if path is None or not content_type or not content_type.lower().startswith("multipart/"):
+        return None
+    try:
+        return multipart_json(content_type, Path(path).read_bytes())
+    except OSError:
+        return None
+
+
+class ResponseRecord:
+    """One call's outcome reduced to what the batch aggregations read.
+
+    Slotted so a million of them stay small; ``raw_headers`` and ``raw_body`` are only populated when raw
+    retention is on, except that a failed call keeps its (small) error body so it stays diagnosable.
+    """
+
+    __slots__ = ("status", "request_id", "timings", "cached", "raw_headers", "raw_body")
+
+    def __init__(
+        self,
+        status: Any,
+        request_id: Optional[str] = None,
+        timings: Optional[Dict[str, Any]] = None,
+        cached: bool = False,
+        raw_headers: Optional[Dict[str, str]] = None,
+        raw_body: Any = None,
+    ):
+        self.status = status
+        self.request_id = request_id
+        self.timings = timings
+        self.cached = cached
+        self.raw_headers = raw_headers
+        self.raw_body = raw_body
+
+    @classmethod
+    def _common(cls, response: Mapping[str, Any]) -> Dict[str, Any]:
+        status = response.get("status")
+        keep = retain_raw()
+        return {
+            "status": status,
+            "request_id": request_id(response.get("headers")),
+            "timings": response.get("timings") or None,
+            "cached": bool(response.get("cached")),
+            "raw_headers": dict(response["headers"].items()) if keep and response.get("headers") else None,
+            "raw_body": response.get("body") if keep or status != 200 else None,
+        }
+
+    @classmethod
+    def from_response(cls, response: Mapping[str, Any]) -> "ResponseRecord":
+        """From an ``http_post_*`` / ``cached_post`` result dict."""
+        return cls(**cls._common(response))
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200
+
+    def to_dict(self) -> Dict[str, Any]:
+        record: Dict[str, Any] = {"status": self.status}
+        if self.request_id:
+            record["requestId"] = self.request_id
+        if self.timings:
+            record["timings"] = self.timings
+        if self.cached:
+            record["cached"] = True
+        if self.raw_headers is not None:
+            record["headers"] = self.raw_headers
+        if self.raw_body is not None:
+            record["body"] = self.raw_body
+        return record
+
+
+class QuoteRecord(ResponseRecord):
+    """A price quote: the ``rate_amounts`` of its body as a packed ``array('d')``."""
+
+    __slots__ = ("amounts",)
+
+    def __init__(self, status: Any, amounts: Optional[array] = None, **common: Any):
+        super().__init__(status, **common)
+        self.amounts = amounts if amounts is not None else array("d")
+
+    @classmethod
+    def from_response(cls, response: Mapping[str, Any]) -> "QuoteRecord":
+        common = cls._common(response)
+        return cls(amounts=array("d", rate_amounts(response.get("body"))), **common)
+
+    @property
+    def lowest(self) -> Optional[float]:
+        return min(self.amounts) if self.amounts else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        record = super().to_dict()
+        if self.amounts:
+            record["lowestPrice"] = self.lowest
+            record["prices"] = self.amounts.tolist()
+        return record
+
+
+class LabelRecord(ResponseRecord):
+    """A created label: its identifiers from ``labelMetadata`` (or the JSON part of a multipart reply) and the saved artifact."""
+
+    __slots__ = ("tracking_number", "label_id", "mail_class", "postage", "content_type", "artifact_path", "size", "sha256", "replayed")
+
+    def __init__(
+        self,
+        status: Any,
+        tracking_number: Optional[str] = None,
+        label_id: Optional[str] = None,
+        mail_class: Optional[str] = None,
+        postage: Optional[float] = None,
+        content_type: Optional[str] = None,
+        artifact_path: Optional[Path] = None,
+        size: Optional[int] = None,
+        sha256: Optional[str] = None,
+        replayed: bool = False,
+        **common: Any,
+    ):
+        super().__init__(status, **common)
+        self.tracking_number = tracking_number
+        self.label_id = label_id
+        self.mail_class = mail_class
+        self.postage = postage
+        self.content_type = content_type
+        self.artifact_path = artifact_path
+        self.size = size
+        self.sha256 = sha256
+        # Returned from the label ledger instead of being bought again.
+        self.replayed = replayed
+
+    @classmethod
+    def from_response(cls, response: Mapping[str, Any]) -> "LabelRecord":
+        common = cls._common(response)
+        body = response.get("body")
+        metadata = body.get("labelMetadata", body) if isinstance(body, dict) else None
+        if not isinstance(metadata, dict):
+            metadata = {}
+        headers = response.get("headers") or {}
+        return cls(
+            tracking_number=metadata.get("trackingNumber"),
+            label_id=metadata.get("labelId"),
+            mail_class=metadata.get("mailClass"),
+            postage=label_postage(metadata.get("postage")),
+            content_type=headers.get("Content-Type"),
+            **common,
+        )
+
+    @classmethod
+    def from_result(cls, result: Mapping[str, Any]) -> "LabelRecord":
+        """From a single-run harness result, whose JSON body is kept as undecoded text."""
+        body = result.get("body")
+        if isinstance(body, str):
+            try:
+                body = json.loads(body) if body else None
+            except ValueError:
+                body = None
+        if body is None and result.get("savedLabel"):
+            body = saved_multipart_json((result.get("headers") or {}).get("Content-Type"), Path(result["savedLabel"]))
+        record = cls.from_response(dict(result, body=body))
+        if result.get("savedLabel"):
+            record.artifact_path = Path(result["savedLabel"])
+            record.size = result.get("size")
+            record.sha256 = result.get("sha256")
+        return record
+
+    @classmethod
+    def from_transport(cls, response: Any, body: Any = None) -> "LabelRecord":
+        """From a ``TransportResponse``; ``body`` is its decoded JSON when the label was not streamed to disk."""
+        if body is None:
+            body = saved_multipart_json(response.headers.get("Content-Type"), response.saved_path)
+        record = cls.from_response({"status": response.status, "headers": response.headers, "body": body, "timings": response.timings})
+        if response.saved_path is not None:
+            record.artifact_path = response.saved_path
+            record.size = response.size
+            record.sha256 = response.sha256
+        return record
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "LabelRecord":
+        """Inverse of ``to_dict``, e.g. for a result replayed from the label ledger."""
+        saved = data.get("savedLabel")
+        return cls(
+            data.get("status"),
+            tracking_number=data.get("trackingNumber"),
+            label_id=data.get("labelId"),
+            mail_class=data.get("mailClass"),
+            postage=data.get("postage"),
+            content_type=data.get("contentType"),
+            artifact_path=Path(saved) if saved else None,
+            size=data.get("size"),
+            sha256=data.get("sha256"),
+            replayed=bool(data.get("replayed")),
+            request_id=data.get("requestId"),
+            timings=data.get("timings"),
+            raw_headers=data.get("headers"),
+            raw_body=data.get("body"),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        record = super().to_dict()
+        for key, value in (
+            ("contentType", self.content_type),
+            ("trackingNumber", self.tracking_number),
+            ("labelId", self.label_id),
+            ("mailClass", self.mail_class),
+            ("postage", self.postage),
+            ("savedLabel", str(self.artifact_path) if self.artifact_path is not None else None),
+            ("size", self.size),
+            ("sha256", self.sha256),
+        ):
+            if value is not None:
+                record[key] = value
+        if self.replayed:
+            record["replayed"] = True
+        return record
@@ -0,0 +1,323 @@
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from .records import LabelRecord
+
+UNMANIFESTED = "unmanifested"
+# On a SCAN form request that has not settled yet; no other manifest may take the label meanwhile.
+SUBMITTED = "submitted"
+MANIFESTED = "manifested"
+COMPLETED = "completed"
+FAILED = "failed"
+# The SCAN form request may have succeeded (it timed out, or its run died mid-request). The labels stay
+# claimed until an operator settles the manifest, since sending them again could put them on two forms.
+REVIEW = "review"
+# A submitted manifest older than this belongs to a run that died mid-request; it is held for review.
+DEFAULT_IN_FLIGHT_TIMEOUT = 10 * 60
+# Filters accepted by ``LabelRegistry.labels``, each an indexed column.
+FILTER_COLUMNS = {
+    "tracking_number": "tracking_number",
+    "mail_date": "mail_date",
+    "mid": "mid",
+    "mail_class": "mail_class",
+    "origin_zip": "origin_zip",
+    "state": "manifest_state",
+}
+
+
+def label_fields(payload: Mapping[str, Any]) -> Dict[str, Optional[str]]:
+    """Mail date, mail class and origin ZIP of a domestic or international label request."""
+    package = payload.get("packageDescription") or {}
+    origin = payload.get("fromAddress") or {}
+    return {
+        "mail_date": payload.get("mailingDate") or package.get("mailingDate"),
+        "mail_class": package.get("mailClass"),
+        "origin_zip": origin.get("ZIPCode"),
+    }
+
+
+def scan_form_label(entry: Mapping[str, Any]) -> Dict[str, Any]:
+    """A registry entry as a ``labelShipment.labels`` item."""
+    label = {"labelId": entry.get("label_id"), "trackingNumber": entry.get("tracking_number"), "mailClass": entry.get("mail_class")}
+    return {name: value for name, value in label.items() if value is not None}
+
+
+class LabelRegistry:
+    """SQLite index of every label bought, for SCAN forms and reprints.
+
+    Each successful label call adds one row keyed by its tracking number (or label ID when the response
+    carried none), with the mail date, MID, mail class, origin ZIP, postage and saved artifact. Rows are
+    indexed by tracking number, mail date, MID, mail class and manifest state, so "today's unmanifested
+    labels from one origin" is an index range scan rather than a file to parse.
+
+    Each SCAN form close is a row in ``manifests``: ``begin_manifest`` claims the labels it covers, and
+    settling it records which form every label went on, so repeated closes only send new labels.
+    """
+
+    def __init__(self, path: str, in_flight_timeout: float = DEFAULT_IN_FLIGHT_TIMEOUT, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.in_flight_timeout = in_flight_timeout
+        self.clock = clock
+        self.counts = {"added": 0, "unidentified": 0}
+        self._lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # One commit per label; under WAL this stays durable across a process crash without an fsync each.
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS labels ("
+            "key TEXT PRIMARY KEY, tracking_number TEXT, label_id TEXT, reference TEXT, mail_date TEXT, mid TEXT, crid TEXT, "
+            "mail_class TEXT, origin_zip TEXT, postage REAL, artifact TEXT, sha256 TEXT, request_id TEXT, "
+            "manifest_state TEXT NOT NULL, manifest_id INTEGER, scan_form TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS manifests ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, mail_date TEXT, origin_zip TEXT, mid TEXT, state TEXT NOT NULL, labels INTEGER NOT NULL, "
+            "scan_form TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL, error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS labels_tracking_number ON labels (tracking_number)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS labels_manifest_id ON labels (manifest_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS manifests_state ON manifests (state, created_at)")
+        # The SCAN form query: state first, then the day and origin it is closed for.
+        self._conn.execute("CREATE INDEX IF NOT EXISTS labels_manifest ON labels (manifest_state, mail_date, origin_zip)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS labels_mid ON labels (mid, mail_date)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS labels_mail_class ON labels (mail_class, mail_date)")
+
+    def add(
+        self,
+        record: LabelRecord,
+        payload: Mapping[str, Any],
+        reference: Optional[str] = None,
+        mid: Optional[str] = None,
+        crid: Optional[str] = None,
+    ) -> bool:
+        """Register a successful label; False (and nothing stored) when it has neither tracking number nor label ID.
+
+        Re-adding a key, e.g. a label replayed from the ledger, refreshes its details but keeps its manifest state.
+        """
+        if not record.ok:
+            return False
+        key = record.tracking_number or record.label_id
+        if not key:
+            with self._lock:
+                self.counts["unidentified"] += 1
+            return False
+        fields = label_fields(payload)
+        now = self.clock()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO labels (key, tracking_number, label_id, reference, mail_date, mid, crid, mail_class, origin_zip, postage, "
+                "artifact, sha256, request_id, manifest_state, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET label_id = COALESCE(excluded.label_id, label_id), "
+                "reference = COALESCE(excluded.reference, reference), postage = COALESCE(excluded.postage, postage), "
+                "artifact = COALESCE(excluded.artifact, artifact), sha256 = COALESCE(excluded.sha256, sha256), "
+                "request_id = COALESCE(excluded.request_id, request_id), updated_at = excluded.updated_at",
+                (
+                    key,
+                    record.tracking_number,
+                    record.label_id,
+                    reference,
+                    fields["mail_date"],
+                    mid,
+                    crid,
+                    record.mail_class or fields["mail_class"],
+                    fields["origin_zip"],
+                    record.postage,
+                    str(record.artifact_path) if record.artifact_path is not None else None,
+                    record.sha256,
+                    record.request_id,
+                    UNMANIFESTED,
+                    now,
+                    now,
+                ),
+            )
+            self.counts["added"] += 1
+        return True
+
+    def get(self, tracking_number: str) -> Optional[Dict[str, Any]]:
+        """The entry for a tracking number (or label ID), e.g. to find the artifact for a reprint."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM labels WHERE key = ? OR tracking_number = ? LIMIT 1", (tracking_number, tracking_number)
+            ).fetchone()
+        return dict(row) if row is not None else None
+
+    @staticmethod
+    def _select(limit: Optional[int], filters: Mapping[str, Optional[str]]) -> Tuple[str, List[Any]]:
+        unknown = set(filters) - set(FILTER_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown label filter(s): {', '.join(sorted(unknown))}")
+        clauses = [(FILTER_COLUMNS[name], value) for name, value in filters.items() if value is not None]
+        where = " AND ".join(f"{column} = ?" for column, _ in clauses) or "1"
+        query = f"SELECT * FROM labels WHERE {where} ORDER BY rowid"
+        params: List[Any] = [value for _, value in clauses]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return query, params
+
+    def labels(self, limit: Optional[int] = None, **filters: Optional[str]) -> List[Dict[str, Any]]:
+        """Entries matching every non-None filter (``tracking_number``, ``mail_date``, ``mid``, ``mail_class``,
+        ``origin_zip``, ``state``), in the order they were added."""
+        query, params = self._select(limit, filters)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def unmanifested(
+        self,
+        mail_date: str,
+        origin_zip: Optional[str] = None,
+        mid: Optional[str] = None,
+        mail_class: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """``labelShipment.labels`` items for the day's labels not yet on a SCAN form."""
+        entries = self.labels(limit=limit, state=UNMANIFESTED, mail_date=mail_date, origin_zip=origin_zip, mid=mid, mail_class=mail_class)
+        return [scan_form_label(entry) for entry in entries]
+
+    def unmanifested_origins(self, mail_date: str, mid: Optional[str] = None) -> List[str]:
+        """Origin ZIPs with labels mailed on ``mail_date`` still waiting for a SCAN form (labels with no origin are left out)."""
+        query = "SELECT DISTINCT origin_zip FROM labels WHERE manifest_state = ? AND mail_date = ? AND origin_zip IS NOT NULL"
+        params: List[Any] = [UNMANIFESTED, mail_date]
+        if mid is not None:
+            query += " AND mid = ?"
+            params.append(mid)
+        with self._lock:
+            return [row[0] for row in self._conn.execute(query + " ORDER BY origin_zip", params)]
+
+    def _transaction(self, body: Callable[[], Any]) -> Any:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = body()
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def _release(self, manifest_id: int, error: str, now: float) -> None:
+        self._conn.execute(
+            "UPDATE labels SET manifest_state = ?, manifest_id = NULL, updated_at = ? WHERE manifest_id = ? AND manifest_state IN (?, ?)",
+            (UNMANIFESTED, now, manifest_id, SUBMITTED, REVIEW),
+        )
+        self._conn.execute("UPDATE manifests SET state = ?, error = ?, updated_at = ? WHERE id = ?", (FAILED, error, now, manifest_id))
+
+    def _hold(self, manifest_id: int, error: str, now: float) -> None:
+        self._conn.execute(
+            "UPDATE labels SET manifest_state = ?, updated_at = ? WHERE manifest_id = ? AND manifest_state = ?",
+            (REVIEW, now, manifest_id, SUBMITTED),
+        )
+        self._conn.execute(
+            "UPDATE manifests SET state = ?, error = ?, updated_at = ? WHERE id = ? AND state = ?", (REVIEW, error, now, manifest_id, SUBMITTED)
+        )
+
+    def begin_manifest(
+        self,
+        mail_date: str,
+        origin_zip: Optional[str] = None,
+        mid: Optional[str] = None,
+        mail_class: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> Optional[Tuple[int, List[Dict[str, Any]]]]:
+        """Claim the day's unmanifested labels for one SCAN form: ``(manifest ID, labels[] items)``, or None when
+        every label already is (or is being) manifested.
+
+        Claimed labels are ``submitted`` until ``complete_manifest`` or ``fail_manifest``, so a later close
+        the same day only picks up labels bought since. Manifests left submitted by a dead run are held for review
+        first; their labels are not claimed again.
+        """
+        query, params = self._select(
+            limit, {"state": UNMANIFESTED, "mail_date": mail_date, "origin_zip": origin_zip, "mid": mid, "mail_class": mail_class}
+        )
+
+        def claim() -> Optional[Tuple[int, List[Dict[str, Any]]]]:
+            now = self.clock()
+            stale = self._conn.execute(
+                "SELECT id FROM manifests WHERE state = ? AND updated_at <= ?", (SUBMITTED, now - self.in_flight_timeout)
+            ).fetchall()
+            for (manifest_id,) in stale:
+                self._hold(manifest_id, "abandoned in flight; check whether its SCAN form was created", now)
+            entries = [dict(row) for row in self._conn.execute(query, params)]
+            if not entries:
+                return None
+            cursor = self._conn.execute(
+                "INSERT INTO manifests (mail_date, origin_zip, mid, state, labels, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (mail_date, origin_zip, mid, SUBMITTED, len(entries), now, now),
+            )
+            manifest_id = cursor.lastrowid
+            self._conn.executemany(
+                "UPDATE labels SET manifest_state = ?, manifest_id = ?, updated_at = ? WHERE key = ?",
+                [(SUBMITTED, manifest_id, now, entry["key"]) for entry in entries],
+            )
+            return manifest_id, [scan_form_label(entry) for entry in entries]
+
+        return self._transaction(claim)
+
+    def complete_manifest(self, manifest_id: int, scan_form: Optional[str]) -> None:
+        """The SCAN form was created: its labels are ``manifested`` and map to ``scan_form``."""
+
+        def complete() -> None:
+            now = self.clock()
+            self._conn.execute(
+                "UPDATE labels SET manifest_state = ?, scan_form = ?, updated_at = ? WHERE manifest_id = ?",
+                (MANIFESTED, scan_form, now, manifest_id),
+            )
+            self._conn.execute(
+                "UPDATE manifests SET state = ?, scan_form = ?, error = NULL, updated_at = ? WHERE id = ?",
+                (COMPLETED, scan_form, now, manifest_id),
+            )
+
+        self._transaction(complete)
+
+    def fail_manifest(self, manifest_id: int, error: str) -> None:
+        """The SCAN form request failed: its labels go back into the next close.
+
+        Also settles a manifest in review once USPS shows no form was created for it.
+        """
+        self._transaction(lambda: self._release(manifest_id, error, self.clock()))
+
+    def review_manifest(self, manifest_id: int, error: str) -> None:
+        """The SCAN form request may have succeeded (timeout, 5xx, dropped connection): hold its labels for review.
+
+        Settle it with ``complete_manifest`` once the form is found, or ``fail_manifest`` once it is known not to exist.
+        """
+        self._transaction(lambda: self._hold(manifest_id, error, self.clock()))
+
+    def manifests(self, mail_date: Optional[str] = None, state: Optional[str] = None) -> List[Dict[str, Any]]:
+        """SCAN form closes, oldest first, optionally for one mail date and state (e.g. ``review``)."""
+        clauses = [(column, value) for column, value in (("mail_date", mail_date), ("state", state)) if value is not None]
+        where = " WHERE " + " AND ".join(f"{column} = ?" for column, _ in clauses) if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(f"SELECT * FROM manifests{where} ORDER BY id", [value for _, value in clauses]).fetchall()
+        return [dict(row) for row in rows]
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute("SELECT manifest_state, COUNT(*) FROM labels GROUP BY manifest_state").fetchall()
+            closes = self._conn.execute("SELECT state, COUNT(*) FROM manifests GROUP BY state").fetchall()
+        return {
+            "path": self.path,
+            "states": {state: count for state, count in rows},
+            "manifests": {state: count for state, count in closes},
+            **self.counts,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def build_label_registry(env: Mapping[str, str], path: Optional[str] = None) -> Optional[LabelRegistry]:
+    """Registry at ``path`` or ``USPS_LABEL_REGISTRY`` (env file, then process environment); None when neither is set."""
+    path = path or {**os.environ, **env}.get("USPS_LABEL_REGISTRY")
+    if not path:
+        return None
+    return LabelRegistry(path)
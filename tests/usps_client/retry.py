@@ -0,0 +1,298 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_BASE_DELAY = 0.25
+DEFAULT_MAX_DELAY = 20.0
+# A Retry-After longer than this is treated as "not within this run" and surfaced immediately.
+DEFAULT_MAX_RETRY_AFTER = 60.0
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+RETRYABLE_STATUSES = (500, 502, 503, 504)
+# Endpoints that create something billable or stateful; a 5xx or timeout may still have succeeded server-side.
+NON_IDEMPOTENT_PATHS = ("labels/v3/label", "international-labels/v3/international-label", "scan-forms/v3/scan-form")
+# Socket errors that prove the request never reached the server, so resending cannot double-charge.
+NOT_SENT_ERRORS = (ConnectionRefusedError,)
+
+
+class CircuitOpenError(urllib.error.URLError):
+    """Raised instead of calling an endpoint whose circuit breaker is open."""
+
+    def __init__(self, endpoint: str, retry_in: float):
+        super().__init__(f"circuit open for {endpoint}; retry in {retry_in:.1f}s")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+def endpoint_key(url: str) -> str:
+    parsed = urllib.parse.urlsplit(url)
+    return f"{parsed.hostname or ''}{parsed.path or '/'}"
+
+
+def is_idempotent(method: str, url: str) -> bool:
+    if method.upper() in ("GET", "HEAD", "OPTIONS"):
+        return True
+    path = urllib.parse.urlsplit(url).path.rstrip("/")
+    return not any(path.endswith(suffix) for suffix in NON_IDEMPOTENT_PATHS)
+
+
+def retry_after_seconds(headers: Any, now: Optional[float] = None) -> Optional[float]:
+    raw = headers.get("Retry-After") if headers is not None else None
+    if not raw:
+        return None
+    raw = raw.strip()
+    if raw.isdigit():
+        return float(raw)
+    try:
+        moment = parsedate_to_datetime(raw)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, moment.timestamp() - (now if now is not None else time.time()))
+
+
+class RetryPolicy:
+    """Which failures to retry and how long to wait, using decorrelated jitter between attempts."""
+
+    def __init__(
+        self,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        base_delay: float = DEFAULT_BASE_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        max_retry_after: float = DEFAULT_MAX_RETRY_AFTER,
+        rng: Optional[random.Random] = None,
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self._rng = rng or random.Random()
+
+    def next_delay(self, previous: float) -> float:
+        return min(self.max_delay, self._rng.uniform(self.base_delay, max(self.base_delay, previous * 3)))
+
+    def delay_for(self, method: str, url: str, exc: BaseException, previous: float) -> Optional[float]:
+        """Seconds to wait before retrying after ``exc``, or None when it must not be retried."""
+        if isinstance(exc, CircuitOpenError):
+            return None
+        if isinstance(exc, urllib.error.HTTPError):
+            if exc.code == 429:
+                # Throttled requests were rejected before processing, so even label calls may be resent.
+                wait = retry_after_seconds(exc.headers)
+                if wait is None:
+                    return self.next_delay(previous)
+                return wait if wait <= self.max_retry_after else None
+            if exc.code in RETRYABLE_STATUSES and is_idempotent(method, url):
+                return self.next_delay(previous)
+            return None
+        if isinstance(exc, urllib.error.URLError):
+            if is_idempotent(method, url) or isinstance(exc.reason, NOT_SENT_ERRORS):
+                return self.next_delay(previous)
+        return None
+
+
+def counts_as_failure(exc: BaseException) -> bool:
+    if isinstance(exc, CircuitOpenError):
+        return False
+    if isinstance(exc, urllib.error.HTTPError):
+        return exc.code in RETRYABLE_STATUSES
+    return isinstance(exc, urllib.error.URLError)
+
+
+class CircuitBreaker:
+    """Closed -> open after ``failure_threshold`` consecutive failures; one trial call is let through after ``reset_timeout``."""
+
+    def __init__(self, endpoint: str, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD, reset_timeout: float = DEFAULT_RESET_TIMEOUT, clock: Callable[[], float] = time.monotonic):
+        self.endpoint = endpoint
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if self.clock() - self.opened_at >= self.reset_timeout else "open"
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.opened_at is None:
+                return
+            waited = self.clock() - self.opened_at
+            if waited < self.reset_timeout or self._trial_in_flight:
+                raise CircuitOpenError(self.endpoint, max(0.0, self.reset_timeout - waited))
+            self._trial_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self._trial_in_flight = False
+
+    def record_neutral(self) -> None:
+        # A 4xx proves the endpoint is answering; release a half-open trial without counting a failure.
+        with self._lock:
+            if self._trial_in_flight:
+                self.failures = 0
+                self.opened_at = None
+                self._trial_in_flight = False
+
+
+# Called after every attempt with the URL, the attempt's round trip in seconds (None when nothing was exchanged) and its error.
+AttemptObserver = Callable[[str, Optional[float], Optional[BaseException]], None]
+
+
+def attempt_seconds(outcome: Any) -> Optional[float]:
+    """Round trip of one transport attempt from its ``timings``, excluding the wait for a pooled connection."""
+    timings = getattr(outcome, "timings", None)
+    if not isinstance(timings, dict) or not isinstance(timings.get("totalMs"), (int, float)):
+        return None
+    return max(0.0, timings["totalMs"] - (timings.get("queueMs") or 0.0)) / 1000
+
+
+class RetryEngine:
+    """Retry policy plus one circuit breaker per endpoint, shared by the sync and asyncio transports."""
+
+    def __init__(self, policy: Optional[RetryPolicy] = None, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD, reset_timeout: float = DEFAULT_RESET_TIMEOUT):
+        self.policy = policy or RetryPolicy()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._observers: List[AttemptObserver] = []
+        self._lock = threading.Lock()
+
+    def add_observer(self, observer: AttemptObserver) -> None:
+        with self._lock:
+            self._observers.append(observer)
+
+    def remove_observer(self, observer: AttemptObserver) -> None:
+        with self._lock:
+            if observer in self._observers:
+                self._observers.remove(observer)
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        key = endpoint_key(url)
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = self._breakers[key] = CircuitBreaker(key, self.failure_threshold, self.reset_timeout)
+            return breaker
+
+    def breaker_states(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {b.endpoint: {"state": b.state, "failures": b.failures} for b in breakers}
+
+    def _record(self, breaker: CircuitBreaker, exc: Optional[BaseException]) -> None:
+        if exc is None:
+            breaker.record_success()
+        elif counts_as_failure(exc):
+            breaker.record_failure()
+        elif not isinstance(exc, CircuitOpenError):
+            breaker.record_neutral()
+
+    def _notify(self, url: str, outcome: Any, exc: Optional[BaseException]) -> None:
+        with self._lock:
+            observers = list(self._observers)
+        seconds = attempt_seconds(outcome)
+        for observer in observers:
+            observer(url, seconds, exc)
+
+    def _admit(self, breaker: CircuitBreaker, url: str) -> None:
+        try:
+            breaker.before_call()
+        except CircuitOpenError as exc:
+            self._notify(url, None, exc)
+            raise
+
+    def call(self, method: str, url: str, send: Callable[[], T], sleep: Callable[[float], None] = time.sleep) -> T:
+        breaker = self.breaker(url)
+        delay = self.policy.base_delay
+        attempt = 1
+        while True:
+            self._admit(breaker, url)
+            try:
+                result = send()
+            except Exception as exc:
+                self._record(breaker, exc)
+                self._notify(url, exc, exc)
+                wait = self.policy.delay_for(method, url, exc, delay) if attempt < self.policy.max_attempts else None
+                if wait is None:
+                    raise
+                delay = max(wait, self.policy.base_delay)
+                sleep(wait)
+                attempt += 1
+                continue
+            self._record(breaker, None)
+            self._notify(url, result, None)
+            return result
+
+    async def call_async(self, method: str, url: str, send: Callable[[], Awaitable[T]]) -> T:
+        breaker = self.breaker(url)
+        delay = self.policy.base_delay
+        attempt = 1
+        while True:
+            self._admit(breaker, url)
+            try:
+                result = await send()
+            except Exception as exc:
+                self._record(breaker, exc)
+                self._notify(url, exc, exc)
+                wait = self.policy.delay_for(method, url, exc, delay) if attempt < self.policy.max_attempts else None
+                if wait is None:
+                    raise
+                delay = max(wait, self.policy.base_delay)
+                await asyncio.sleep(wait)
+                attempt += 1
+                continue
+            self._record(breaker, None)
+            self._notify(url, result, None)
+            return result
+
+
+_default_engine: Optional[RetryEngine] = None
+_default_lock = threading.Lock()
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, ""))
+    except ValueError:
+        return default
+
+
+def get_retry_engine() -> RetryEngine:
+    """Process-wide engine; USPS_RETRY_ATTEMPTS=1 disables retries, USPS_BREAKER_* tune the breakers."""
+    global _default_engine
+    with _default_lock:
+        if _default_engine is None:
+            policy = RetryPolicy(
+                max_attempts=int(_env_number("USPS_RETRY_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)),
+                max_delay=_env_number("USPS_RETRY_MAX_DELAY", DEFAULT_MAX_DELAY),
+            )
+            _default_engine = RetryEngine(
+                policy,
+                failure_threshold=int(_env_number("USPS_BREAKER_THRESHOLD", DEFAULT_FAILURE_THRESHOLD)),
+                reset_timeout=_env_number("USPS_BREAKER_RESET", DEFAULT_RESET_TIMEOUT),
+            )
+        return _default_engine
@@ -0,0 +1,195 @@
+import gzip
+import io
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import IO, Any, Dict, List, Mapping, Optional
+
+from .config import parse_int
+
+DEFAULT_FSYNC_EVERY = 64
+DEFAULT_FSYNC_INTERVAL = 1.0
+# zlib level 6 compresses NDJSON nearly as well as 9 at a fraction of the CPU.
+GZIP_LEVEL = 6
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def _open_compressed(raw: IO[bytes], compression: Optional[str]) -> IO[bytes]:
+    if compression is None:
+        return raw
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=GZIP_LEVEL)  # type: ignore[return-value]
+    if compression == "zstd":
+        try:
+            import zstandard  # type: ignore[import-not-found]
+        except ImportError as exc:
+            raise ValueError("zstd compression requires the 'zstandard' package") from exc
+        return zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+    raise ValueError(f"Unknown compression '{compression}'; choose gzip or zstd")
+
+
+def open_text(path: Path) -> IO[str]:
+    """Read a plain, gzip (``.gz``) or zstd (``.zst``) text file, such as a sink segment."""
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    if path.suffix == ".zst":
+        try:
+            import zstandard  # type: ignore[import-not-found]
+        except ImportError as exc:
+            raise ValueError("Reading .zst files requires the 'zstandard' package") from exc
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True), encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+class NdjsonSink:
+    """Append-only newline-delimited JSON, one compact record per call, written as each call finishes.
+
+    Records are flushed and fsynced together every ``fsync_every`` records or ``fsync_interval`` seconds,
+    so a crash loses at most one batch while the sink never holds more than one record in memory. With
+    ``max_bytes`` the file is closed once it reaches that size on disk and the next record starts a new
+    segment (``results.jsonl``, ``results.0001.jsonl``, ...). Compressed segments are gzip or zstd
+    streams that stay readable up to the last sync.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        compression: Optional[str] = None,
+        max_bytes: Optional[int] = None,
+        fsync_every: int = DEFAULT_FSYNC_EVERY,
+        fsync_interval: float = DEFAULT_FSYNC_INTERVAL,
+        append: bool = False,
+    ):
+        suffix = COMPRESSION_SUFFIXES.get(compression or "", "")
+        path = Path(path)
+        if suffix and not path.name.endswith(suffix):
+            path = path.with_name(path.name + suffix)
+        self.path = path
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.fsync_every = max(1, fsync_every)
+        self.fsync_interval = fsync_interval
+        self.append = append
+        self.segments: List[Path] = []
+        self.records = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._raw: Optional[IO[bytes]] = None
+        self._stream: Optional[IO[bytes]] = None
+        self._lock = threading.Lock()
+        # Open eagerly so a bad path or missing codec fails before any request is sent.
+        self._open_segment()
+
+    def _segment_path(self, index: int) -> Path:
+        if index == 0:
+            return self.path
+        name = self.path.name
+        stem, dot, rest = name.partition(".")
+        return self.path.with_name(f"{stem}.{index:04d}{dot}{rest}")
+
+    def _open_segment(self) -> None:
+        segment = self._segment_path(len(self.segments))
+        segment.parent.mkdir(parents=True, exist_ok=True)
+        self._raw = open(segment, "ab" if self.append else "wb")
+        self._stream = _open_compressed(self._raw, self.compression)
+        self.segments.append(segment)
+
+    def _close_segment(self) -> None:
+        if self._stream is None or self._raw is None:
+            return
+        if self._stream is not self._raw:
+            self._stream.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+        self._stream = self._raw = None
+        self._unsynced = 0
+
+    def _sync(self) -> None:
+        assert self._stream is not None and self._raw is not None
+        self._stream.flush()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def write(self, record: Mapping[str, Any]) -> None:
+        line = (json.dumps(record, separators=(",", ":"), default=str) + "\n").encode("utf-8")
+        with self._lock:
+            if self._stream is None:
+                self._open_segment()
+            assert self._stream is not None and self._raw is not None
+            self._stream.write(line)
+            self.records += 1
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+                if self.max_bytes and self._raw.tell() >= self.max_bytes:
+                    self._close_segment()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._stream is not None and self._unsynced:
+                self._sync()
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_segment()
+
+    def __enter__(self) -> "NdjsonSink":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def call_summary(result: Any) -> Any:
+    """The scalar fields of a call result (status, error, saved paths), without headers, bodies or timings."""
+    if not isinstance(result, dict):
+        return result
+    return {key: value for key, value in result.items() if not isinstance(value, (dict, list))}
+
+
+def record_call(sink: Optional[NdjsonSink], call: str, result: Any) -> Any:
+    """Append ``{"call", "timestamp", **result}`` for a finished harness call and return what the final document keeps.
+
+    Without a sink (or result) nothing is written and ``result`` is returned unchanged; otherwise the full record
+    is on disk and only ``call_summary(result)`` is returned, so a harness holds no response bodies until exit.
+    """
+    if sink is None or result is None:
+        return result
+    record: Dict[str, Any] = {"call": call, "timestamp": datetime.utcnow().isoformat() + "Z"}
+    if isinstance(result, dict):
+        record.update(result)
+    else:
+        record["result"] = result
+    sink.write(record)
+    return call_summary(result)
+
+
+def open_sink(path: Path, env: Mapping[str, str], append: bool = False) -> NdjsonSink:
+    """``NdjsonSink`` at ``path`` tuned by ``USPS_RESULTS_COMPRESSION`` (gzip/zstd), ``USPS_RESULTS_ROTATE_MB``,
+    ``USPS_RESULTS_FSYNC_EVERY`` and ``USPS_RESULTS_FSYNC_INTERVAL``."""
+    compression = (env.get("USPS_RESULTS_COMPRESSION") or "").strip().lower() or None
+    if compression in ("none", "off"):
+        compression = None
+    rotate_mb = parse_int(env.get("USPS_RESULTS_ROTATE_MB"))
+    interval = env.get("USPS_RESULTS_FSYNC_INTERVAL")
+    return NdjsonSink(
+        path,
+        compression=compression,
+        max_bytes=rotate_mb * 1024 * 1024 if rotate_mb else None,
+        fsync_every=parse_int(env.get("USPS_RESULTS_FSYNC_EVERY")) or DEFAULT_FSYNC_EVERY,
+        fsync_interval=float(interval) if interval else DEFAULT_FSYNC_INTERVAL,
+        append=append,
+    )
+
+
+def build_sink(env: Mapping[str, str]) -> Optional[NdjsonSink]:
+    """Per-call log for the single-run harnesses, appended to ``USPS_RESULTS_SINK``; None when unset."""
+    if not env.get("USPS_RESULTS_SINK"):
+        return None
+    return open_sink(Path(env["USPS_RESULTS_SINK"]), env, append=True)
@@ -0,0 +1,353 @@
+import hashlib
+import http.client
+import io
+import json
+import os
+import queue
+import socket
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .metrics import get_metrics
+from .ratelimit import RateLimiter, get_rate_limiter
+from .records import compact_headers
+from .retry import RetryEngine, endpoint_key, get_retry_engine, is_idempotent
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_IDLE_TIMEOUT = 50.0
+STREAM_CHUNK_SIZE = 64 * 1024
+# Errors raised when a pooled keep-alive socket was closed by the server while idle.
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+
+class TransportResponse:
+    def __init__(self, status: int, reason: str, headers: http.client.HTTPMessage, body: bytes):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        # Set instead of ``body`` when the payload was streamed to disk.
+        self.saved_path: Optional[Path] = None
+        self.size = len(body)
+        self.sha256: Optional[str] = None
+        # Per-phase milliseconds (queueMs, dnsMs, connectMs, tlsMs, sendMs, ttfbMs, bodyMs, totalMs) plus "reused".
+        self.timings: Dict[str, Any] = {}
+
+
+def stream_body_to_file(response: http.client.HTTPResponse, path: Path) -> Tuple[int, str]:
+    """Copy a response body to ``path`` in fixed-size chunks, hashing as it goes; returns (size, sha256)."""
+    digest = hashlib.sha256()
+    buffer = bytearray(STREAM_CHUNK_SIZE)
+    view = memoryview(buffer)
+    size = 0
+    part_path = path.with_name(path.name + ".part")
+    try:
+        with open(part_path, "wb") as handle:
+            while True:
+                count = response.readinto(view)
+                if not count:
+                    break
+                chunk = view[:count]
+                digest.update(chunk)
+                handle.write(chunk)
+                size += count
+        os.replace(part_path, path)
+    except BaseException:
+        try:
+            os.unlink(part_path)
+        except OSError:
+            pass
+        raise
+    return size, digest.hexdigest()
+
+
+def _elapsed_ms(start: float, end: float) -> float:
+    return round((end - start) * 1000, 3)
+
+
+def _open_timed_socket(conn: http.client.HTTPConnection) -> None:
+    """Resolve and connect separately so DNS and TCP connect time can be told apart."""
+    started = time.monotonic()
+    addresses = socket.getaddrinfo(conn.host, conn.port, 0, socket.SOCK_STREAM)
+    resolved = time.monotonic()
+    last_error: Optional[OSError] = None
+    for family, socktype, proto, _, address in addresses:
+        sock = socket.socket(family, socktype, proto)
+        try:
+            sock.settimeout(conn.timeout)
+            sock.connect(address)
+        except OSError as exc:
+            sock.close()
+            last_error = exc
+            continue
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn.sock = sock
+        conn.connect_timings = {"dnsMs": _elapsed_ms(started, resolved), "connectMs": _elapsed_ms(resolved, time.monotonic())}
+        return
+    raise last_error or OSError(f"getaddrinfo returned no addresses for {conn.host}")
+
+
+class _TimedHTTPConnection(http.client.HTTPConnection):
+    connect_timings: Dict[str, float] = {}
+
+    def connect(self) -> None:
+        _open_timed_socket(self)
+
+
+class _TimedHTTPSConnection(http.client.HTTPSConnection):
+    connect_timings: Dict[str, float] = {}
+
+    def connect(self) -> None:
+        _open_timed_socket(self)
+        started = time.monotonic()
+        self.sock = self._context.wrap_socket(self.sock, server_hostname=self.host)
+        self.connect_timings["tlsMs"] = _elapsed_ms(started, time.monotonic())
+
+
+class _HostPool:
+    def __init__(self, scheme: str, host: str, port: Optional[int], size: int, idle_timeout: float, ssl_context: Optional[ssl.SSLContext]):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.idle_timeout = idle_timeout
+        self.ssl_context = ssl_context
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle: "queue.LifoQueue[Tuple[http.client.HTTPConnection, float]]" = queue.LifoQueue()
+
+    def _new_connection(self, timeout: float) -> http.client.HTTPConnection:
+        if self.scheme == "https":
+            return _TimedHTTPSConnection(self.host, self.port, timeout=timeout, context=self.ssl_context)
+        return _TimedHTTPConnection(self.host, self.port, timeout=timeout)
+
+    def acquire(self, timeout: float) -> Tuple[http.client.HTTPConnection, bool, float]:
+        """``(connection, reused, queueMs)``; queueMs is the wait for a free pool slot, as in the asyncio pool."""
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=timeout):
+            raise urllib.error.URLError(f"timed out waiting for a pooled connection to {self.host}")
+        now = time.monotonic()
+        waited = _elapsed_ms(started, now)
+        while True:
+            try:
+                conn, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                return self._new_connection(timeout), False, waited
+            if conn.sock is not None and now - idle_since < self.idle_timeout:
+                conn.timeout = timeout
+                conn.sock.settimeout(timeout)
+                return conn, True, waited
+            conn.close()
+
+    def release(self, conn: http.client.HTTPConnection, reusable: bool) -> None:
+        try:
+            if reusable and conn.sock is not None:
+                self._idle.put((conn, time.monotonic()))
+            else:
+                conn.close()
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.close()
+
+
+class HttpTransport:
+    """Thread-safe HTTP/1.1 client keeping a bounded pool of keep-alive connections per host."""
+
+    def __init__(
+        self,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+        ssl_context: Optional[ssl.SSLContext] = None,
+        retry_engine: Optional[RetryEngine] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
+        self.pool_size = max(1, pool_size)
+        self.idle_timeout = idle_timeout
+        self.ssl_context = ssl_context or ssl.create_default_context()
+        self.retry_engine = retry_engine or get_retry_engine()
+        # None means the process-wide limiter, looked up per call so configure_rate_limiter() takes effect.
+        self.rate_limiter = rate_limiter
+        self._pools: Dict[Tuple[str, str, Optional[int]], _HostPool] = {}
+        self._lock = threading.Lock()
+
+    def _pool_for(self, parsed: urllib.parse.SplitResult) -> _HostPool:
+        scheme = parsed.scheme.lower()
+        if scheme not in ("http", "https"):
+            raise urllib.error.URLError(f"unsupported URL scheme '{parsed.scheme}'")
+        key = (scheme, parsed.hostname or "", parsed.port)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = _HostPool(scheme, key[1], key[2], self.pool_size, self.idle_timeout, self.ssl_context)
+                self._pools[key] = pool
+            return pool
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        body: Optional[bytes] = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: float = 15,
+        stream_to: Optional[Callable[[http.client.HTTPMessage], Optional[Path]]] = None,
+    ) -> TransportResponse:
+        """Send a request; when ``stream_to`` returns a path for a 2xx response, the body is written there instead of buffered.
+
+        Every attempt first takes a token from the endpoint's rate-limit bucket. Failures go through the retry
+        engine: idempotent calls are retried on 5xx/connection errors, any call on 429, and an endpoint whose
+        circuit breaker is open fails fast with ``CircuitOpenError``. Phase timings of the final attempt are on
+        ``TransportResponse.timings`` (or ``HTTPError.timings``) and feed the per-endpoint histograms in
+        ``usps_client.metrics``.
+        """
+        return self.retry_engine.call(method, url, lambda: self._send(method, url, body, headers, timeout, stream_to))
+
+    def _send(
+        self,
+        method: str,
+        url: str,
+        body: Optional[bytes],
+        headers: Optional[Dict[str, str]],
+        timeout: float,
+        stream_to: Optional[Callable[[http.client.HTTPMessage], Optional[Path]]],
+    ) -> TransportResponse:
+        (self.rate_limiter or get_rate_limiter()).acquire(url)
+        parsed = urllib.parse.urlsplit(url)
+        pool = self._pool_for(parsed)
+        target = parsed.path or "/"
+        if parsed.query:
+            target = f"{target}?{parsed.query}"
+        hdrs = {"Connection": "keep-alive"}
+        if headers:
+            hdrs.update(headers)
+
+        while True:
+            queued = time.monotonic()
+            conn, reused, queue_ms = pool.acquire(timeout)
+            acquired = time.monotonic()
+            conn.connect_timings = {}
+            reusable = False
+            response: Optional[http.client.HTTPResponse] = None
+            saved: Optional[Tuple[Path, int, str]] = None
+            written = False
+            try:
+                conn.request(method, target, body=body, headers=hdrs)
+                written = True
+                sent = time.monotonic()
+                response = conn.getresponse()
+                first_byte = time.monotonic()
+                destination = stream_to(response.headers) if stream_to and 200 <= response.status < 300 else None
+                if destination is not None:
+                    size, sha256 = stream_body_to_file(response, destination)
+                    saved = (destination, size, sha256)
+                    payload = b""
+                else:
+                    payload = response.read()
+                finished = time.monotonic()
+                reusable = not response.will_close
+            except STALE_CONNECTION_ERRORS as exc:
+                # A reused socket the server closed while idle fails on write or before the status line. Once the
+                # request is fully written the server may have acted on it, so only idempotent calls are resent.
+                if reused and response is None and (not written or is_idempotent(method, url)):
+                    continue
+                raise urllib.error.URLError(exc) from exc
+            except (OSError, http.client.HTTPException) as exc:
+                raise urllib.error.URLError(exc) from exc
+            finally:
+                pool.release(conn, reusable)
+            break
+
+        connect_ms = sum(conn.connect_timings.values())
+        timings: Dict[str, Any] = {"reused": reused, "queueMs": queue_ms, **conn.connect_timings}
+        timings.update(
+            sendMs=round(max(0.0, _elapsed_ms(acquired, sent) - connect_ms), 3),
+            ttfbMs=_elapsed_ms(sent, first_byte),
+            bodyMs=_elapsed_ms(first_byte, finished),
+            totalMs=_elapsed_ms(queued, finished),
+        )
+        get_metrics().record(endpoint_key(url), timings)
+
+        if not 200 <= response.status < 300:
+            # Mirror urllib.request.urlopen so callers keep their HTTPError handling.
+            error = urllib.error.HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(payload))
+            error.timings = timings  # type: ignore[attr-defined]
+            raise error
+        result = TransportResponse(response.status, response.reason, response.headers, payload)
+        result.timings = timings
+        if saved is not None:
+            result.saved_path, result.size, result.sha256 = saved
+        return result
+
+    def close(self) -> None:
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.close()
+
+
+_default_transport: Optional[HttpTransport] = None
+_default_lock = threading.Lock()
+
+
+def get_transport() -> HttpTransport:
+    global _default_transport
+    with _default_lock:
+        if _default_transport is None:
+            pool_size = os.environ.get("USPS_HTTP_POOL_SIZE", "")
+            _default_transport = HttpTransport(pool_size=int(pool_size) if pool_size.isdigit() else DEFAULT_POOL_SIZE)
+        return _default_transport
+
+
+def configure_transport(pool_size: int = DEFAULT_POOL_SIZE, idle_timeout: float = DEFAULT_IDLE_TIMEOUT) -> HttpTransport:
+    global _default_transport
+    with _default_lock:
+        if _default_transport is not None:
+            _default_transport.close()
+        _default_transport = HttpTransport(pool_size=pool_size, idle_timeout=idle_timeout)
+        return _default_transport
+
+
+def decode_json_body(body_bytes: bytes) -> Any:
+    body_text = body_bytes.decode("utf-8") if body_bytes else ""
+    try:
+        return json.loads(body_text) if body_text else {}
+    except json.JSONDecodeError:
+        return {"raw": body_text}
+
+
+def http_post_form(url: str, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None, timeout: int = 15):
+    data = urllib.parse.urlencode(payload).encode("utf-8")
+    hdrs = {"Content-Type": "application/x-www-form-urlencoded", "Accept": "application/json"}
+    if headers:
+        hdrs.update(headers)
+    response = get_transport().request("POST", url, body=data, headers=hdrs, timeout=timeout)
+    return {
+        "status": response.status,
+        "headers": compact_headers(response.headers),
+        "body": decode_json_body(response.body),
+        "timings": response.timings,
+    }
+
+
+def http_post_json(url: str, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None, timeout: int = 15):
+    data = json.dumps(payload).encode("utf-8")
+    hdrs = {"Content-Type": "application/json", "Accept": "application/json"}
+    if headers:
+        hdrs.update(headers)
+    response = get_transport().request("POST", url, body=data, headers=hdrs, timeout=timeout)
+    return {
+        "status": response.status,
+        "headers": compact_headers(response.headers),
+        "body": decode_json_body(response.body),
+        "timings": response.timings,
+    }